@@ -0,0 +1,85 @@
+import multiprocessing
+import random
+import resource
+import statistics
+import time
+import uuid
+
+from argparse import ArgumentParser
+
+from api.models import Task
+from api.storage import TieredStore
+
+
+def rss_megabytes():
+    # ru_maxrss is in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def read_latencies(store, uuids, reads, hot_fraction):
+    # Most reads go to a small set of recent tasks, like real traffic.
+    hot = uuids[-max(int(len(uuids) * hot_fraction), 1):]
+    latencies = []
+    for _ in range(reads):
+        uuid_ = random.choice(hot) if random.random() < 0.9 else random.choice(uuids)
+        start = time.perf_counter()
+        store[uuid_]
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return latencies
+
+
+def run(tasks, capacity, reads, directory, results):
+    store = {} if capacity is None else TieredStore(capacity, directory)
+    uuids = [uuid.uuid4() for _ in range(tasks)]
+
+    start = time.perf_counter()
+    for index, uuid_ in enumerate(uuids):
+        # Older tasks are mostly completed.
+        store[uuid_] = Task(
+            description=f'benchmark task {index} ' + 'x' * 200,
+            completed=index < tasks * 0.8,
+        )
+    load_seconds = time.perf_counter() - start
+
+    latencies = read_latencies(store, uuids, reads, 0.05)
+    start = time.perf_counter()
+    if capacity is None:
+        open_tasks = sum(1 for item in store.values() if not item.completed)
+    else:
+        open_tasks = sum(1 for _ in store.items(completed=False))
+    scan_seconds = time.perf_counter() - start
+
+    results.put({
+        'rss_mb': rss_megabytes(),
+        'load_seconds': load_seconds,
+        'read_p50_us': statistics.median(latencies) * 1e6,
+        'read_p99_us': latencies[int(len(latencies) * 0.99)] * 1e6,
+        'open_scan_seconds': scan_seconds,
+        'open_tasks': open_tasks,
+    })
+
+
+def main():
+    parser = ArgumentParser(description='Compare the plain dict with the tiered task store.')
+    parser.add_argument('--tasks', type=int, default=1000000, help='Tasks loaded')
+    parser.add_argument('--capacity', type=int, default=100000, help='Tasks kept in memory')
+    parser.add_argument('--reads', type=int, default=100000, help='Point reads timed')
+    parser.add_argument('--dir', default=None, help='Directory for the cold segment')
+    args = parser.parse_args()
+
+    # Each store runs in its own process so the RSS figures do not mix.
+    for name, capacity in (('dict', None), ('tiered', args.capacity)):
+        results = multiprocessing.Queue()
+        process = multiprocessing.Process(
+            target=run,
+            args=(args.tasks, capacity, args.reads, args.dir, results),
+        )
+        process.start()
+        result = results.get()
+        process.join()
+        print(name, ' '.join(f'{key}={value:.2f}' for key, value in result.items()))
+
+
+if __name__ == '__main__':
+    main()
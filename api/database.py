@@ -1,9 +1,10 @@
 import uuid
 
 from .models import Task
+from .storage import create_store
 
 class DBSession:
-    tasks = {}
+    tasks = create_store()
     def __init__(self):
         self.tasks = DBSession.tasks
 
@@ -11,25 +12,19 @@ class DBSession:
         """
             This method returns the task list
         """
-        return self.tasks
+        return dict(self.tasks.items())
 
     def read_completed_tasks(self):
         """
             This method returns the list of completed tasks
         """
-        return {
-            uuid_: item
-            for uuid_, item in self.tasks.items() if item.completed == True
-        }
+        return dict(self.tasks.items(completed=True))
 
     def read_incompleted_tasks(self):
         """
             This method returns the list of incompleted tasks
         """
-        return {
-            uuid_: item
-            for uuid_, item in self.tasks.items() if item.completed == False
-        }
+        return dict(self.tasks.items(completed=False))
 
     def create_task(self, uuid_: uuid.UUID, item: Task):
         """
@@ -55,7 +50,8 @@ class DBSession:
             This method partially updates the task by id
         """
         update_data = item.dict(exclude_unset=True)
-        self.tasks[uuid_] = self.tasks[uuid_].copy(update=update_data)
+        with self.tasks.lock:
+            self.tasks[uuid_] = self.tasks[uuid_].copy(update=update_data)
 
     def delete_task_from_uuid(self, uuid_: uuid.UUID):
         """
@@ -67,7 +63,7 @@ class DBSession:
         """
             This method checks if uuid is in the db
         """
-        if uuid_ in self.tasks.keys():
+        if uuid_ in self.tasks:
             return True
         return False
 
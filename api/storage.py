@@ -0,0 +1,352 @@
+import collections
+import contextlib
+import mmap
+import os
+import tempfile
+import threading
+
+from collections.abc import MutableMapping
+
+from .models import Task
+
+
+class SegmentStore:
+    """
+        Append-only file of serialized tasks, read back through mmap.
+
+        Only the offset, length and completed flag of each task stay in
+        memory. Overwritten and deleted records are garbage until the segment
+        is compacted.
+    """
+    def __init__(self, directory=None, compact_bytes=64 * 1024 * 1024):
+        self.directory = directory
+        self.compact_bytes = compact_bytes
+        self.index = {}
+        self.live_bytes = 0
+        self.dead_bytes = 0
+        self.__lock = threading.Lock()
+        self.__file = tempfile.TemporaryFile(dir=directory)
+        self.__map = None
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, uuid_):
+        return uuid_ in self.index
+
+    def put(self, uuid_, item: Task):
+        """
+            This method appends the task to the segment
+        """
+        data = item.json().encode()
+        with self.__lock:
+            offset = self.__file.seek(0, os.SEEK_END)
+            self.__file.write(data)
+        self.discard(uuid_)
+        self.index[uuid_] = (offset, len(data), item.completed)
+        self.live_bytes += len(data)
+
+    def get(self, uuid_):
+        """
+            This method reads the task back from the segment
+        """
+        return self.read(self.index[uuid_])
+
+    def read(self, entry):
+        """
+            This method decodes the record an index entry points to
+        """
+        offset, length, _ = entry
+        with self.__lock:
+            data = self.__view(offset, length)
+        return Task.parse_raw(data)
+
+    def discard(self, uuid_):
+        """
+            This method forgets the task, leaving its record as garbage
+        """
+        entry = self.index.pop(uuid_, None)
+        if entry is not None:
+            self.live_bytes -= entry[1]
+            self.dead_bytes += entry[1]
+
+    def keys(self, completed=None):
+        """
+            This method returns the uuids in the segment, optionally only
+            those with the given completed flag
+        """
+        return [
+            uuid_ for uuid_, (_, _, item_completed) in self.index.copy().items()
+            if completed is None or item_completed == completed
+        ]
+
+    def wants_compaction(self):
+        return self.dead_bytes > max(self.live_bytes, self.compact_bytes)
+
+    def compact(self):
+        """
+            This method rewrites the live records into a new segment
+        """
+        with self.__lock:
+            self.__view(0, 0)
+            old_map = self.__map
+            new_file = tempfile.TemporaryFile(dir=self.directory)
+            index = {}
+            for uuid_, (offset, length, completed) in self.index.items():
+                index[uuid_] = (new_file.seek(0, os.SEEK_END), length, completed)
+                new_file.write(old_map[offset:offset + length])
+            self.__close_map()
+            self.__file.close()
+            self.__file = new_file
+            self.index = index
+            self.live_bytes = sum(length for _, length, _ in index.values())
+            self.dead_bytes = 0
+
+    def close(self):
+        with self.__lock:
+            self.__close_map()
+            self.__file.close()
+
+    def __view(self, offset, length):
+        self.__file.flush()
+        size = self.__file.seek(0, os.SEEK_END)
+        if self.__map is None or len(self.__map) < max(offset + length, size, 1):
+            # The map is grown lazily, when a read goes past its end.
+            self.__close_map()
+            if size:
+                self.__map = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+        return b'' if self.__map is None else self.__map[offset:offset + length]
+
+    def __close_map(self):
+        if self.__map is not None:
+            self.__map.close()
+        self.__map = None
+
+
+class Snapshot:
+    """
+        Read-only view of a TieredStore as of one version.
+
+        Values come from the tiers unless a later write recorded the value
+        this version had in the undo log.
+    """
+    def __init__(self, store, version, undo):
+        self.version = version
+        self.__store = store
+        self.__undo = undo
+
+    def items(self, completed=None):
+        """
+            This method returns the tasks of the snapshot, optionally only
+            those with the given completed flag
+        """
+        hot, cold = self.__store.tier_copies()
+        undo = self.__undo.copy()
+        items = []
+        for uuid_, item in hot:
+            item = self.__at_version(uuid_, item, undo)
+            if item is not None and (completed is None or item.completed == completed):
+                items.append((uuid_, item))
+        for uuid_, entry in cold.items():
+            if uuid_ in undo or completed is None or entry[2] == completed:
+                item = self.__at_version(uuid_, entry, undo)
+                if item is not None and (completed is None or item.completed == completed):
+                    items.append((uuid_, item))
+
+        # Tasks deleted or moved between tiers since the snapshot was taken.
+        seen = {uuid_ for uuid_, _ in hot}.union(cold)
+        for uuid_ in undo.keys() - seen:
+            item = self.__at_version(uuid_, None, undo)
+            if item is not None and (completed is None or item.completed == completed):
+                items.append((uuid_, item))
+        return items
+
+    def __at_version(self, uuid_, current, undo):
+        for version, previous in undo.get(uuid_, ()):
+            if version > self.version:
+                return previous
+        if isinstance(current, tuple):
+            return self.__store.cold.read(current)
+        return current
+
+
+class TieredStore(MutableMapping):
+    """
+        Task mapping that keeps at most `capacity` tasks in memory.
+
+        Least recently used tasks spill to a SegmentStore, completed ones
+        before open ones, and are paged back in when they are read.
+
+        Writers are serialized by `lock`. Listings read a Snapshot without
+        taking it: each write first records the value it replaces in an undo
+        log under the next version, then changes the tiers, then publishes
+        the version. Undo entries are dropped once no snapshot older than
+        them is pinned.
+    """
+    def __init__(self, capacity=100000, directory=None, cold=None):
+        self.capacity = capacity
+        self.cold = cold if cold is not None else SegmentStore(directory)
+        self.lock = threading.RLock()
+        self.version = 0
+        # Values live in a plain dict, which snapshots can copy in one step;
+        # the OrderedDicts only keep the recency order of each tier.
+        self.__hot = {}
+        self.__open = collections.OrderedDict()
+        self.__completed = collections.OrderedDict()
+        self.__moves = 0
+        self.__undo = {}
+        self.__undo_order = collections.deque()
+        self.__pins = collections.Counter()
+        self.__pin_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__hot) + len(self.cold)
+
+    def __contains__(self, uuid_):
+        if uuid_ in self.__hot or uuid_ in self.cold:
+            return True
+        # The task may be moving between tiers.
+        with self.lock:
+            return uuid_ in self.__hot or uuid_ in self.cold
+
+    def __iter__(self):
+        return iter([uuid_ for uuid_, _ in self.items()])
+
+    def __getitem__(self, uuid_):
+        item = self.__hot.get(uuid_)
+        if item is None:
+            with self.lock:
+                item = self.__hot.get(uuid_)
+                if item is None:
+                    item = self.cold.get(uuid_)
+                    self.__promote(uuid_, item)
+        try:
+            self.__recency(item).move_to_end(uuid_)
+        except KeyError:
+            # Overwritten or evicted since it was read.
+            pass
+        return item
+
+    def __setitem__(self, uuid_, item):
+        with self.lock:
+            self.__write(uuid_, item)
+
+    def __delitem__(self, uuid_):
+        with self.lock:
+            if uuid_ not in self:
+                raise KeyError(uuid_)
+            self.__write(uuid_, None)
+
+    @property
+    def undo_size(self):
+        return len(self.__undo_order)
+
+    @contextlib.contextmanager
+    def snapshot(self):
+        """
+            This method pins the current version for the duration of the
+            block and yields a Snapshot of it
+        """
+        with self.__pin_lock:
+            version = self.version
+            self.__pins[version] += 1
+        try:
+            yield Snapshot(self, version, self.__undo)
+        finally:
+            with self.__pin_lock:
+                self.__pins[version] -= 1
+                if not self.__pins[version]:
+                    del self.__pins[version]
+            with self.lock:
+                self.__reclaim()
+
+    def items(self, completed=None):
+        """
+            This method returns the tasks of both tiers as of one version,
+            without paging cold ones in, so full scans do not flush the hot set
+        """
+        with self.snapshot() as snapshot:
+            return snapshot.items(completed)
+
+    def tier_copies(self):
+        """
+            This method copies the hot items and the cold index. Copies that
+            overlap a move between tiers are retried, falling back to the
+            writer lock when moves keep coming
+        """
+        for _ in range(10):
+            moves = self.__moves
+            hot, cold = list(self.__hot.copy().items()), self.cold.index.copy()
+            if moves % 2 == 0 and moves == self.__moves:
+                return hot, cold
+        with self.lock:
+            return list(self.__hot.copy().items()), self.cold.index.copy()
+
+    def __recency(self, item):
+        return self.__completed if item.completed else self.__open
+
+    def __write(self, uuid_, item):
+        version = self.version + 1
+        previous = self.__hot.get(uuid_)
+        if previous is None and uuid_ in self.cold:
+            previous = self.cold.get(uuid_)
+        self.__undo[uuid_] = self.__undo.get(uuid_, ()) + ((version, previous), )
+        self.__undo_order.append((version, uuid_))
+
+        self.__hot.pop(uuid_, None)
+        self.__open.pop(uuid_, None)
+        self.__completed.pop(uuid_, None)
+        self.cold.discard(uuid_)
+        if item is not None:
+            self.__hot[uuid_] = item
+            self.__recency(item)[uuid_] = None
+        self.version = version
+
+        self.__evict()
+        self.__reclaim()
+
+    def __promote(self, uuid_, item):
+        # A move, not a write: snapshots see the same value either way, but
+        # must not copy the tiers halfway through it.
+        self.__moves += 1
+        self.__hot[uuid_] = item
+        self.__recency(item)[uuid_] = None
+        self.cold.discard(uuid_)
+        self.__moves += 1
+        self.__evict()
+
+    def __evict(self):
+        while len(self.__hot) > self.capacity:
+            recency = self.__completed if self.__completed else self.__open
+            uuid_, _ = recency.popitem(last=False)
+            self.__moves += 1
+            self.cold.put(uuid_, self.__hot[uuid_])
+            del self.__hot[uuid_]
+            self.__moves += 1
+
+    def __reclaim(self):
+        with self.__pin_lock:
+            oldest = min(self.__pins) if self.__pins else self.version
+            while self.__undo_order and self.__undo_order[0][0] <= oldest:
+                _, uuid_ = self.__undo_order.popleft()
+                entries = self.__undo[uuid_][1:]
+                if entries:
+                    self.__undo[uuid_] = entries
+                else:
+                    del self.__undo[uuid_]
+
+            # Snapshots hold offsets into the segment, so it is only
+            # rewritten while none is pinned.
+            if not self.__pins and self.cold.wants_compaction():
+                self.cold.compact()
+
+
+def create_store():
+    """
+        This function creates the task store, sized by the API_HOT_TASKS
+        environment variable and spilling to API_COLD_DIR
+    """
+    return TieredStore(
+        capacity=int(os.environ.get('API_HOT_TASKS', 100000)),
+        directory=os.environ.get('API_COLD_DIR'),
+    )
@@ -0,0 +1,144 @@
+import sys
+import threading
+import uuid
+
+from .models import Task
+from .storage import SegmentStore, TieredStore
+
+
+def create_tasks(store, count, completed=False):
+    uuids = [uuid.uuid4() for _ in range(count)]
+    for index, uuid_ in enumerate(uuids):
+        store[uuid_] = Task(description=f'task {index}', completed=completed)
+    return uuids
+
+def test_cold_tasks_spill_to_disk_and_page_back_in(tmp_path):
+    """
+        This test fills the store past its capacity and checks that the oldest
+        tasks moved to the segment and are read back unchanged
+    """
+    store = TieredStore(capacity=2, directory=str(tmp_path))
+    uuids = create_tasks(store, 5)
+    assert len(store) == 5
+    assert set(store.cold.keys()) == set(uuids[:3])
+
+    assert store[uuids[0]] == Task(description='task 0', completed=False)
+    assert uuids[0] not in store.cold
+    assert len(store.cold) == 3
+
+def test_completed_tasks_are_evicted_first(tmp_path):
+    """
+        This test checks that completed tasks leave memory before open ones,
+        even when they were used more recently
+    """
+    store = TieredStore(capacity=2, directory=str(tmp_path))
+    open_uuids = create_tasks(store, 2)
+    completed_uuids = create_tasks(store, 2, completed=True)
+    assert set(store.cold.keys()) == set(completed_uuids)
+    assert all(uuid_ in store for uuid_ in open_uuids + completed_uuids)
+
+def test_filtered_reads_cover_both_tiers(tmp_path):
+    """
+        This test checks that full and filtered listings include cold tasks
+        without paging them back in
+    """
+    store = TieredStore(capacity=3, directory=str(tmp_path))
+    open_uuids = create_tasks(store, 4)
+    completed_uuids = create_tasks(store, 4, completed=True)
+    cold = len(store.cold)
+
+    assert set(dict(store.items())) == set(open_uuids + completed_uuids)
+    assert set(dict(store.items(completed=True))) == set(completed_uuids)
+    assert set(dict(store.items(completed=False))) == set(open_uuids)
+    assert len(store.cold) == cold
+
+def test_segment_is_compacted(tmp_path):
+    """
+        This test overwrites and deletes segment records until the garbage
+        outweighs the live data and checks the survivors after compaction
+    """
+    segment = SegmentStore(str(tmp_path), compact_bytes=0)
+    uuids = [uuid.uuid4() for _ in range(10)]
+    for uuid_ in uuids:
+        segment.put(uuid_, Task(description='old'))
+    for uuid_ in uuids[:5]:
+        segment.put(uuid_, Task(description='new'))
+    for uuid_ in uuids[5:8]:
+        segment.discard(uuid_)
+
+    assert segment.wants_compaction()
+    segment.compact()
+    assert segment.dead_bytes == 0
+    assert [segment.get(uuid_).description for uuid_ in uuids[:5]] == ['new'] * 5
+    assert [segment.get(uuid_).description for uuid_ in uuids[8:]] == ['old'] * 2
+    segment.close()
+
+def test_writes_are_invisible_to_pinned_snapshots(tmp_path):
+    """
+        This test writes, overwrites and deletes tasks in both tiers while a
+        snapshot is pinned and checks the snapshot still sees the old state
+    """
+    store = TieredStore(capacity=2, directory=str(tmp_path))
+    uuids = create_tasks(store, 4)
+    with store.snapshot() as snapshot:
+        before = dict(snapshot.items())
+        store[uuids[0]] = Task(description='changed', completed=True)
+        del store[uuids[3]]
+        create_tasks(store, 3)
+        assert dict(snapshot.items()) == before
+        assert set(dict(snapshot.items(completed=False))) == set(uuids)
+        assert store.undo_size == 5
+
+    assert store.undo_size == 0
+    assert len(store.items()) == 6
+
+def test_concurrent_readers_see_consistent_snapshots(tmp_path):
+    """
+        This test runs writers that keep a sliding window of tasks against
+        readers that list the store, and checks every listing is a whole
+        window and does not change while its snapshot is pinned
+    """
+    store = TieredStore(capacity=50, directory=str(tmp_path))
+    window, rounds = 20, 400
+    uuids = [uuid.uuid4() for _ in range(window + rounds)]
+    for index in range(window):
+        store[uuids[index]] = Task(description=str(index), completed=index % 2 == 0)
+    done = threading.Event()
+    errors = []
+
+    def write():
+        for index in range(window, window + rounds):
+            with store.lock:
+                store[uuids[index]] = Task(description=str(index), completed=index % 2 == 0)
+                del store[uuids[index - window]]
+            store[uuids[index - 1]]
+        done.set()
+
+    def read():
+        while not done.is_set():
+            try:
+                with store.snapshot() as snapshot:
+                    numbers = sorted(int(item.description) for _, item in snapshot.items())
+                    again = sorted(int(item.description) for _, item in snapshot.items())
+                assert again == numbers, (numbers, again)
+                assert len(numbers) in (window, window + 1), numbers
+                assert numbers == list(range(numbers[0], numbers[0] + len(numbers))), numbers
+            except Exception as exception:  # pylint: disable=broad-except
+                errors.append(exception)
+                return
+
+    # Switching threads often makes reads and writes interleave mid-listing.
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    threads = [threading.Thread(target=write)] + [threading.Thread(target=read) for _ in range(4)]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+
+    assert not errors, errors[0]
+    assert store.undo_size == 0
+    assert sorted(int(item.description) for _, item in store.items()) == list(range(rounds, window + rounds))
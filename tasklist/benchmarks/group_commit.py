@@ -0,0 +1,95 @@
+# pylint: disable=missing-module-docstring, missing-function-docstring
+import json
+import os.path
+import time
+
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+
+from tasklist.backends import create_backend
+from tasklist.coalescer import WriteCoalescer
+from tasklist.database import DBSession
+from tasklist.models import Task
+from utils.utils import (
+    get_admin_secrets_filename,
+    get_app_secrets_filename,
+    get_config_filename,
+    get_sqlite_path,
+    run_all_scripts,
+)
+
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), '..', 'database', 'migrations')
+BENCHMARK_CONFIG = os.path.join(os.path.dirname(__file__), '..', 'config', 'config_benchmark.json')
+
+
+def add_database_arguments(parser):
+    parser.add_argument('--config', default=BENCHMARK_CONFIG,
+                        help='Config of a database that only holds benchmark data')
+    parser.add_argument('--reset', action='store_true',
+                        help='Confirm that every table of that database may be dropped')
+
+
+def database_of(config_file_name):
+    with open(config_file_name, 'r') as file:
+        config = json.load(file)
+    if config.get('backend', 'mysql') == 'sqlite':
+        return 'sqlite', os.path.realpath(get_sqlite_path(config_file_name, config))
+    return 'mysql', config.get('db_host'), config.get('database')
+
+
+def check_database(args):
+    # Every run starts from freshly migrated, empty tables, so benchmarks
+    # refuse the application's database whatever config file points at it.
+    if os.path.exists(get_config_filename()) and database_of(args.config) == database_of(get_config_filename()):
+        raise SystemExit('Refusing to drop the application database; use a benchmark config')
+    if not args.reset:
+        raise SystemExit(f'Every table of the database in {args.config} is dropped; pass --reset to confirm')
+
+
+def reset_database(args):
+    run_all_scripts(MIGRATIONS_DIR, args.config, get_admin_secrets_filename())
+
+
+def insert_tasks(backend, coalescer, count):
+    for _ in range(count):
+        session = DBSession(backend.connect, coalescer=coalescer)
+        try:
+            session.create_task(Task(description='benchmark'))
+        finally:
+            session.close()
+
+
+def run(backend, coalescer, threads, rows):
+    per_thread = rows // threads
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        for future in [
+                executor.submit(insert_tasks, backend, coalescer, per_thread)
+                for _ in range(threads)
+        ]:
+            future.result()
+    return per_thread * threads / (time.perf_counter() - start)
+
+
+def main():
+    parser = ArgumentParser(description='Compare task insert throughput with and without group commit.')
+    add_database_arguments(parser)
+    parser.add_argument('--threads', type=int, default=32, help='Concurrent writers')
+    parser.add_argument('--rows', type=int, default=5000, help='Rows inserted per run')
+    parser.add_argument('--max-delay', type=float, default=0.005, help='Coalescing window in seconds')
+    parser.add_argument('--max-rows', type=int, default=100, help='Maximum rows per transaction')
+    args = parser.parse_args()
+    check_database(args)
+
+    backend = create_backend(args.config, get_app_secrets_filename())
+    coalescer = WriteCoalescer(backend.connect, args.max_delay, args.max_rows)
+
+    for name, writer in [('one commit per row', None), ('group commit', coalescer)]:
+        reset_database(args)
+        throughput = run(backend, writer, args.threads, args.rows)
+        print(f'{name:>20}: {throughput:10.0f} inserts/s')
+
+
+if __name__ == '__main__':
+    main()
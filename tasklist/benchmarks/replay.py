@@ -0,0 +1,185 @@
+# pylint: disable=missing-module-docstring, missing-function-docstring, missing-class-docstring
+import gzip
+import http.client
+import json
+import math
+import re
+import threading
+import time
+
+from argparse import ArgumentParser
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from tasklist.capture import created_key
+
+UUID_PATTERN = re.compile(r'[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}')
+KEY_TIMEOUT = 60.0
+
+
+def read_capture(filenames):
+    # Files of several workers are merged in start order.
+    entries = []
+    for filename in filenames:
+        with gzip.open(filename, 'rt', encoding='utf-8') as file:
+            try:
+                for line in file:
+                    entries.append(json.loads(line))
+            except (EOFError, ValueError):
+                # Cut off by a worker that did not shut down cleanly.
+                pass
+    return sorted(entries, key=lambda entry: entry['t'])
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[max(math.ceil(fraction * len(values)) - 1, 0)]
+
+
+def summarize(results, key):
+    routes = {}
+    for result in results:
+        routes.setdefault(result['route'], []).append(result)
+    return {
+        route: {
+            'count': len(entries),
+            'p50': percentile([entry[key] for entry in entries], 0.50),
+            'p95': percentile([entry[key] for entry in entries], 0.95),
+            'p99': percentile([entry[key] for entry in entries], 0.99),
+            'status_changed': sum(entry['status'] != entry['expected'] for entry in entries),
+        }
+        for route, entries in sorted(routes.items())
+    }
+
+
+# Sends captured requests to a running instance, each at its captured
+# offset divided by `speed`. Keys the captured run created (tasks, users,
+# jobs) are replaced by the ones this run gets back, waiting for the
+# creating request when needed.
+class Replayer:
+    def __init__(self, url: str, speed: float = 1.0, concurrency: int = 32, timeout: float = 30.0):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port
+        self.speed = speed
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.skipped = 0
+        self.__keys = {}
+        self.__local = threading.local()
+
+    def run(self, entries):
+        self.__keys = {entry['c']: Future() for entry in entries if 'c' in entry}
+        futures = []
+        started = time.perf_counter()
+        with ThreadPoolExecutor(self.concurrency, thread_name_prefix='replay') as executor:
+            for entry in entries:
+                if entry.get('x'):
+                    self.skipped += 1
+                    if 'c' in entry:
+                        self.__keys[entry['c']].set_result(entry['c'])
+                    continue
+                delay = (entry['t'] - entries[0]['t']) / self.speed - (time.perf_counter() - started)
+                if delay > 0:
+                    time.sleep(delay)
+                # Requests start in capture order, so a request never waits
+                # for a key from one that has not started.
+                futures.append(executor.submit(self.__send, entry))
+            return [future.result() for future in futures]
+
+    def __send(self, entry):
+        target = self.__map(entry['p'])
+        if entry.get('q'):
+            target += '?' + self.__map(entry['q'])
+        body = None if 'b' not in entry else self.__map(json.dumps(entry['b'])).encode()
+        headers = dict(entry.get('h', {}))
+        if body is not None:
+            headers.setdefault('content-type', 'application/json')
+
+        try:
+            status, data, seconds = self.__request(entry['m'], target, body, headers)
+        except Exception:
+            if 'c' in entry:
+                self.__keys[entry['c']].set_result(entry['c'])
+            raise
+        if 'c' in entry:
+            self.__keys[entry['c']].set_result(created_key(data) or entry['c'])
+        return {
+            'route': f'{entry["m"]} {entry.get("r") or entry["p"]}',
+            'status': status,
+            'expected': entry['s'],
+            'seconds': seconds,
+            'captured': entry['d'],
+        }
+
+    def __request(self, method, target, body, headers):
+        # One keep-alive connection per thread, reopened once if it went stale.
+        for attempt in range(2):
+            connection = getattr(self.__local, 'connection', None)
+            if connection is None:
+                connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+                self.__local.connection = connection
+            try:
+                started = time.perf_counter()
+                connection.request(method, target, body, headers)
+                response = connection.getresponse()
+                data = response.read()
+                return response.status, data, time.perf_counter() - started
+            except (http.client.HTTPException, ConnectionError):
+                connection.close()
+                self.__local.connection = None
+                if attempt:
+                    raise
+        raise AssertionError('unreachable')
+
+    def __map(self, text):
+        def replace(match):
+            future = self.__keys.get(match.group(0).lower())
+            return match.group(0) if future is None else future.result(KEY_TIMEOUT)
+        return UUID_PATTERN.sub(replace, text)
+
+
+def report(baseline, current):
+    print(f'{"route":<40} {"count":>7} {"p50 ms":>15} {"p95 ms":>15} {"p99 ms":>15} {"status":>7}')
+    for route, stats in current.items():
+        before = baseline.get(route)
+        columns = []
+        for key in ('p50', 'p95', 'p99'):
+            column = f'{stats[key] * 1000:.1f}'
+            if before is not None and before[key]:
+                column += f' ({(stats[key] / before[key] - 1) * 100:+.0f}%)'
+            columns.append(column)
+        print(f'{route:<40} {stats["count"]:>7} {columns[0]:>15} {columns[1]:>15} {columns[2]:>15} '
+              f'{stats["status_changed"]:>7}')
+
+
+def main():
+    parser = ArgumentParser(description='Replay captured traffic against a running instance.')
+    parser.add_argument('capture', nargs='+', help='Capture files written by the capture middleware')
+    parser.add_argument('--url', default='http://127.0.0.1:8000', help='Instance to replay against')
+    parser.add_argument('--speed', type=float, default=1.0, help='Replay N times faster than captured')
+    parser.add_argument('--concurrency', type=int, default=32, help='Maximum requests in flight')
+    parser.add_argument('--output', help='Write the per-route results to this JSON file')
+    parser.add_argument('--baseline', help='Results of an earlier replay to compare with, '
+                                           'instead of the captured latencies')
+    args = parser.parse_args()
+
+    entries = read_capture(args.capture)
+    replayer = Replayer(args.url, args.speed, args.concurrency)
+    results = replayer.run(entries)
+    current = summarize(results, 'seconds')
+    if args.baseline:
+        with open(args.baseline, 'r') as file:
+            baseline = json.load(file)
+    else:
+        baseline = summarize(results, 'captured')
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(current, file, indent=4)
+
+    print(f'Replayed {len(results)} requests, skipped {replayer.skipped}.')
+    report(baseline, current)
+
+
+if __name__ == '__main__':
+    main()
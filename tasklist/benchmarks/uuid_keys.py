@@ -0,0 +1,93 @@
+# pylint: disable=missing-module-docstring, missing-function-docstring
+import time
+import uuid
+
+from argparse import ArgumentParser
+
+from tasklist.backends import create_backend
+from tasklist.database import to_bin, uuid7
+from utils.utils import get_app_secrets_filename
+
+from .group_commit import add_database_arguments, check_database, reset_database
+
+
+def clustered_index(connection):
+    # InnoDB stores the rows in the primary key's B-tree: its size and how
+    # full its leaf pages are show the page splits random keys cause.
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE TABLE tasks')
+        cursor.fetchall()
+        cursor.execute(
+            '''
+            SELECT stat_name, stat_value FROM mysql.innodb_index_stats
+            WHERE database_name = DATABASE() AND table_name = 'tasks'
+            AND index_name = 'PRIMARY' AND stat_name IN ('size', 'n_leaf_pages')
+            '''
+        )
+        stats = dict(cursor.fetchall())
+        cursor.execute('SELECT @@innodb_page_size, COUNT(*) FROM tasks')
+        page_size, rows = cursor.fetchone()
+    return stats['size'] * page_size, rows / stats['n_leaf_pages']
+
+
+def table_size(backend, connection):
+    with connection.cursor() as cursor:
+        if backend.name == 'mysql':
+            cursor.execute(
+                '''
+                SELECT data_length + index_length
+                FROM information_schema.tables
+                WHERE table_schema = DATABASE() AND table_name = 'tasks'
+                '''
+            )
+        else:
+            cursor.execute(
+                '''
+                SELECT SUM(pgsize) FROM dbstat
+                WHERE name IN (SELECT name FROM sqlite_master WHERE tbl_name = 'tasks')
+                '''
+            )
+        return cursor.fetchone()[0]
+
+
+def insert_tasks(connection, new_uuid, rows, batch_size):
+    start = time.perf_counter()
+    with connection.cursor() as cursor:
+        for offset in range(0, rows, batch_size):
+            cursor.executemany(
+                'INSERT INTO tasks (uuid, description, completed, user_uuid) VALUES (%s, %s, %s, %s)',
+                [
+                    (to_bin(new_uuid()), 'benchmark', False, None)
+                    for _ in range(min(batch_size, rows - offset))
+                ],
+            )
+            connection.commit()
+    return rows / (time.perf_counter() - start)
+
+
+def main():
+    parser = ArgumentParser(description='Compare random (v4) and time-ordered (v7) task keys.')
+    add_database_arguments(parser)
+    parser.add_argument('--rows', type=int, default=200000, help='Rows inserted per run')
+    parser.add_argument('--batch-size', type=int, default=1000, help='Rows per transaction')
+    args = parser.parse_args()
+    check_database(args)
+
+    backend = create_backend(args.config, get_app_secrets_filename())
+    for name, new_uuid in [('uuid4', uuid.uuid4), ('uuid7', uuid7)]:
+        reset_database(args)
+        connection = backend.connect()
+        try:
+            throughput = insert_tasks(connection, new_uuid, args.rows, args.batch_size)
+            clustered = clustered_index(connection) if backend.name == 'mysql' else None
+            size = table_size(backend, connection)
+        finally:
+            connection.close()
+        line = f'{name}: {throughput:10.0f} inserts/s, {size / 2**20:8.1f} MiB'
+        if clustered is not None:
+            line += f', clustered index {clustered[0] / 2**20:8.1f} MiB, {clustered[1]:6.1f} rows per leaf page'
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
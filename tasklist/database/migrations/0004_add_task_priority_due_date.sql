@@ -0,0 +1,8 @@
+ALTER TABLE tasks
+    ADD priority TINYINT UNSIGNED NOT NULL DEFAULT 0,
+    ADD due_date DATE;
+-- Equality on the leading columns plus ORDER BY on the last one (and the
+-- primary key InnoDB appends to every index) is served by an index scan.
+-- The prefix of tasks_completed_due_date also serves WHERE completed = ?.
+CREATE INDEX tasks_user_completed_due_date ON tasks (user_uuid, completed, due_date);
+CREATE INDEX tasks_completed_due_date ON tasks (completed, due_date);
@@ -0,0 +1,2 @@
+ALTER TABLE tasks ADD version INT UNSIGNED NOT NULL DEFAULT 1;
+ALTER TABLE users ADD version INT UNSIGNED NOT NULL DEFAULT 1;
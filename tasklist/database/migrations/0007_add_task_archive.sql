@@ -0,0 +1,22 @@
+ALTER TABLE tasks ADD completed_at DATETIME;
+-- Tasks completed before this migration start ageing now.
+UPDATE tasks SET completed_at = UTC_TIMESTAMP() WHERE completed;
+CREATE INDEX tasks_completed_completed_at ON tasks (completed, completed_at);
+-- A table rather than partitions of tasks: InnoDB does not partition tables
+-- with foreign keys.
+-- Nor does the archive refer to users: 0002 drops users before this script
+-- drops the archive when the migrations are run again. Archived tasks are
+-- deleted with their user by the application, before the user row.
+DROP TABLE IF EXISTS tasks_archive;
+CREATE TABLE tasks_archive (
+    uuid BINARY(16) PRIMARY KEY,
+    description NVARCHAR(1024),
+    completed BOOLEAN,
+    user_uuid BINARY(16),
+    priority TINYINT UNSIGNED NOT NULL DEFAULT 0,
+    due_date DATE,
+    version INT UNSIGNED NOT NULL DEFAULT 1,
+    completed_at DATETIME
+);
+CREATE INDEX tasks_archive_user_due_date ON tasks_archive (user_uuid, due_date);
+CREATE INDEX tasks_archive_user_priority ON tasks_archive (user_uuid, priority);
@@ -0,0 +1,3 @@
+-- NVARCHAR columns use utf8_general_ci, which is case-insensitive, so
+-- LIKE 'prefix%' on this index is a range scan whatever the case.
+CREATE INDEX users_name ON users (name);
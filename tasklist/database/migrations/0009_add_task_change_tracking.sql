@@ -0,0 +1,21 @@
+ALTER TABLE tasks
+    ADD created_at DATETIME(6),
+    ADD updated_at DATETIME(6);
+ALTER TABLE tasks_archive
+    ADD created_at DATETIME(6),
+    ADD updated_at DATETIME(6);
+-- Existing tasks count as changed now, so the next sync picks them up.
+UPDATE tasks SET created_at = UTC_TIMESTAMP(6), updated_at = UTC_TIMESTAMP(6);
+CREATE INDEX tasks_updated_at ON tasks (updated_at);
+CREATE INDEX tasks_user_updated_at ON tasks (user_uuid, updated_at);
+-- Deleted tasks, and tasks that left a user, for clients that sync changes.
+-- Several tombstones of one task are harmless, so there is no unique key.
+DROP TABLE IF EXISTS task_tombstones;
+CREATE TABLE task_tombstones (
+    id BIGINT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
+    uuid BINARY(16) NOT NULL,
+    user_uuid BINARY(16),
+    deleted_at DATETIME(6) NOT NULL
+);
+CREATE INDEX task_tombstones_deleted_at ON task_tombstones (deleted_at);
+CREATE INDEX task_tombstones_user_deleted_at ON task_tombstones (user_uuid, deleted_at);
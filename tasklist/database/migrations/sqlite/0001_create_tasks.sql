@@ -0,0 +1,6 @@
+DROP TABLE IF EXISTS tasks;
+CREATE TABLE tasks (
+    uuid BLOB(16) PRIMARY KEY,
+    description NVARCHAR(1024),
+    completed BOOLEAN
+) WITHOUT ROWID;
@@ -0,0 +1,5 @@
+DROP TABLE IF EXISTS users;
+CREATE TABLE users (
+    uuid BLOB(16) PRIMARY KEY,
+    name NVARCHAR(64)
+) WITHOUT ROWID;
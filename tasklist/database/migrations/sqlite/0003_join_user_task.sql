@@ -0,0 +1,6 @@
+ALTER TABLE
+    tasks ADD user_uuid BLOB(16)
+    REFERENCES users(uuid)
+    ON DELETE CASCADE;
+-- InnoDB indexes foreign keys implicitly, SQLite does not.
+CREATE INDEX tasks_user_uuid ON tasks (user_uuid);
@@ -0,0 +1,4 @@
+ALTER TABLE tasks ADD priority TINYINT NOT NULL DEFAULT 0;
+ALTER TABLE tasks ADD due_date DATE;
+CREATE INDEX tasks_user_completed_due_date ON tasks (user_uuid, completed, due_date);
+CREATE INDEX tasks_completed_due_date ON tasks (completed, due_date);
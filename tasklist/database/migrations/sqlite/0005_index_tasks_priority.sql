@@ -0,0 +1,2 @@
+CREATE INDEX tasks_user_completed_priority ON tasks (user_uuid, completed, priority);
+CREATE INDEX tasks_completed_priority ON tasks (completed, priority);
@@ -0,0 +1,2 @@
+ALTER TABLE tasks ADD version INTEGER NOT NULL DEFAULT 1;
+ALTER TABLE users ADD version INTEGER NOT NULL DEFAULT 1;
@@ -0,0 +1,18 @@
+ALTER TABLE tasks ADD completed_at DATETIME;
+UPDATE tasks SET completed_at = CURRENT_TIMESTAMP WHERE completed;
+CREATE INDEX tasks_completed_completed_at ON tasks (completed, completed_at);
+-- Like on MySQL, the archive does not refer to users: archived tasks are
+-- deleted with their user by the application.
+DROP TABLE IF EXISTS tasks_archive;
+CREATE TABLE tasks_archive (
+    uuid BLOB(16) PRIMARY KEY,
+    description NVARCHAR(1024),
+    completed BOOLEAN,
+    user_uuid BLOB(16),
+    priority TINYINT NOT NULL DEFAULT 0,
+    due_date DATE,
+    version INTEGER NOT NULL DEFAULT 1,
+    completed_at DATETIME
+) WITHOUT ROWID;
+CREATE INDEX tasks_archive_user_due_date ON tasks_archive (user_uuid, due_date);
+CREATE INDEX tasks_archive_user_priority ON tasks_archive (user_uuid, priority);
@@ -0,0 +1,13 @@
+-- SQLite compares with BINARY unless a column says otherwise. The table is
+-- rebuilt with a NOCASE name, so comparisons, ORDER BY and the index are
+-- case-insensitive like the MySQL collation.
+DROP TABLE IF EXISTS users_nocase;
+CREATE TABLE users_nocase (
+    uuid BLOB(16) PRIMARY KEY,
+    name NVARCHAR(64) COLLATE NOCASE,
+    version INTEGER NOT NULL DEFAULT 1
+) WITHOUT ROWID;
+INSERT INTO users_nocase (uuid, name, version) SELECT uuid, name, version FROM users;
+DROP TABLE users;
+ALTER TABLE users_nocase RENAME TO users;
+CREATE INDEX users_name ON users (name);
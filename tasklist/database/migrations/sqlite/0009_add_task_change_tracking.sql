@@ -0,0 +1,18 @@
+ALTER TABLE tasks ADD created_at DATETIME;
+ALTER TABLE tasks ADD updated_at DATETIME;
+ALTER TABLE tasks_archive ADD created_at DATETIME;
+ALTER TABLE tasks_archive ADD updated_at DATETIME;
+UPDATE tasks SET
+    created_at = STRFTIME('%Y-%m-%d %H:%M:%f', 'now'),
+    updated_at = STRFTIME('%Y-%m-%d %H:%M:%f', 'now');
+CREATE INDEX tasks_updated_at ON tasks (updated_at);
+CREATE INDEX tasks_user_updated_at ON tasks (user_uuid, updated_at);
+DROP TABLE IF EXISTS task_tombstones;
+CREATE TABLE task_tombstones (
+    id INTEGER PRIMARY KEY,
+    uuid BLOB(16) NOT NULL,
+    user_uuid BLOB(16),
+    deleted_at DATETIME NOT NULL
+);
+CREATE INDEX task_tombstones_deleted_at ON task_tombstones (deleted_at);
+CREATE INDEX task_tombstones_user_deleted_at ON task_tombstones (user_uuid, deleted_at);
@@ -0,0 +1,19 @@
+from argparse import ArgumentParser
+
+from tasklist.sharding import move_user
+
+
+def main():
+    parser = ArgumentParser(description='Move a user and their tasks to another shard.')
+    parser.add_argument('user_uuid', help='User to move')
+    parser.add_argument('shard', type=int, help='Index of the target shard in the config')
+    parser.add_argument('config', help='Service config file')
+    parser.add_argument('secrets', help='Service database secrets')
+
+    args = parser.parse_args()
+    moved = move_user(args.config, args.secrets, args.user_uuid, args.shard)
+    print(f'Moved user {args.user_uuid} and {moved} tasks to shard {args.shard}.')
+
+
+if __name__ == '__main__':
+    main()
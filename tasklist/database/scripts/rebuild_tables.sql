@@ -0,0 +1,2 @@
+OPTIMIZE TABLE tasks;
+OPTIMIZE TABLE users;
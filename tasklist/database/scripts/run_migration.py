@@ -1,6 +1,6 @@
 from argparse import ArgumentParser
 
-from utils import run_script
+from utils.utils import run_script
 
 
 def main():
@@ -0,0 +1,145 @@
+# pylint: disable=missing-module-docstring, missing-function-docstring, missing-class-docstring
+import asyncio
+import collections
+import json
+import threading
+
+from functools import lru_cache
+
+from fastapi import Depends, HTTPException, Request
+
+from utils.utils import get_config_filename
+
+
+class Limiter:
+    def __init__(self, concurrency: int, queue: int = 0, timeout: float = 1.0):
+        self.concurrency = concurrency
+        self.queue = queue
+        self.timeout = timeout
+        self.active = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.__waiters = collections.deque()
+        self.__lock = threading.Lock()
+
+    @property
+    def waiting(self):
+        return len(self.__waiters)
+
+    def stats(self):
+        return {
+            'concurrency': self.concurrency,
+            'active': self.active,
+            'waiting': self.waiting,
+            'admitted': self.admitted,
+            'rejected': self.rejected,
+        }
+
+    async def acquire(self):
+        with self.__lock:
+            if self.active < self.concurrency and not self.__waiters:
+                self.active += 1
+                self.admitted += 1
+                return True
+            if len(self.__waiters) >= self.queue:
+                self.rejected += 1
+                return False
+            waiter = asyncio.get_running_loop().create_future()
+            self.__waiters.append(waiter)
+
+        try:
+            await asyncio.wait_for(waiter, self.timeout)
+        except asyncio.TimeoutError:
+            with self.__lock:
+                # A releaser may have handed us its slot just in time.
+                if waiter in self.__waiters:
+                    self.__waiters.remove(waiter)
+                    self.rejected += 1
+                    return False
+        except asyncio.CancelledError:
+            # The client went away while queued. A slot already handed to
+            # us goes on to the next waiter instead of being lost.
+            with self.__lock:
+                handed = waiter not in self.__waiters
+                if not handed:
+                    self.__waiters.remove(waiter)
+            if handed:
+                self.release()
+            raise
+        with self.__lock:
+            self.admitted += 1
+        return True
+
+    def release(self):
+        with self.__lock:
+            if self.__waiters:
+                # The slot goes straight to the oldest waiter.
+                waiter = self.__waiters.popleft()
+                waiter.get_loop().call_soon_threadsafe(self.__wake, waiter)
+            else:
+                self.active -= 1
+
+    @staticmethod
+    def __wake(waiter):
+        if not waiter.done():
+            waiter.set_result(True)
+
+
+class AdmissionControl:
+    def __init__(self, config: dict):
+        self.retry_after = config.get('retry_after', 1)
+        self.__default = config.get('default')
+        self.__routes = config.get('routes', {})
+        self.__limiters = {}
+        self.__lock = threading.Lock()
+        if 'global' in config:
+            self.__limiters['global'] = Limiter(**config['global'])
+
+    def limiters_for(self, request: Request):
+        route = request.scope.get('route')
+        key = f'{request.method} {route.path}' if route is not None else request.url.path
+        limiters = []
+        with self.__lock:
+            if key not in self.__limiters:
+                settings = self.__routes.get(key, self.__default)
+                self.__limiters[key] = None if settings is None else Limiter(**settings)
+            if self.__limiters[key] is not None:
+                limiters.append(self.__limiters[key])
+        if 'global' in self.__limiters:
+            limiters.append(self.__limiters['global'])
+        return limiters
+
+    def stats(self):
+        with self.__lock:
+            return {
+                key: limiter.stats()
+                for key, limiter in self.__limiters.items()
+                if limiter is not None
+            }
+
+
+@lru_cache
+def get_admission(config_file_name: str = Depends(get_config_filename)):
+    with open(config_file_name, 'r') as file:
+        config = json.load(file)
+    if 'admission' not in config:
+        return None
+    return AdmissionControl(config['admission'])
+
+
+async def admit(request: Request, admission: AdmissionControl = Depends(get_admission)):
+    # Runs before get_db, so rejected requests never open a connection.
+    acquired = []
+    try:
+        for limiter in [] if admission is None else admission.limiters_for(request):
+            if not await limiter.acquire():
+                raise HTTPException(
+                    status_code=503,
+                    detail='Server overloaded, retry later',
+                    headers={'Retry-After': str(admission.retry_after)},
+                )
+            acquired.append(limiter)
+        yield
+    finally:
+        for limiter in acquired:
+            limiter.release()
@@ -0,0 +1,286 @@
+# pylint: disable=missing-module-docstring, missing-function-docstring, missing-class-docstring
+import json
+import math
+import queue
+import sqlite3
+import string
+import threading
+import time
+import unicodedata
+
+import mysql.connector as conn
+
+from utils.utils import get_sqlite_path
+
+BUSY_TIMEOUT_MS = 5000
+# SQLite virtual machine instructions between deadline checks.
+PROGRESS_STEPS = 10000
+ER_LOCK_WAIT_TIMEOUT = 1205
+ER_QUERY_TIMEOUT = 3024
+ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+# The errors of either backend, for code that runs on whichever is configured.
+ERRORS = (conn.Error, sqlite3.Error)
+INTEGRITY_ERRORS = (conn.IntegrityError, sqlite3.IntegrityError)
+
+
+# Python keys that order and compare user names exactly as the name column's
+# collation does, for results merged or filtered outside the database.
+def nocase_key(text: str):
+    # SQLite's NOCASE only folds ASCII letters; everything else compares by
+    # code point, which is also the order of the UTF-8 bytes.
+    return text.translate(ASCII_LOWER)
+
+
+def general_ci_key(text: str):
+    # MySQL's utf8_general_ci gives every character one weight: its base
+    # letter in upper case, so accents and case are both ignored.
+    return ''.join(unicodedata.normalize('NFD', char)[0].upper()[0] for char in text)
+
+
+class SQLiteCursor:
+    def __init__(self, cursor: sqlite3.Cursor):
+        self.cursor = cursor
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.cursor.close()
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    def execute(self, query, params=()):
+        # Queries are written with the MySQL placeholder style.
+        self.cursor.execute(query.replace('%s', '?'), params)
+
+    def executemany(self, query, seq_params):
+        self.cursor.executemany(query.replace('%s', '?'), seq_params)
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    def fetchmany(self, size):
+        return self.cursor.fetchmany(size)
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+
+class SQLiteConnection:
+    def __init__(self, path: str):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA foreign_keys = ON')
+        self.connection.execute(f'PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}')
+        # WAL is durable across a process crash with synchronous=NORMAL and
+        # lets readers run concurrently with the single writer.
+        self.connection.execute('PRAGMA journal_mode = WAL')
+        self.connection.execute('PRAGMA synchronous = NORMAL')
+
+    def cursor(self, **_):
+        return SQLiteCursor(self.connection.cursor())
+
+    def is_connected(self):
+        return True
+
+    def commit(self):
+        self.connection.commit()
+
+    def rollback(self):
+        self.connection.rollback()
+
+    def set_deadline(self, deadline):
+        # A statement still running at the deadline is interrupted, and lock
+        # waits give up at it.
+        if deadline is None:
+            self.connection.set_progress_handler(None, 0)
+            self.connection.execute(f'PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}')
+            return
+        self.connection.set_progress_handler(lambda: time.monotonic() > deadline, PROGRESS_STEPS)
+        self.connection.execute(f'PRAGMA busy_timeout = {int(remaining(deadline) * 1000)}')
+
+    def close(self):
+        self.connection.close()
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class QueryTimeout(Exception):
+    # A statement ran past the deadline of its request.
+    pass
+
+
+def remaining(deadline):
+    return max(deadline - time.monotonic(), 0.0)
+
+
+def set_deadline(connection, deadline):
+    # Bounds the statements of a connection by a time.monotonic() deadline,
+    # or lifts the bound when it is None. MySQL SELECTs are bounded by their
+    # MAX_EXECUTION_TIME hints; lock waits are bounded here, in whole seconds.
+    if hasattr(connection, 'set_deadline'):
+        connection.set_deadline(deadline)
+        return
+    with connection.cursor() as cursor:
+        if deadline is None:
+            cursor.execute('SET SESSION innodb_lock_wait_timeout = DEFAULT')
+        else:
+            cursor.execute(
+                'SET SESSION innodb_lock_wait_timeout = %s',
+                (max(math.ceil(remaining(deadline)), 1), ),
+            )
+
+
+def is_timeout(exception: Exception):
+    # Statements cancelled by a deadline, and lock waits that gave up.
+    if isinstance(exception, sqlite3.OperationalError):
+        return str(exception) in ('interrupted', 'database is locked')
+    return isinstance(exception, conn.Error) and exception.errno in (ER_LOCK_WAIT_TIMEOUT, ER_QUERY_TIMEOUT)
+
+
+class VersionConflict(Exception):
+    # A conditional write found the row at another version than expected.
+    pass
+
+
+class ImportFailed(ValueError):
+    # A bulk import stopped at `row`, counted from 1 (None when it is not
+    # known), after committing `imported` rows.
+    def __init__(self, reason, row, imported: int):
+        where = '' if row is None else f'Row {row}: '
+        super().__init__(f'{where}{reason} ({imported} rows imported)')
+        self.reason = reason
+        self.row = row
+        self.imported = imported
+
+
+class PooledConnection:
+    def __init__(self, pool, connection):
+        self.__pool = pool
+        self.connection = connection
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+    def close(self):
+        if self.connection is not None:
+            self.__pool.release(self.connection)
+            self.connection = None
+
+
+class ConnectionPool:
+    def __init__(self, connect, size: int, timeout: float = 30.0, max_idle: float = 60.0):
+        self.size = size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.__connect = connect
+        self.__idle = queue.LifoQueue()
+        self.__slots = threading.BoundedSemaphore(size)
+
+    def fill(self):
+        # Opens every connection up front so no request pays for a connect.
+        connections = [self.acquire() for _ in range(self.size)]
+        for connection in connections:
+            connection.close()
+
+    def acquire(self):
+        if not self.__slots.acquire(timeout=self.timeout):
+            raise PoolTimeout(f'No database connection available after {self.timeout}s')
+        try:
+            return PooledConnection(self, self.__checkout())
+        except BaseException:
+            self.__slots.release()
+            raise
+
+    def release(self, connection):
+        try:
+            connection.rollback()
+            self.__idle.put((time.monotonic(), connection))
+        except Exception:  # pylint: disable=broad-except
+            connection.close()
+        finally:
+            self.__slots.release()
+
+    def __checkout(self):
+        while True:
+            try:
+                released, connection = self.__idle.get_nowait()
+            except queue.Empty:
+                return self.__connect()
+            # Long idle connections may have been dropped by the server.
+            if time.monotonic() - released < self.max_idle or connection.is_connected():
+                return connection
+            connection.close()
+
+
+class Backend:
+    pool = None
+
+    def connect(self):
+        if self.pool is None:
+            return self.open()
+        return self.pool.acquire()
+
+    def open(self):
+        raise NotImplementedError()
+
+
+class MySQLBackend(Backend):
+    name = 'mysql'
+    Error = conn.Error
+    name_key = staticmethod(general_ci_key)
+
+    def __init__(self, config: dict, secrets_file_name: str):
+        with open(secrets_file_name, 'r') as file:
+            secrets = json.load(file)
+        self.credentials = {
+            'user': secrets['user'],
+            'password': secrets['password'],
+            'host': config['db_host'],
+            'database': config['database'],
+        }
+
+    def open(self):
+        return conn.connect(**self.credentials)
+
+
+class SQLiteBackend(Backend):
+    name = 'sqlite'
+    Error = sqlite3.Error
+    name_key = staticmethod(nocase_key)
+
+    def __init__(self, config: dict, config_file_name: str):
+        self.path = get_sqlite_path(config_file_name, config)
+
+    def open(self):
+        return SQLiteConnection(self.path)
+
+
+def create_backend(config_file_name: str, secrets_file_name: str):
+    with open(config_file_name, 'r') as file:
+        config = json.load(file)
+    return create_backend_from_config(config, config_file_name, secrets_file_name)
+
+
+def create_backend_from_config(config: dict, config_file_name: str, secrets_file_name: str):
+    name = config.get('backend', 'mysql')
+    if name == 'mysql':
+        backend = MySQLBackend(config, secrets_file_name)
+    elif name == 'sqlite':
+        backend = SQLiteBackend(config, config_file_name)
+    else:
+        raise ValueError(f'Unknown database backend: {name}')
+
+    if config.get('pool_size'):
+        backend.pool = ConnectionPool(
+            backend.open,
+            config['pool_size'],
+            timeout=config.get('pool_timeout', 30.0),
+        )
+    return backend
@@ -0,0 +1,115 @@
+# pylint: disable=missing-module-docstring, missing-function-docstring
+import codecs
+import csv
+import io
+import json
+
+import anyio
+
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def format_ndjson(batches, fields):
+    for batch in batches:
+        yield ''.join(
+            json.dumps({field: row[field] for field in fields}) + '\n'
+            for row in batch
+        )
+
+
+def format_csv(batches, fields):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    for batch in batches:
+        writer.writerows(
+            ['' if row[field] is None else row[field] for field in fields]
+            for row in batch
+        )
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def format_rows(batches, fields, format_):
+    if format_ == 'csv':
+        return format_csv(batches, fields)
+    return format_ndjson(batches, fields)
+
+
+def iterate_lines(chunks):
+    # Decodes a byte stream into lines without holding more than one line.
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    pending = ''
+    for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split('\n')
+        for line in lines:
+            yield line + '\n'
+    pending += decoder.decode(b'', final=True)
+    if pending:
+        yield pending
+
+
+def iterate_from_thread(async_iterator):
+    # Lets a worker thread consume the request body the event loop receives.
+    while True:
+        try:
+            yield anyio.from_thread.run(async_iterator.__anext__)
+        except StopAsyncIteration:
+            return
+
+
+def parse_ndjson(lines):
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError as exception:
+            raise ValueError(f'Line {number}: {exception}') from exception
+
+
+def parse_csv(lines):
+    for row in csv.DictReader(lines):
+        yield {field: None if value == '' else value for field, value in row.items()}
+
+
+def parse_rows(lines, format_):
+    if format_ == 'csv':
+        return parse_csv(lines)
+    return parse_ndjson(lines)
+
+
+def content_format(content_type: str):
+    if content_type is not None and content_type.split(';')[0].strip() == FORMATS['csv']:
+        return 'csv'
+    return 'ndjson'
+
+
+def batched(rows, size: int):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class Counted:
+    # Counts the rows read so far, so a row that fails to parse can be
+    # reported by its position.
+    def __init__(self, rows):
+        self.rows = rows
+        self.count = 0
+
+    def __iter__(self):
+        for row in self.rows:
+            self.count += 1
+            yield row
@@ -0,0 +1,209 @@
+# pylint: disable=missing-module-docstring, missing-function-docstring, missing-class-docstring
+import gzip
+import json
+import queue
+import random
+import re
+import threading
+import time
+
+from functools import lru_cache
+from urllib.parse import parse_qsl, urlencode
+
+from fastapi import FastAPI, HTTPException
+
+from utils.utils import get_capture_path, get_config_filename
+
+from .routers import page_cursor, parse_page_cursor
+from .warmup import resolve
+
+# Long-lived streams and diagnostics are not part of the traffic mix.
+DEFAULT_EXCLUDE = ('/feed', '/debug', '/metrics', '/ready', '/docs', '/openapi.json')
+# Only the headers that change what a request does are kept.
+KEPT_HEADERS = ('content-type', 'if-match')
+# Keys and dates are kept so requests can be replayed; any other text is
+# replaced by as many x's.
+KEPT_TEXT = re.compile(r'^([0-9a-fA-F]{8}-?([0-9a-fA-F]{4}-?){3}[0-9a-fA-F]{12}|\d{4}-\d{2}-\d{2})$')
+FREE_TEXT_PARAMS = ('name_prefix', )
+MAX_RESPONSE_BODY = 1024
+FLUSH_SECONDS = 1.0
+
+
+def sanitize(value):
+    if isinstance(value, str):
+        return value if KEPT_TEXT.match(value) else 'x' * len(value)
+    if isinstance(value, list):
+        return [sanitize(item) for item in value]
+    if isinstance(value, dict):
+        return {key: sanitize(item) for key, item in value.items()}
+    return value
+
+
+def sanitize_query(query: str):
+    params = []
+    for name, value in parse_qsl(query, keep_blank_values=True):
+        if name in FREE_TEXT_PARAMS:
+            value = sanitize(value)
+        elif name == 'after':
+            # Page cursors carry a user name.
+            try:
+                cursor_name, uuid_ = parse_page_cursor(value)
+                value = page_cursor(None if cursor_name is None else sanitize(cursor_name), uuid_)
+            except HTTPException:
+                value = sanitize(value)
+        params.append((name, value))
+    return urlencode(params)
+
+
+def created_key(body: bytes):
+    # The UUID a create returned, or the id of a job a request started, so a
+    # replay can map it to the one it gets back.
+    try:
+        value = json.loads(body)
+    except ValueError:
+        return None
+    if isinstance(value, dict):
+        value = value.get('id')
+    return value if isinstance(value, str) and KEPT_TEXT.match(value) else None
+
+
+# Writes one compact JSON line per request to a gzip file: its start time,
+# method, path, sanitized query and JSON body, status and duration. Lines
+# are written by a background thread, so requests only pay for a queue put.
+class Recorder:
+    def __init__(self, path: str, sample: float = 1.0, max_body: int = 65536, exclude=DEFAULT_EXCLUDE):
+        self.path = path
+        self.sample = sample
+        self.max_body = max_body
+        self.exclude = tuple(exclude)
+        self.recorded = 0
+        self.closed = False
+        self.__queue = queue.Queue()
+        self.__thread = threading.Thread(target=self.__run, name='capture', daemon=True)
+        self.__thread.start()
+
+    def wants(self, path: str):
+        if self.closed or path.startswith(self.exclude):
+            return False
+        return self.sample >= 1.0 or random.random() < self.sample
+
+    def record(self, entry: dict):
+        self.__queue.put(entry)
+
+    def close(self):
+        self.closed = True
+        self.__queue.put(None)
+        self.__thread.join()
+
+    def __run(self):
+        flushed = time.monotonic()
+        with gzip.open(self.path, 'at', encoding='utf-8') as file:
+            while True:
+                entry = self.__queue.get()
+                if entry is None:
+                    return
+                file.write(json.dumps(self.__line(entry), separators=(',', ':')) + '\n')
+                self.recorded += 1
+                if self.__queue.empty() and time.monotonic() - flushed > FLUSH_SECONDS:
+                    file.flush()
+                    flushed = time.monotonic()
+
+    @staticmethod
+    def __line(entry):
+        line = {
+            't': round(entry['time'], 6),
+            'm': entry['method'],
+            'p': entry['path'],
+            'r': entry['route'],
+            's': entry['status'],
+            'd': round(entry['duration'], 6),
+        }
+        if entry['query']:
+            line['q'] = sanitize_query(entry['query'])
+        headers = {name: value for name, value in entry['headers'].items() if name in KEPT_HEADERS}
+        if headers:
+            line['h'] = headers
+        if entry['body'] is None:
+            # Too large to keep; replays skip the request.
+            line['x'] = True
+        elif entry['body']:
+            try:
+                line['b'] = sanitize(json.loads(entry['body']))
+            except ValueError:
+                # Not JSON (a CSV or NDJSON import): nothing can be sanitized.
+                line['x'] = True
+        created = created_key(entry['response'])
+        if created is not None:
+            line['c'] = created
+        return line
+
+
+class CaptureMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        recorder = None
+        if scope['type'] == 'http':
+            recorder = get_recorder(resolve(scope['app'], get_config_filename))
+        if recorder is None or not recorder.wants(scope['path']):
+            await self.app(scope, receive, send)
+            return
+
+        started = time.time()
+        clock = time.perf_counter()
+        request = {'body': bytearray(), 'truncated': False}
+        response = {'status': None, 'body': bytearray()}
+
+        async def receive_body():
+            message = await receive()
+            if message['type'] == 'http.request' and not request['truncated']:
+                request['body'].extend(message.get('body', b''))
+                if len(request['body']) > recorder.max_body:
+                    request['truncated'] = True
+                    request['body'].clear()
+            return message
+
+        async def send_response(message):
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+            elif message['type'] == 'http.response.body' \
+                    and len(response['body']) < MAX_RESPONSE_BODY:
+                response['body'].extend(message.get('body', b''))
+            await send(message)
+
+        try:
+            await self.app(scope, receive_body, send_response)
+        finally:
+            route = scope.get('route')
+            recorder.record({
+                'time': started,
+                'duration': time.perf_counter() - clock,
+                'method': scope['method'],
+                'path': scope['path'],
+                'route': route.path if route is not None else None,
+                'query': scope['query_string'].decode('latin-1'),
+                'headers': {name.decode('latin-1'): value.decode('latin-1') for name, value in scope['headers']},
+                'body': None if request['truncated'] else bytes(request['body']),
+                'status': response['status'],
+                'response': bytes(response['body']) if scope['method'] != 'GET' else b'',
+            })
+
+
+@lru_cache
+def get_recorder(config_file_name: str):
+    with open(config_file_name, 'r') as file:
+        config = json.load(file)
+    if 'capture' not in config:
+        return None
+    settings = dict(config['capture'])
+    settings.pop('path', None)
+    return Recorder(get_capture_path(config_file_name, config), **settings)
+
+
+def stop_capture(app: FastAPI):
+    # Only a recorder that was started is closed.
+    if get_recorder.cache_info().currsize:
+        recorder = get_recorder(resolve(app, get_config_filename))
+        if recorder is not None:
+            recorder.close()
@@ -0,0 +1,100 @@
+# pylint: disable=missing-module-docstring, missing-function-docstring, missing-class-docstring
+import queue
+import threading
+import time
+
+from concurrent.futures import Future
+
+
+# Writes from concurrent requests are queued and a background thread runs
+# every write that arrives within `max_delay` seconds (up to `max_rows`) in one
+# transaction, so the commit latency is paid once per batch instead of once
+# per row. Each write runs under its own savepoint: a failing row only fails
+# its own caller.
+class WriteCoalescer:
+    def __init__(self, connect, max_delay: float = 0.005, max_rows: int = 100):
+        self.max_delay = max_delay
+        self.max_rows = max_rows
+        self.__connect = connect
+        self.__queue = queue.Queue()
+        self.__lock = threading.Lock()
+        self.__thread = None
+
+    def submit(self, query: str, params: tuple) -> Future:
+        future = Future()
+        self.__start()
+        self.__queue.put((query, params, future))
+        return future
+
+    def execute(self, query: str, params: tuple):
+        return self.submit(query, params).result()
+
+    def __start(self):
+        with self.__lock:
+            if self.__thread is None:
+                self.__thread = threading.Thread(
+                    target=self.__run,
+                    name='write-coalescer',
+                    daemon=True,
+                )
+                self.__thread.start()
+
+    def __run(self):
+        connection = None
+        while True:
+            batch = self.__next_batch()
+            try:
+                if connection is None:
+                    connection = self.__connect()
+                self.__write(connection, batch)
+            except Exception as exception:  # pylint: disable=broad-except
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(exception)
+                if connection is not None:
+                    connection.close()
+                connection = None
+
+    def __next_batch(self):
+        batch = [self.__queue.get()]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_rows:
+            timeout = deadline - time.monotonic()
+            try:
+                if timeout > 0:
+                    batch.append(self.__queue.get(timeout=timeout))
+                else:
+                    batch.append(self.__queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    @staticmethod
+    def __write(connection, batch):
+        failed = set()
+        with connection.cursor() as cursor:
+            for index, (query, params, future) in enumerate(batch):
+                cursor.execute(f'SAVEPOINT row_{index}')
+                try:
+                    cursor.execute(query, params)
+                except Exception as exception:  # pylint: disable=broad-except
+                    cursor.execute(f'ROLLBACK TO SAVEPOINT row_{index}')
+                    future.set_exception(exception)
+                    failed.add(index)
+        connection.commit()
+
+        for index, (_, _, future) in enumerate(batch):
+            if index not in failed:
+                future.set_result(None)
+
+
+def create_coalescer(config: dict, backend):
+    if 'group_commit' not in config:
+        return None
+    # The writer keeps its connection for good, so it is opened outside the
+    # pool rather than holding one of the pool's slots forever.
+    return WriteCoalescer(
+        backend.open,
+        max_delay=config['group_commit'].get('max_delay', 0.005),
+        max_rows=config['group_commit'].get('max_rows', 100),
+    )
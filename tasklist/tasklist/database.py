@@ -1,202 +1,1208 @@
 # pylint: disable=missing-module-docstring, missing-function-docstring, missing-class-docstring
+import contextlib
+import datetime
+import itertools
 import json
+import os
+import re
+import threading
+import time
 import uuid
 
-from functools import lru_cache
+from functools import lru_cache, partial
 
 import mysql.connector as conn
 
-from fastapi import Depends
+from fastapi import Depends, Request, Response
+from fastapi.encoders import jsonable_encoder
 
-from utils.utils import get_config_filename, get_app_secrets_filename
+from utils.utils import (
+    get_app_secrets_filename,
+    get_config_filename,
+    get_write_behind_log_dir,
+)
 
+from .backends import (
+    ERRORS,
+    ConnectionPool,
+    ImportFailed,
+    PoolTimeout,
+    QueryTimeout,
+    VersionConflict,
+    create_backend,
+    is_timeout,
+    nocase_key,
+    remaining,
+    set_deadline,
+)
+from .bulk import Counted, batched
+from .coalescer import WriteCoalescer, create_coalescer
+from .deadlines import get_deadline
+from .feed import ChangeFeed, get_feed
 from .models import Task, User
+from .sharding import ShardMap, ShardedDBSession, create_shard_map, name_order
+from .singleflight import SingleFlight, get_single_flight
+from .writebehind import WriteBehindCache, WriteLog
 
 
-class DBSession:
-    def __init__(self, connection: conn.MySQLConnection):
+PRIMARY_COOKIE = 'tasklist_primary'
+
+
+# UUIDs are stored as BINARY(16) and converted here rather than with MySQL's
+# UUID_TO_BIN/BIN_TO_UUID, so the same queries run on every backend.
+def to_bin(value):
+    if value is None:
+        return None
+    if not isinstance(value, uuid.UUID):
+        value = uuid.UUID(str(value))
+    return value.bytes
+
+
+def from_bin(value):
+    if value is None:
+        return None
+    return str(uuid.UUID(bytes=bytes(value)))
+
+
+def uuid7():
+    # RFC 9562 UUIDv7: a 48-bit millisecond Unix timestamp followed by the
+    # sub-millisecond fraction and random bits. Keys generated later sort
+    # after earlier ones, so inserts append to the right edge of the
+    # clustered index instead of splitting random pages.
+    nanoseconds = time.time_ns()
+    milliseconds, fraction = divmod(nanoseconds, 1_000_000)
+    value = milliseconds << 80
+    value |= 0x7 << 76
+    value |= (fraction * 4096 // 1_000_000) << 64
+    value |= 0x2 << 62
+    value |= int.from_bytes(os.urandom(8), 'big') >> 2
+    return uuid.UUID(int=value)
+
+
+TASK_FIELDS = ('description', 'completed', 'user_uuid', 'priority', 'due_date')
+USER_FIELDS = ('name', )
+TASK_COLUMNS = ', '.join(('uuid', ) + TASK_FIELDS)
+USER_COLUMNS = ', '.join(('uuid', ) + USER_FIELDS)
+TASK_SORTS = ('due_date', 'priority')
+TASK_TABLES = ('tasks', 'tasks_archive')
+ARCHIVE_COLUMNS = f'{TASK_COLUMNS}, version, completed_at, created_at, updated_at'
+PATCH_ATTEMPTS = 5
+
+
+def check_fields(fields, allowed):
+    # Field names end up in the SQL column list, so only known ones pass.
+    if fields is None:
+        return allowed
+    unknown = set(fields) - set(allowed) - {'uuid'}
+    if unknown:
+        raise ValueError(f'Unknown fields: {", ".join(sorted(unknown))}')
+    return tuple(field for field in allowed if field in fields)
+
+
+def check_sort(sort):
+    # `field` sorts ascending, `-field` descending. Only columns with a
+    # (user_uuid, completed, column) index are accepted.
+    if sort is None:
+        return None, False
+    column = sort[1:] if sort.startswith('-') else sort
+    if column not in TASK_SORTS:
+        raise ValueError(f'Unknown sort field: {column}')
+    return column, sort.startswith('-')
+
+
+def utc_now():
+    # Naive UTC, the type DATETIME columns take on every backend.
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+def escape_like(value):
+    return value.replace('!', '!!').replace('%', '!%').replace('_', '!_')
+
+
+SELECT_START = re.compile(r'^\s*SELECT\b')
+
+
+def limit_select(query, deadline):
+    # MySQL cancels a SELECT still running when its MAX_EXECUTION_TIME hint
+    # runs out; to SQLite the hint is a comment.
+    milliseconds = max(int(remaining(deadline) * 1000), 1)
+    return SELECT_START.sub(f'SELECT /*+ MAX_EXECUTION_TIME({milliseconds}) */', query, count=1)
+
+
+UUID_GENERATORS = {
+    4: uuid.uuid4,
+    7: uuid7,
+}
+
+
+class ReplicaConnection:
+    # A connection to one replica. A read that fails on it takes the
+    # replica out of rotation.
+    def __init__(self, replicas, replica, connection):
+        self.__replicas = replicas
+        self.replica = replica
         self.connection = connection
 
-    def read_tasks(self, completed: bool = None):
-        query = 'SELECT BIN_TO_UUID(uuid), description, completed, BIN_TO_UUID(user_uuid) FROM tasks'
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+    def fail(self):
+        self.__replicas.mark_down(self.replica)
+        self.close()
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+class ReplicaPool:
+    def __init__(
+            self,
+            hosts,
+            retry_seconds: float = 30.0,
+            connect_timeout: int = 2,
+            read_your_writes: bool = False,
+            lag_seconds: int = 5,
+            pool_size: int = None,
+            pool_timeout: float = 30.0,
+            connect=conn.connect,
+    ):
+        self.hosts = list(hosts)
+        self.retry_seconds = retry_seconds
+        self.connect_timeout = connect_timeout
+        self.read_your_writes = read_your_writes
+        self.lag_seconds = lag_seconds
+        self.pool_size = pool_size
+        self.pool_timeout = pool_timeout
+        self.__connect = connect
+        self.__pools = {}
+        self.__next = 0
+        self.__down_until = {}
+        self.__lock = threading.Lock()
+
+    def connect(self, credentials: dict):
+        for host in self.__candidates():
+            try:
+                connection = self.__open(host, credentials)
+                if connection.is_connected():
+                    self.__mark_up(host)
+                    return ReplicaConnection(self, host, connection)
+                connection.close()
+            except PoolTimeout:
+                # Busy rather than down.
+                continue
+            except conn.Error:
+                pass
+            self.mark_down(host)
+
+        # Every replica is down: the caller falls back to the primary.
+        return None
+
+    def is_healthy(self, host):
+        with self.__lock:
+            return self.__down_until.get(host, 0) <= time.monotonic()
+
+    def mark_down(self, host):
+        with self.__lock:
+            self.__down_until[host] = time.monotonic() + self.retry_seconds
+
+    def __open(self, host, credentials):
+        connect = partial(self.__connect, **{
+            **credentials,
+            **self.__address(host),
+            'connection_timeout': self.connect_timeout,
+        })
+        if not self.pool_size:
+            return connect()
+        # Like the primary's, each replica's connections are pooled.
+        with self.__lock:
+            if host not in self.__pools:
+                self.__pools[host] = ConnectionPool(connect, self.pool_size, timeout=self.pool_timeout)
+            pool = self.__pools[host]
+        return pool.acquire()
+
+    @staticmethod
+    def __address(host):
+        # Replicas may be given as 'host' or 'host:port'.
+        name, _, port = host.partition(':')
+        if port:
+            return {'host': name, 'port': int(port)}
+        return {'host': name}
+
+    def __candidates(self):
+        with self.__lock:
+            start = self.__next
+            self.__next = (self.__next + 1) % max(len(self.hosts), 1)
+        rotated = self.hosts[start:] + self.hosts[:start]
+        return [host for host in rotated if self.is_healthy(host)]
+
+    def __mark_up(self, host):
+        with self.__lock:
+            self.__down_until.pop(host, None)
+
+
+class DBSession:
+    def __init__(
+            self,
+            connect,
+            read_connect=None,
+            on_write=None,
+            feed=None,
+            coalescer=None,
+            new_uuid=uuid.uuid4,
+            single_flight=None,
+            deadline: float = None,
+    ):
+        self.__connect = connect
+        self.__read_connect = read_connect
+        self.__on_write = on_write
+        self.__feed = feed
+        self.__coalescer = coalescer
+        self.__new_uuid = new_uuid
+        self.__single_flight = single_flight
+        self.__deadline = deadline
+        self.__changes = []
+        self.__connection = None
+        self.__read_connection = None
+        self.__wrote = False
+        self.__transaction = False
+        self.__savepoint = None
+
+    @property
+    def connection(self):
+        self.__check_deadline()
+        if self.__connection is None:
+            self.__connection = self.__open(self.__connect)
+        return self.__connection
+
+    @property
+    def read_connection(self):
+        # Once this session has written, keep reading from the primary so
+        # callers always see their own writes.
+        if self.__wrote or self.__transaction or self.__read_connect is None:
+            return self.connection
+        if self.__read_connection is None:
+            self.__read_connection = self.__open(self.__read_connect)
+            if self.__read_connection is None:
+                self.__read_connect = None
+                return self.connection
+        return self.__read_connection
+
+    def close(self):
+        for connection in (self.__connection, self.__read_connection):
+            if connection is not None:
+                if self.__deadline is not None:
+                    # Pooled connections go back without the bound.
+                    try:
+                        set_deadline(connection, None)
+                    except Exception:  # pylint: disable=broad-except
+                        pass
+                connection.close()
+        self.__connection = None
+        self.__read_connection = None
+
+    def __open(self, connect):
+        connection = connect()
+        if connection is not None and self.__deadline is not None:
+            set_deadline(connection, self.__deadline)
+        return connection
+
+    def __check_deadline(self):
+        # Nothing more is sent once the request is out of time.
+        if self.__deadline is not None and remaining(self.__deadline) <= 0:
+            raise QueryTimeout()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        # The writes of the block are committed together when it exits and
+        # rolled back together when it raises. Reads see them, and
+        # subscribers only hear about them once they are committed.
+        if self.__transaction:
+            raise ValueError('Transactions cannot be nested')
+        self.__transaction = True
+        try:
+            yield self
+        except BaseException:
+            self.__transaction = False
+            if self.__connection is not None:
+                self.__connection.rollback()
+            self.__changes = []
+            raise
+        self.__transaction = False
+        self.__commit()
+
+    @contextlib.contextmanager
+    def savepoint(self):
+        # Within a transaction, a block that raises undoes only its own
+        # writes. No savepoint is needed while the connection is not open:
+        # rolling back everything then undoes just the block.
+        changes = len(self.__changes)
+        self.__savepoint = self.__connection is not None
+        if self.__savepoint:
+            with self.connection.cursor() as cursor:
+                cursor.execute('SAVEPOINT operation')
+        try:
+            yield self
+        except BaseException:
+            self.__rollback()
+            del self.__changes[changes:]
+            raise
+        finally:
+            opened, self.__savepoint = self.__savepoint, None
+        if opened:
+            with self.connection.cursor() as cursor:
+                cursor.execute('RELEASE SAVEPOINT operation')
+
+    def read_tasks(
+            self,
+            completed: bool = None,
+            fields=None,
+            user_uuid: uuid.UUID = None,
+            sort: str = None,
+            limit: int = None,
+            include_archived: bool = False,
+    ):
+        fields = check_fields(fields, TASK_FIELDS)
+        column, descending = check_sort(sort)
+        # Archived tasks are all completed.
+        tables = TASK_TABLES if include_archived and completed is not False else TASK_TABLES[:1]
+        columns = ('uuid', ) + fields
+        if len(tables) > 1 and column is not None and column not in fields:
+            # The ORDER BY of a UNION can only name selected columns.
+            columns += (column, )
+        conditions = []
+        params = []
+        if user_uuid is not None:
+            conditions.append('user_uuid = %s')
+            params.append(to_bin(user_uuid))
         if completed is not None:
-            query += ' WHERE completed = '
-            if completed:
-                query += 'True'
-            else:
-                query += 'False'
+            conditions.append('completed = %s')
+            params.append(completed)
+        where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+        query = ' UNION ALL '.join(f'SELECT {", ".join(columns)} FROM {table}{where}' for table in tables)
+        params *= len(tables)
+        if column is not None:
+            # The uuid tie-break keeps pages stable; it is the primary key
+            # suffix of every secondary index, so the order is still the
+            # index order.
+            direction = ' DESC' if descending else ''
+            query += f' ORDER BY {column}{direction}, uuid{direction}'
+        if limit is not None:
+            query += ' LIMIT %s'
+            params.append(int(limit))
 
-        with self.connection.cursor() as cursor:
-            cursor.execute(query)
-            db_results = cursor.fetchall()
+        db_results = self.__select(query, params, 'task')
 
         return {
-            uuid_: Task(
-                description=field_description,
-                completed=bool(field_completed),
-                user_uuid=field_user_uuid,
-            )
-            for uuid_, field_description, field_completed, field_user_uuid in db_results
+            from_bin(uuid_): self.__to_task(fields, values[:len(fields)])
+            for uuid_, *values in db_results
         }
 
-    def create_task(self, item: Task):
-        uuid_ = uuid.uuid4()
+    def create_task(
+            self,
+            item: Task,
+            uuid_: uuid.UUID = None,
+            version: int = 1,
+            action: str = 'create',
+            created_at: datetime.datetime = None,
+            completed_at: datetime.datetime = None,
+    ):
+        # A task moved from another shard keeps its timestamps. A None action
+        # is not announced on the feed; the caller announces the whole move.
+        if uuid_ is None:
+            uuid_ = self.__new_uuid()
+
+        now = utc_now()
+        self.__insert(
+            f'INSERT INTO tasks ({TASK_COLUMNS}, version, completed_at, created_at, updated_at) '
+            'VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)',
+            self.__task_row(uuid_, item) + (
+                version,
+                (completed_at or now) if item.completed else None,
+                created_at or now,
+                now,
+            ),
+        )
+        self.__changed('task', action, uuid_, item.user_uuid, item)
+        self.__commit()
 
+        return uuid_
+
+    def read_task(self, uuid_: uuid.UUID, fields=None, with_version=False):
+        task, version = self.__read_task(uuid_, None, fields)
+        return (task, version) if with_version else task
+
+    def read_task_times(self, uuid_: uuid.UUID):
+        # The version, creation and completion time of a task, for moving
+        # it to another shard.
         with self.connection.cursor() as cursor:
             cursor.execute(
-                'INSERT INTO tasks VALUES (UUID_TO_BIN(%s), %s, %s, UUID_TO_BIN(%s))',
-                (str(uuid_), item.description, item.completed, str(item.user_uuid)),
+                'SELECT version, created_at, completed_at FROM tasks WHERE uuid=%s',
+                (to_bin(uuid_), ),
             )
-        self.connection.commit()
+            result = cursor.fetchone()
+        if result is None:
+            raise KeyError()
+        return result
 
-        return uuid_
+    def announce_task(self, action: str, uuid_: uuid.UUID, item: Task):
+        # One feed event for a write made through several sessions, such as
+        # a task moved to another shard; sent once the write is committed.
+        self.__changed('task', action, uuid_, item.user_uuid, item)
+        self.__publish()
+
+    def lookup_tasks(self, uuids, fields=None):
+        fields = check_fields(fields, TASK_FIELDS)
+        return {
+            from_bin(uuid_): self.__to_task(fields, values)
+            for uuid_, *values in self.__lookup('tasks', fields, uuids)
+        }
+
+    def __read_task(self, uuid_: uuid.UUID, connection, fields=None):
+        fields = check_fields(fields, TASK_FIELDS)
+        results = self.__select(
+            f'''
+            SELECT {", ".join(("uuid", ) + fields + ("version", ))}
+            FROM tasks
+            WHERE uuid = %s
+            ''',
+            (to_bin(uuid_), ),
+            'task',
+            to_bin(uuid_),
+            connection,
+        )
 
-    def read_task(self, uuid_: uuid.UUID):
-        if not self.__task_exists(uuid_):
+        if not results:
             raise KeyError()
 
+        return self.__to_task(fields, results[0][1:-1]), results[0][-1]
+
+    @staticmethod
+    def __to_task(fields, values):
+        values = dict(zip(fields, values))
+        if 'completed' in values:
+            values['completed'] = bool(values['completed'])
+        if 'user_uuid' in values:
+            values['user_uuid'] = from_bin(values['user_uuid'])
+        return Task(**values)
+
+    def replace_task(self, uuid_, item, action='replace', version: int = None):
+        # completed_at keeps the time the task was first completed, which is
+        # what the archive job ages tasks by.
+        now = utc_now()
+        with self.connection.cursor() as cursor:
+            self.__tombstone_moved(cursor, [(to_bin(uuid_), to_bin(item.user_uuid))], now)
+        try:
+            version = self.__update(
+                'tasks',
+                'description=%s, completed=%s, user_uuid=%s, priority=%s, due_date=%s, '
+                'completed_at=CASE WHEN %s THEN COALESCE(completed_at, %s) END, updated_at=%s',
+                self.__task_row(uuid_, item)[1:] + (item.completed, now, now),
+                uuid_,
+                version,
+                self.__task_exists,
+            )
+        except (KeyError, VersionConflict):
+            # The tombstone must not outlive a write that did not happen.
+            self.__rollback()
+            raise
+        self.__changed('task', action, uuid_, item.user_uuid, item)
+        self.__commit()
+        return version
+
+    def alter_task(self, uuid_, item, version: int = None):
+        return self.__patch(
+            lambda: self.__read_task(uuid_, self.connection),
+            lambda new_item, current: self.replace_task(uuid_, new_item, 'patch', current),
+            item,
+            version,
+        )
+
+    def remove_task(self, uuid_, version: int = None, action: str = 'delete'):
         with self.connection.cursor() as cursor:
             cursor.execute(
-                '''
-                SELECT description, completed, BIN_TO_UUID(user_uuid)
-                FROM tasks
-                WHERE uuid = UUID_TO_BIN(%s)
-                ''',
-                (str(uuid_), ),
+                'SELECT user_uuid, version FROM tasks WHERE uuid=%s',
+                (to_bin(uuid_), ),
             )
             result = cursor.fetchone()
+            if result is None:
+                raise KeyError()
+
+            query = 'DELETE FROM tasks WHERE uuid=%s'
+            params = (to_bin(uuid_), )
+            if version is not None:
+                query += ' AND version=%s'
+                params += (version, )
+            cursor.execute(query, params)
+            if not cursor.rowcount:
+                raise KeyError() if version is None else VersionConflict()
+            cursor.execute(
+                'INSERT INTO task_tombstones (uuid, user_uuid, deleted_at) VALUES (%s, %s, %s)',
+                (to_bin(uuid_), result[0], utc_now()),
+            )
+        self.__changed('task', action, uuid_, from_bin(result[0]))
+        self.__commit()
 
-        return Task(description=result[0], completed=bool(result[1]), user_uuid=str(result[2]))
+    def remove_all_tasks(self, chunk_size: int = 1000, pause: float = 0.0, on_chunk=None):
+        for table in TASK_TABLES:
+            self.__delete_chunks(table, None, (), chunk_size, pause, on_chunk)
+        self.__changed('task', 'clear')
+        self.__commit()
 
-    def replace_task(self, uuid_, item):
-        if not self.__task_exists(uuid_):
-            raise KeyError()
+    def archive_tasks(self, after_days: float, chunk_size: int = 1000, pause: float = 0.0, on_chunk=None):
+        # Completed tasks move to tasks_archive once they have been completed
+        # for `after_days` days, a chunk per transaction. The condition is
+        # repeated on the copy and the delete so a task reopened in between
+        # stays where it is.
+        condition = 'completed = %s AND completed_at < %s'
+        params = (True, utc_now() - datetime.timedelta(days=after_days))
 
-        with self.connection.cursor() as cursor:
+        def move(cursor, keys):
+            placeholders = ", ".join(["%s"] * len(keys))
             cursor.execute(
-                '''
-                UPDATE tasks SET description=%s, completed=%s, user_uuid=UUID_TO_BIN(%s)
-                WHERE uuid=UUID_TO_BIN(%s)
+                f'''
+                INSERT INTO tasks_archive ({ARCHIVE_COLUMNS})
+                SELECT {ARCHIVE_COLUMNS} FROM tasks
+                WHERE {condition} AND uuid IN ({placeholders})
                 ''',
-                (item.description, item.completed, str(item.user_uuid), str(uuid_)),
+                params + tuple(keys),
+            )
+            self.__tombstone(cursor, f'{condition} AND uuid IN ({placeholders})', params + tuple(keys))
+            cursor.execute(
+                f'DELETE FROM tasks WHERE {condition} AND uuid IN ({placeholders})',
+                params + tuple(keys),
             )
-        self.connection.commit()
 
-    def remove_task(self, uuid_):
-        if not self.__task_exists(uuid_):
-            raise KeyError()
+        archived = self.__chunks('tasks', condition, params, move, chunk_size, pause, on_chunk)
+        if archived:
+            self.__changed('task', 'archive')
+            self.__publish()
+        return archived
 
-        with self.connection.cursor() as cursor:
+    def __delete_chunks(self, table, condition, params, chunk_size, pause, on_chunk):
+        def delete(cursor, keys):
+            if table == 'tasks':
+                self.__tombstone(cursor, f'uuid IN ({", ".join(["%s"] * len(keys))})', keys)
             cursor.execute(
-                'DELETE FROM tasks WHERE uuid=UUID_TO_BIN(%s)',
-                (str(uuid_), ),
+                f'DELETE FROM {table} WHERE uuid IN ({", ".join(["%s"] * len(keys))})',
+                keys,
             )
-        self.connection.commit()
 
-    def remove_all_tasks(self):
-        with self.connection.cursor() as cursor:
-            cursor.execute('DELETE FROM tasks')
-        self.connection.commit()
+        return self.__chunks(table, condition, params, delete, chunk_size, pause, on_chunk)
 
-    def __task_exists(self, uuid_: uuid.UUID):
-        with self.connection.cursor() as cursor:
+    def __chunks(self, table, condition, params, apply, chunk_size, pause, on_chunk):
+        # One short transaction per chunk keeps locks, undo log and
+        # replication lag bounded; the pause leaves room for other writers.
+        # Keys are selected first because SQLite has no DELETE ... LIMIT.
+        query = f'SELECT uuid FROM {table}'
+        if condition is not None:
+            query += f' WHERE {condition}'
+        query += ' LIMIT %s'
+
+        done = 0
+        while True:
+            with self.connection.cursor() as cursor:
+                cursor.execute(query, params + (chunk_size, ))
+                keys = [key for key, in cursor.fetchall()]
+                if keys:
+                    apply(cursor, keys)
+            self.__commit()
+            done += len(keys)
+            if keys and on_chunk is not None:
+                on_chunk(len(keys))
+            if len(keys) < chunk_size:
+                return done
+            time.sleep(pause)
+
+    def export_tasks(self, batch_size: int = 1000):
+        # Archived tasks are exported too, and imported back as live ones.
+        for rows in itertools.chain.from_iterable(
+                self.__export(table, TASK_FIELDS, batch_size) for table in TASK_TABLES
+        ):
+            yield [
+                {
+                    'uuid': from_bin(uuid_),
+                    'description': description,
+                    'completed': bool(completed),
+                    'user_uuid': from_bin(user_uuid),
+                    'priority': priority,
+                    'due_date': None if due_date is None else str(due_date),
+                }
+                for uuid_, description, completed, user_uuid, priority, due_date in rows
+            ]
+
+    def import_tasks(self, items, batch_size: int = 5000):
+        now = utc_now()
+        return self.__import(
+            'task',
+            f'INSERT INTO tasks ({TASK_COLUMNS}, completed_at, created_at, updated_at) '
+            'VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)',
+            (
+                self.__task_row(uuid_, item) + (now if item.completed else None, now, now)
+                for uuid_, item in items
+            ),
+            batch_size,
+        )
+
+    def read_task_changes(self, since: datetime.datetime = None, fields=None, user_uuid: uuid.UUID = None):
+        # The tasks written after `since` and the keys of the tasks deleted
+        # (or moved to another user) after it; every task when `since` is
+        # None. A task that came back after its tombstone is only returned
+        # as a task.
+        fields = check_fields(fields, TASK_FIELDS)
+        conditions = []
+        params = []
+        if user_uuid is not None:
+            conditions.append('user_uuid = %s')
+            params.append(to_bin(user_uuid))
+        if since is None:
+            return self.__changed_tasks(fields, conditions, params), []
+
+        tasks = self.__changed_tasks(fields, conditions + ['updated_at > %s'], params + [since])
+        deleted = self.__select(
+            'SELECT DISTINCT uuid FROM task_tombstones WHERE ' + ' AND '.join(conditions + ['deleted_at > %s']),
+            params + [since],
+            'task',
+        )
+        return tasks, sorted({from_bin(uuid_) for uuid_, in deleted} - tasks.keys())
+
+    def __changed_tasks(self, fields, conditions, params):
+        query = f'SELECT {", ".join(("uuid", ) + fields)} FROM tasks'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        return {
+            from_bin(uuid_): self.__to_task(fields, values)
+            for uuid_, *values in self.__select(query, params, 'task')
+        }
+
+    def purge_tombstones(self, before: datetime.datetime, chunk_size: int = 1000):
+        # Clients that last synced before `before` have to start over, so
+        # older tombstones are no longer needed.
+        purged = 0
+        while True:
+            with self.connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT id FROM task_tombstones WHERE deleted_at < %s LIMIT %s',
+                    (before, chunk_size),
+                )
+                keys = [key for key, in cursor.fetchall()]
+                if keys:
+                    cursor.execute(
+                        f'DELETE FROM task_tombstones WHERE id IN ({", ".join(["%s"] * len(keys))})',
+                        keys,
+                    )
+            self.__commit()
+            purged += len(keys)
+            if len(keys) < chunk_size:
+                return purged
+
+    @staticmethod
+    def __tombstone(cursor, condition, params):
+        # Written in the transaction that deletes the tasks, before it does.
+        cursor.execute(
+            f'''
+            INSERT INTO task_tombstones (uuid, user_uuid, deleted_at)
+            SELECT uuid, user_uuid, %s FROM tasks WHERE {condition}
+            ''',
+            (utc_now(), ) + tuple(params),
+        )
+
+    @staticmethod
+    def __tombstone_moved(cursor, rows, now):
+        # A task that changes user is gone for syncs of its old user.
+        cursor.executemany(
+            '''
+            INSERT INTO task_tombstones (uuid, user_uuid, deleted_at)
+            SELECT uuid, user_uuid, %s FROM tasks
+            WHERE uuid = %s AND user_uuid IS NOT NULL AND (%s IS NULL OR user_uuid <> %s)
+            ''',
+            [(now, key, user_uuid, user_uuid) for key, user_uuid in rows],
+        )
+
+    @staticmethod
+    def __task_row(uuid_, item):
+        return (
+            to_bin(uuid_),
+            item.description,
+            item.completed,
+            to_bin(item.user_uuid),
+            item.priority,
+            item.due_date,
+        )
+
+    def __task_exists(self, uuid_: uuid.UUID, connection=None):
+        if connection is None:
+            connection = self.connection
+
+        with connection.cursor() as cursor:
             cursor.execute(
                 '''
                 SELECT EXISTS(
-                    SELECT 1 FROM tasks WHERE uuid=UUID_TO_BIN(%s)
+                    SELECT 1 FROM tasks WHERE uuid=%s
                 )
                 ''',
-                (str(uuid_), ),
+                (to_bin(uuid_), ),
             )
             results = cursor.fetchone()
             found = bool(results[0])
 
         return found
 
-# User
+    def __update(self, table, assignments, params, uuid_, version, exists):
+        # The version check and the write are one statement, so concurrent
+        # writers cannot both succeed against the same version and no row
+        # lock is held between reading and writing.
+        query = f'UPDATE {table} SET {assignments}, version=version + 1 WHERE uuid=%s'
+        params = tuple(params) + (to_bin(uuid_), )
+        if version is not None:
+            query += ' AND version=%s'
+            params += (version, )
+
+        with self.connection.cursor() as cursor:
+            cursor.execute(query, params)
+            if cursor.rowcount and version is not None:
+                return version + 1
+            if cursor.rowcount:
+                cursor.execute(f'SELECT version FROM {table} WHERE uuid=%s', (to_bin(uuid_), ))
+                return cursor.fetchone()[0]
+
+        if not exists(uuid_):
+            raise KeyError()
+        raise VersionConflict()
+
+    def __patch(self, read, replace, item, version):
+        # A read-modify-write without If-Match is retried from a fresh
+        # transaction when another writer got in between, so concurrent
+        # patches of different fields never lose each other's updates.
+        for _ in range(PATCH_ATTEMPTS):
+            old_item, current = read()
+            if version is not None and version != current:
+                raise VersionConflict()
+            new_item = old_item.copy(update=item.dict(exclude_unset=True))
+            try:
+                return replace(new_item, current)
+            except VersionConflict:
+                if version is not None:
+                    raise
+                self.__rollback()
+        raise VersionConflict()
+
+    def __lookup(self, table, fields, uuids):
+        # One IN query instead of a round trip per key.
+        keys = sorted({to_bin(uuid_) for uuid_ in uuids})
+        if not keys:
+            return []
+
+        return self.__select(
+            f'''
+            SELECT {", ".join(("uuid", ) + fields)}
+            FROM {table}
+            WHERE uuid IN ({", ".join(["%s"] * len(keys))})
+            ''',
+            keys,
+            table[:-1],
+        )
+
+    def __select(self, query, params, kind, key=None, connection=None):
+        # Reads on the read connection go through the single-flight layer,
+        # keyed by statement and parameters: callers that ask for the same
+        # rows while the query is running share its result, and only the
+        # first one opens a connection. `key` is the row a point read is
+        # about, for invalidation by writes.
+        def run(target):
+            with target.cursor() as cursor:
+                if self.__deadline is None:
+                    cursor.execute(query, params)
+                else:
+                    self.__check_deadline()
+                    cursor.execute(limit_select(query, self.__deadline), params)
+                return cursor.fetchall()
+
+        def fetch():
+            target = self.read_connection if connection is None else connection
+            try:
+                return run(target)
+            except ERRORS as exception:
+                if target is not self.__read_connection or is_timeout(exception):
+                    raise
+            # The replica failed: this session reads from the primary from
+            # now on, and other sessions skip the replica for a while.
+            self.__read_connection.fail()
+            self.__read_connection = None
+            self.__read_connect = None
+            return run(self.connection)
+
+        if connection is not None or self.__single_flight is None or self.__transaction:
+            # Uncommitted writes of a transaction must not leak to others.
+            return fetch()
+        # Sessions that read from the primary never share with replica reads.
+        primary = self.__wrote or self.__read_connect is None
+        # A shared read runs under the deadline of the session that started
+        # it: the others stop waiting at their own deadline, and redo the
+        # read under it when it timed out.
+        return self.__single_flight.do(
+            (self.__connect, primary, query, tuple(params)),
+            kind,
+            key,
+            fetch,
+            timeout=None if self.__deadline is None else remaining(self.__deadline),
+            retry=lambda error: isinstance(error, QueryTimeout) or is_timeout(error),
+        )
+
+    def __export(self, table, fields, batch_size):
+        # Rows are streamed from an unbuffered cursor, one batch at a time.
+        with self.read_connection.cursor() as cursor:
+            cursor.execute(f'SELECT {", ".join(("uuid", ) + fields)} FROM {table}')
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    return
+                yield rows
+
+    def __import(self, kind, query, rows, batch_size):
+        imported = 0
+        rows = Counted(rows)
+        try:
+            for batch in batched(rows, batch_size):
+                try:
+                    with self.connection.cursor() as cursor:
+                        cursor.executemany(query, batch)
+                except ERRORS as exception:
+                    if is_timeout(exception):
+                        raise
+                    row = self.__failing_row(query, batch)
+                    raise ImportFailed(exception, None if row is None else imported + row, imported) from exception
+                self.__commit()
+                imported += len(batch)
+        except ImportFailed:
+            raise
+        except ValueError as exception:
+            raise ImportFailed(exception, rows.count + 1, imported) from exception
+        finally:
+            if imported:
+                self.__changed(kind, 'import')
+                self.__publish()
+
+        return imported
+
+    def __failing_row(self, query, batch):
+        # executemany does not say which row it failed on: the batch is
+        # rolled back and replayed a row at a time up to the one that fails.
+        self.connection.rollback()
+        try:
+            with self.connection.cursor() as cursor:
+                for row, params in enumerate(batch, 1):
+                    try:
+                        cursor.execute(query, params)
+                    except ERRORS:
+                        return row
+            return None
+        finally:
+            self.connection.rollback()
 
-    def read_users(self):
-        query = 'SELECT BIN_TO_UUID(uuid), name FROM users'
+    def __changed(self, kind, action, uuid_=None, user_uuid=None, item=None):
+        if self.__feed is not None or self.__single_flight is not None:
+            self.__changes.append((
+                kind,
+                action,
+                # Canonical keys, which is what feed filters compare with.
+                None if uuid_ is None else str(uuid.UUID(str(uuid_))),
+                None if user_uuid is None else str(uuid.UUID(str(user_uuid))),
+                None if item is None else jsonable_encoder(item),
+            ))
+
+    def __insert(self, query, params):
+        if self.__coalescer is None or self.__transaction:
+            with self.connection.cursor() as cursor:
+                cursor.execute(query, params)
+        else:
+            # Committed by the coalescer together with concurrent inserts.
+            self.__coalescer.execute(query, params)
+
+    def __rollback(self):
+        # Inside a transaction only the current savepoint is undone; without
+        # one the error leaves the transaction, which rolls back as a whole.
+        if self.__savepoint:
+            with self.connection.cursor() as cursor:
+                cursor.execute('ROLLBACK TO SAVEPOINT operation')
+        elif not self.__transaction or self.__savepoint is not None:
+            self.connection.rollback()
+
+    def __commit(self):
+        if self.__transaction:
+            # Committed when the transaction block exits.
+            return
+        if self.__connection is not None:
+            self.connection.commit()
+        self.__wrote = True
+        if self.__on_write is not None:
+            self.__on_write()
+
+        self.__publish()
+
+    def __publish(self):
+        # Subscribers only hear about changes, and in-flight reads are only
+        # detached, once the changes are durable.
+        if self.__transaction:
+            return
+        changes, self.__changes = self.__changes, []
+        for change in changes:
+            if self.__single_flight is not None:
+                kind, action, uuid_ = change[:3]
+                self.__single_flight.invalidate(kind, to_bin(uuid_))
+                if kind == 'user' and action in ('delete', 'clear'):
+                    # The user's tasks went with it.
+                    self.__single_flight.invalidate('task')
+            if self.__feed is not None and change[1] is not None:
+                self.__feed.publish(*change)
+
+    def read_rows(self):
+        # Every task and user with its version, to fill the write-behind cache.
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'SELECT {TASK_COLUMNS}, version FROM tasks')
+            tasks = {
+                from_bin(uuid_): (self.__to_task(TASK_FIELDS, values[:-1]), values[-1])
+                for uuid_, *values in cursor.fetchall()
+            }
+            cursor.execute(f'SELECT {USER_COLUMNS}, version FROM users')
+            users = {
+                from_bin(uuid_): (User(**dict(zip(USER_FIELDS, values[:-1]))), values[-1])
+                for uuid_, *values in cursor.fetchall()
+            }
+        return tasks, users
+
+    def write_rows(self, rows):
+        # Applies (table, uuid, item, version) rows flushed by the write-behind
+        # cache in one transaction; a None item deletes the row. Users are
+        # written before the tasks that may refer to them and deleted after.
+        now = utc_now()
+        upserts = {'users': [], 'tasks': []}
+        deletes = {'users': [], 'tasks': []}
+        for table, uuid_, item, version in rows:
+            if item is None:
+                deletes[table].append(to_bin(uuid_))
+            else:
+                upserts[table].append((to_bin(uuid_), uuid_, item, version))
 
         with self.connection.cursor() as cursor:
-            cursor.execute(query)
-            db_results = cursor.fetchall()
+            if upserts['tasks']:
+                self.__tombstone_moved(
+                    cursor,
+                    [(key, to_bin(item.user_uuid)) for key, _, item, _ in upserts['tasks']],
+                    now,
+                )
+            if deletes['tasks']:
+                placeholders = ", ".join(["%s"] * len(deletes['tasks']))
+                self.__tombstone(cursor, f'uuid IN ({placeholders})', deletes['tasks'])
+            if upserts['users']:
+                self.__upsert(
+                    cursor,
+                    'users',
+                    upserts['users'],
+                    (
+                        'UPDATE users SET name=%s, version=%s WHERE uuid=%s',
+                        lambda key, uuid_, item, version: (item.name, version, key),
+                    ),
+                    (
+                        f'INSERT INTO users ({USER_COLUMNS}, version) VALUES (%s, %s, %s)',
+                        lambda key, uuid_, item, version: (key, item.name, version),
+                    ),
+                )
+            if upserts['tasks']:
+                # Completion and creation times are kept like create_task
+                # and replace_task keep them.
+                self.__upsert(
+                    cursor,
+                    'tasks',
+                    upserts['tasks'],
+                    (
+                        'UPDATE tasks SET description=%s, completed=%s, user_uuid=%s, priority=%s, due_date=%s, '
+                        'completed_at=CASE WHEN %s THEN COALESCE(completed_at, %s) END, version=%s, updated_at=%s '
+                        'WHERE uuid=%s',
+                        lambda key, uuid_, item, version:
+                            self.__task_row(uuid_, item)[1:] + (item.completed, now, version, now, key),
+                    ),
+                    (
+                        f'INSERT INTO tasks ({TASK_COLUMNS}, version, completed_at, created_at, updated_at) '
+                        'VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)',
+                        lambda key, uuid_, item, version:
+                            self.__task_row(uuid_, item) + (version, now if item.completed else None, now, now),
+                    ),
+                )
+            for table in ('tasks', 'users'):
+                if deletes[table]:
+                    cursor.execute(
+                        f'DELETE FROM {table} WHERE uuid IN ({", ".join(["%s"] * len(deletes[table]))})',
+                        deletes[table],
+                    )
+        self.__commit()
+
+    @staticmethod
+    def __upsert(cursor, table, rows, update, insert):
+        # Plain UPDATE or INSERT, so the same statements run on every backend.
+        # `update` and `insert` are a statement and the parameters it takes
+        # for a (key, uuid, item, version) row, for existing and new rows.
+        keys = [row[0] for row in rows]
+        cursor.execute(
+            f'SELECT uuid FROM {table} WHERE uuid IN ({", ".join(["%s"] * len(keys))})',
+            keys,
+        )
+        existing = {bytes(key) for key, in cursor.fetchall()}
+        for (statement, params), chosen in (
+                (update, [row for row in rows if row[0] in existing]),
+                (insert, [row for row in rows if row[0] not in existing]),
+        ):
+            if chosen:
+                cursor.executemany(statement, [params(*row) for row in chosen])
+
+# User
+
+    def read_users(self, fields=None, name_prefix: str = None, limit: int = None, after=None):
+        fields = check_fields(fields, USER_FIELDS)
+        query = f'SELECT {", ".join(("uuid", ) + fields)} FROM users'
+        params = []
+        if name_prefix is not None or limit is not None or after is not None:
+            # Pages of users by name. The name collation is case-insensitive
+            # on both backends, and a LIKE prefix match (wildcards escaped) on
+            # the users_name index is a range scan in (name, uuid) order, so a
+            # page starts where the (name, uuid) cursor of the previous one
+            # ended.
+            conditions = []
+            if name_prefix is not None:
+                conditions.append("name LIKE %s ESCAPE '!'")
+                params.append(escape_like(name_prefix) + '%')
+            if after is not None:
+                name, uuid_ = after
+                if name is None:
+                    # NULL names come first.
+                    conditions.append('(name IS NOT NULL OR uuid > %s)')
+                    params.append(to_bin(uuid_))
+                else:
+                    conditions.append('(name > %s OR (name = %s AND uuid > %s))')
+                    params.extend((name, name, to_bin(uuid_)))
+            if conditions:
+                query += ' WHERE ' + ' AND '.join(conditions)
+            query += ' ORDER BY name, uuid'
+            if limit is not None:
+                query += ' LIMIT %s'
+                params.append(int(limit))
+
+        db_results = self.__select(query, params, 'user')
 
         return {
-            uuid_: User(
-                name=field_name,
-            )
-            for uuid_, field_name in db_results
+            from_bin(uuid_): User(**dict(zip(fields, values)))
+            for uuid_, *values in db_results
         }
 
-    def create_user(self, item: User):
-        uuid_ = uuid.uuid4()
+    def create_user(self, item: User, uuid_: uuid.UUID = None):
+        if uuid_ is None:
+            uuid_ = self.__new_uuid()
 
-        with self.connection.cursor() as cursor:
-            cursor.execute(
-                'INSERT INTO users VALUES (UUID_TO_BIN(%s), %s)',
-                (str(uuid_), item.name),
-            )
-        self.connection.commit()
+        self.__insert(
+            'INSERT INTO users (uuid, name) VALUES (%s, %s)',
+            (to_bin(uuid_), item.name),
+        )
+        self.__changed('user', 'create', uuid_, uuid_, item)
+        self.__commit()
 
         return uuid_
 
-    def read_user(self, uuid_: uuid.UUID):
-        if not self.__user_exists(uuid_):
-            raise KeyError()
+    def read_user(self, uuid_: uuid.UUID, fields=None, with_version=False):
+        user, version = self.__read_user(uuid_, None, fields)
+        return (user, version) if with_version else user
 
-        with self.connection.cursor() as cursor:
-            cursor.execute(
-                '''
-                SELECT name
-                FROM users
-                WHERE uuid = UUID_TO_BIN(%s)
-                ''',
-                (str(uuid_), ),
-            )
-            result = cursor.fetchone()
+    def lookup_users(self, uuids, fields=None):
+        fields = check_fields(fields, USER_FIELDS)
+        return {
+            from_bin(uuid_): User(**dict(zip(fields, values)))
+            for uuid_, *values in self.__lookup('users', fields, uuids)
+        }
 
-        return User(name=result[0])
+    def __read_user(self, uuid_: uuid.UUID, connection, fields=None):
+        fields = check_fields(fields, USER_FIELDS)
+        results = self.__select(
+            f'''
+            SELECT {", ".join(("uuid", ) + fields + ("version", ))}
+            FROM users
+            WHERE uuid = %s
+            ''',
+            (to_bin(uuid_), ),
+            'user',
+            to_bin(uuid_),
+            connection,
+        )
 
-    def replace_user(self, uuid_, item):
-        if not self.__user_exists(uuid_):
+        if not results:
             raise KeyError()
 
-        with self.connection.cursor() as cursor:
-            cursor.execute(
-                '''
-                UPDATE users SET name=%s
-                WHERE uuid=UUID_TO_BIN(%s)
-                ''',
-                (item.name, str(uuid_)),
-            )
-        self.connection.commit()
+        return User(**dict(zip(fields, results[0][1:-1]))), results[0][-1]
+
+    def replace_user(self, uuid_, item, action='replace', version: int = None):
+        version = self.__update('users', 'name=%s', (item.name, ), uuid_, version, self.__user_exists)
+        self.__changed('user', action, uuid_, uuid_, item)
+        self.__commit()
+        return version
 
-    def remove_user(self, uuid_):
+    def alter_user(self, uuid_, item, version: int = None):
+        return self.__patch(
+            lambda: self.__read_user(uuid_, self.connection),
+            lambda new_item, current: self.replace_user(uuid_, new_item, 'patch', current),
+            item,
+            version,
+        )
+
+    def remove_user(self, uuid_, chunk_size: int = 1000, pause: float = 0.0, on_chunk=None):
         if not self.__user_exists(uuid_):
             raise KeyError()
 
+        # The tasks go first, in chunks, so the cascade has nothing left to do.
+        for table in TASK_TABLES:
+            self.__delete_chunks(table, 'user_uuid = %s', (to_bin(uuid_), ), chunk_size, pause, on_chunk)
         with self.connection.cursor() as cursor:
             cursor.execute(
-                'DELETE FROM users WHERE uuid=UUID_TO_BIN(%s)',
-                (str(uuid_), ),
+                'DELETE FROM users WHERE uuid=%s',
+                (to_bin(uuid_), ),
             )
-        self.connection.commit()
+        self.__changed('user', 'delete', uuid_, uuid_)
+        self.__commit()
+        if on_chunk is not None:
+            on_chunk(1)
 
-    def remove_all_users(self):
-        with self.connection.cursor() as cursor:
-            cursor.execute('DELETE FROM users')
-        self.connection.commit()
+    def remove_all_users(self, chunk_size: int = 1000, pause: float = 0.0, on_chunk=None):
+        for table in TASK_TABLES:
+            self.__delete_chunks(table, 'user_uuid IS NOT NULL', (), chunk_size, pause, on_chunk)
+        self.__delete_chunks('users', None, (), chunk_size, pause, on_chunk)
+        self.__changed('user', 'clear')
+        self.__commit()
 
-    def __user_exists(self, uuid_: uuid.UUID):
-        with self.connection.cursor() as cursor:
+    def export_users(self, batch_size: int = 1000):
+        for rows in self.__export('users', USER_FIELDS, batch_size):
+            yield [
+                {'uuid': from_bin(uuid_), 'name': name}
+                for uuid_, name in rows
+            ]
+
+    def import_users(self, items, batch_size: int = 5000):
+        return self.__import(
+            'user',
+            'INSERT INTO users (uuid, name) VALUES (%s, %s)',
+            ((to_bin(uuid_), item.name) for uuid_, item in items),
+            batch_size,
+        )
+
+    def __user_exists(self, uuid_: uuid.UUID, connection=None):
+        if connection is None:
+            connection = self.connection
+
+        with connection.cursor() as cursor:
             cursor.execute(
                 '''
                 SELECT EXISTS(
-                    SELECT 1 FROM users WHERE uuid=UUID_TO_BIN(%s)
+                    SELECT 1 FROM users WHERE uuid=%s
                 )
                 ''',
-                (str(uuid_), ),
+                (to_bin(uuid_), ),
             )
             results = cursor.fetchone()
             found = bool(results[0])
@@ -204,26 +1210,500 @@ class DBSession:
         return found
 
 
+# In write-behind mode every request is served from a WriteBehindCache shared
+# by the worker. The checks a transaction would make (existence, versions,
+# the user a task refers to) run under the cache lock instead.
+class CachedDBSession:
+    def __init__(
+            self,
+            cache: WriteBehindCache,
+            feed=None,
+            new_uuid=uuid.uuid4,
+            deadline: float = None,
+            name_key=nocase_key,
+    ):
+        # Requests never wait on the database, so there is no deadline to
+        # enforce. `name_key` is the collation of the database behind the
+        # cache, so name pages and prefixes match what it would return.
+        self.cache = cache
+        self.__feed = feed
+        self.__new_uuid = new_uuid
+        self.__name_key = name_key
+
+    def close(self):
+        pass
+
+    def read_tasks(
+            self,
+            completed: bool = None,
+            fields=None,
+            user_uuid: uuid.UUID = None,
+            sort: str = None,
+            limit: int = None,
+            include_archived: bool = False,  # pylint: disable=unused-argument
+    ):
+        # Nothing is archived in write-behind mode, see archive_tasks.
+        fields = check_fields(fields, TASK_FIELDS)
+        column, descending = check_sort(sort)
+        if user_uuid is not None:
+            user_uuid = self.__key(user_uuid)
+        tasks = [
+            (uuid_, item) for uuid_, (item, _) in list(self.cache.tasks.items())
+            if (user_uuid is None or item.user_uuid == user_uuid)
+            and (completed is None or item.completed == completed)
+        ]
+        if column is not None:
+            # The database order: NULLs first, ties broken by key.
+            tasks.sort(
+                key=lambda entry: (
+                    getattr(entry[1], column) is not None,
+                    getattr(entry[1], column),
+                    to_bin(entry[0]),
+                ),
+                reverse=descending,
+            )
+        return {uuid_: self.__project(item, fields) for uuid_, item in tasks[:limit]}
+
+    def create_task(self, item: Task, uuid_: uuid.UUID = None, version: int = 1):
+        if uuid_ is None:
+            uuid_ = self.__new_uuid()
+        key = self.__key(uuid_)
+        item = self.__task(item)
+
+        with self.cache.writing():
+            if key in self.cache.tasks:
+                raise ValueError(f'Duplicate task {key}')
+            self.__check_user(item)
+            self.cache.write('tasks', key, item, version)
+        self.__publish('task', 'create', key, item.user_uuid, item)
+
+        return uuid_
+
+    def read_task(self, uuid_: uuid.UUID, fields=None, with_version=False):
+        item, version = self.__get(self.cache.tasks, uuid_)
+        item = self.__project(item, check_fields(fields, TASK_FIELDS))
+        return (item, version) if with_version else item
+
+    def lookup_tasks(self, uuids, fields=None):
+        return self.__lookup(self.cache.tasks, uuids, check_fields(fields, TASK_FIELDS))
+
+    def replace_task(self, uuid_, item, action='replace', version: int = None):
+        item = self.__task(item)
+        with self.cache.writing():
+            key, current = self.__current(self.cache.tasks, uuid_, version)
+            self.__check_user(item)
+            self.cache.write('tasks', key, item, current + 1)
+        self.__publish('task', action, key, item.user_uuid, item)
+        return current + 1
+
+    def alter_task(self, uuid_, item, version: int = None):
+        with self.cache.writing():
+            key, current = self.__current(self.cache.tasks, uuid_, version)
+            new_item = self.cache.tasks[key][0].copy(update=item.dict(exclude_unset=True))
+            return self.replace_task(key, new_item, 'patch', current)
+
+    def remove_task(self, uuid_, version: int = None):
+        with self.cache.writing():
+            key, _ = self.__current(self.cache.tasks, uuid_, version)
+            user_uuid = self.cache.tasks[key][0].user_uuid
+            self.cache.write('tasks', key, None, None)
+        self.__publish('task', 'delete', key, user_uuid)
+
+    def remove_all_tasks(self, chunk_size: int = 1000, pause: float = 0.0, on_chunk=None):
+        self.__delete_chunks('tasks', lambda item: True, chunk_size, pause, on_chunk)
+        self.__publish('task', 'clear')
+
+    def archive_tasks(self, after_days: float, chunk_size: int = 1000, pause: float = 0.0, on_chunk=None):
+        # The cache does not know when tasks were completed, and a task
+        # moved behind its back would be written back by the next flush.
+        raise ValueError('Archiving is not supported in write-behind mode')
+
+    def transaction(self):
+        # Cache writes are acknowledged one by one and cannot be undone.
+        raise ValueError('Batches are not supported in write-behind mode')
+
+    def read_task_changes(self, since: datetime.datetime = None, fields=None, user_uuid: uuid.UUID = None):
+        # Writes reach the database, and get their timestamps and tombstones,
+        # only when the cache flushes them.
+        raise ValueError('Incremental sync is not supported in write-behind mode')
+
+    def purge_tombstones(self, before: datetime.datetime, chunk_size: int = 1000):
+        raise ValueError('Incremental sync is not supported in write-behind mode')
+
+    def export_tasks(self, batch_size: int = 1000):
+        return self.__export(self.cache.tasks, batch_size)
+
+    def import_tasks(self, items, batch_size: int = 5000):
+        return self.__import(
+            'tasks',
+            'task',
+            ((uuid_, self.__task(item)) for uuid_, item in items),
+            batch_size,
+        )
+
+    def read_users(self, fields=None, name_prefix: str = None, limit: int = None, after=None):
+        fields = check_fields(fields, USER_FIELDS)
+        users = list(self.cache.users.items())
+        if name_prefix is not None or limit is not None or after is not None:
+            def order(entry):
+                return name_order(entry[1][0].name, entry[0], self.__name_key)
+
+            users.sort(key=order)
+            if name_prefix is not None:
+                prefix = self.__name_key(name_prefix)
+                users = [
+                    entry for entry in users
+                    if entry[1][0].name is not None and self.__name_key(entry[1][0].name).startswith(prefix)
+                ]
+            if after is not None:
+                cursor = name_order(*after, self.__name_key)
+                users = [entry for entry in users if order(entry) > cursor]
+        return {uuid_: self.__project(item, fields) for uuid_, (item, _) in users[:limit]}
+
+    def create_user(self, item: User, uuid_: uuid.UUID = None):
+        if uuid_ is None:
+            uuid_ = self.__new_uuid()
+        key = self.__key(uuid_)
+
+        with self.cache.writing():
+            if key in self.cache.users:
+                raise ValueError(f'Duplicate user {key}')
+            self.cache.write('users', key, item, 1)
+        self.__publish('user', 'create', key, key, item)
+
+        return uuid_
+
+    def read_user(self, uuid_: uuid.UUID, fields=None, with_version=False):
+        item, version = self.__get(self.cache.users, uuid_)
+        item = self.__project(item, check_fields(fields, USER_FIELDS))
+        return (item, version) if with_version else item
+
+    def lookup_users(self, uuids, fields=None):
+        return self.__lookup(self.cache.users, uuids, check_fields(fields, USER_FIELDS))
+
+    def replace_user(self, uuid_, item, action='replace', version: int = None):
+        with self.cache.writing():
+            key, current = self.__current(self.cache.users, uuid_, version)
+            self.cache.write('users', key, item, current + 1)
+        self.__publish('user', action, key, key, item)
+        return current + 1
+
+    def alter_user(self, uuid_, item, version: int = None):
+        with self.cache.writing():
+            key, current = self.__current(self.cache.users, uuid_, version)
+            new_item = self.cache.users[key][0].copy(update=item.dict(exclude_unset=True))
+            return self.replace_user(key, new_item, 'patch', current)
+
+    def remove_user(self, uuid_, chunk_size: int = 1000, pause: float = 0.0, on_chunk=None):
+        key = self.__key(uuid_)
+        if key not in self.cache.users:
+            raise KeyError()
+
+        self.__delete_chunks('tasks', lambda item: item.user_uuid == key, chunk_size, pause, on_chunk)
+        with self.cache.writing():
+            if key in self.cache.users:
+                self.cache.write('users', key, None, None)
+            self.__delete_orphans()
+        self.__publish('user', 'delete', key, key)
+        if on_chunk is not None:
+            on_chunk(1)
+
+    def remove_all_users(self, chunk_size: int = 1000, pause: float = 0.0, on_chunk=None):
+        self.__delete_chunks('tasks', lambda item: item.user_uuid is not None, chunk_size, pause, on_chunk)
+        self.__delete_chunks('users', lambda item: True, chunk_size, pause, on_chunk)
+        with self.cache.writing():
+            self.__delete_orphans()
+        self.__publish('user', 'clear')
+
+    def export_users(self, batch_size: int = 1000):
+        return self.__export(self.cache.users, batch_size)
+
+    def import_users(self, items, batch_size: int = 5000):
+        return self.__import('users', 'user', items, batch_size)
+
+    @staticmethod
+    def __key(uuid_):
+        return str(uuid.UUID(str(uuid_)))
+
+    @staticmethod
+    def __project(item, fields):
+        return type(item)(**{field: getattr(item, field) for field in fields})
+
+    def __task(self, item):
+        # Keys are compared as strings, so user keys are normalized once.
+        if item.user_uuid is None:
+            return item
+        return item.copy(update={'user_uuid': self.__key(item.user_uuid)})
+
+    def __check_user(self, item):
+        # The foreign key would reject the row at flush time, after the
+        # write was acknowledged.
+        if item.user_uuid is not None and item.user_uuid not in self.cache.users:
+            raise ValueError(f'Unknown user {item.user_uuid}')
+
+    def __get(self, rows, uuid_):
+        entry = rows.get(self.__key(uuid_))
+        if entry is None:
+            raise KeyError()
+        return entry
+
+    def __current(self, rows, uuid_, version):
+        key = self.__key(uuid_)
+        _, current = self.__get(rows, key)
+        if version is not None and version != current:
+            raise VersionConflict()
+        return key, current
+
+    def __lookup(self, rows, uuids, fields):
+        found = {}
+        for uuid_ in uuids:
+            entry = rows.get(self.__key(uuid_))
+            if entry is not None:
+                found[self.__key(uuid_)] = self.__project(entry[0], fields)
+        return found
+
+    def __delete_chunks(self, table, matches, chunk_size, pause, on_chunk):
+        # Chunks keep every hold of the cache lock, and every flush, short.
+        rows = getattr(self.cache, table)
+        while True:
+            with self.cache.writing():
+                keys = [key for key, (item, _) in rows.items() if matches(item)][:chunk_size]
+                for key in keys:
+                    self.cache.write(table, key, None, None)
+            if keys and on_chunk is not None:
+                on_chunk(len(keys))
+            if len(keys) < chunk_size:
+                return
+            time.sleep(pause)
+
+    def __delete_orphans(self):
+        # Tasks created for a user while it was being deleted, which the
+        # database would cascade away.
+        for key, (item, _) in list(self.cache.tasks.items()):
+            if item.user_uuid is not None and item.user_uuid not in self.cache.users:
+                self.cache.write('tasks', key, None, None)
+
+    @staticmethod
+    def __export(rows, batch_size):
+        rows = list(rows.items())
+        for start in range(0, len(rows), batch_size):
+            yield [
+                {'uuid': uuid_, **jsonable_encoder(item)}
+                for uuid_, (item, _) in rows[start:start + batch_size]
+            ]
+
+    def __import(self, table, kind, items, batch_size):
+        rows = getattr(self.cache, table)
+        imported = 0
+        items = Counted(items)
+        try:
+            for batch in batched(items, batch_size):
+                batch = [(self.__key(uuid_), item) for uuid_, item in batch]
+                with self.cache.writing():
+                    # A batch is checked whole before any of it is written.
+                    keys = set()
+                    for row, (key, item) in enumerate(batch, imported + 1):
+                        try:
+                            if key in rows or key in keys:
+                                raise ValueError(f'Duplicate uuid {key}')
+                            if table == 'tasks':
+                                self.__check_user(item)
+                        except ValueError as exception:
+                            raise ImportFailed(exception, row, imported) from exception
+                        keys.add(key)
+                    for key, item in batch:
+                        self.cache.write(table, key, item, 1)
+                imported += len(batch)
+        except ImportFailed:
+            raise
+        except ValueError as exception:
+            raise ImportFailed(exception, items.count + 1, imported) from exception
+        finally:
+            if imported:
+                self.__publish(kind, 'import')
+
+        return imported
+
+    def __publish(self, kind, action, uuid_=None, user_uuid=None, item=None):
+        if self.__feed is not None:
+            self.__feed.publish(
+                kind,
+                action,
+                uuid_,
+                user_uuid,
+                None if item is None else jsonable_encoder(item),
+            )
+
+
+@lru_cache
+def get_backend(
+        config_file_name: str = Depends(get_config_filename),
+        secrets_file_name: str = Depends(get_app_secrets_filename),
+):
+    with open(config_file_name, 'r') as file:
+        config = json.load(file)
+    if 'shards' in config:
+        return None
+    return create_backend(config_file_name, secrets_file_name)
+
+
 @lru_cache
-def get_credentials(
+def get_shard_map(
         config_file_name: str = Depends(get_config_filename),
         secrets_file_name: str = Depends(get_app_secrets_filename),
 ):
+    return create_shard_map(config_file_name, secrets_file_name)
+
+
+@lru_cache
+def get_uuid_generator(config_file_name: str = Depends(get_config_filename)):
+    with open(config_file_name, 'r') as file:
+        config = json.load(file)
+    return UUID_GENERATORS[config.get('uuid_version', 4)]
+
+
+@lru_cache
+def get_coalescer(
+        config_file_name: str = Depends(get_config_filename),
+        backend=Depends(get_backend),
+):
+    if backend is None:
+        return None
+    with open(config_file_name, 'r') as file:
+        config = json.load(file)
+    return create_coalescer(config, backend)
+
+
+@lru_cache
+def get_write_behind(
+        config_file_name: str = Depends(get_config_filename),
+        backend=Depends(get_backend),
+):
+    with open(config_file_name, 'r') as file:
+        config = json.load(file)
+    if 'write_behind' not in config:
+        return None
+    if backend is None:
+        raise ValueError('Write-behind caching does not support sharded deployments')
+
+    def in_session(call):
+        session = DBSession(backend.connect)
+        try:
+            return call(session)
+        finally:
+            session.close()
+
+    settings = dict(config['write_behind'])
+    settings.pop('log_dir', None)
+    log = WriteLog(
+        get_write_behind_log_dir(config_file_name, config),
+        fsync=settings.pop('fsync', True),
+    )
+    cache = WriteBehindCache(
+        log,
+        load=lambda: in_session(lambda session: session.read_rows()),
+        flush=lambda rows: in_session(lambda session: session.write_rows(rows)),
+        **settings,
+    )
+    cache.start()
+    return cache
+
+
+@lru_cache
+def get_archive_after_days(config_file_name: str = Depends(get_config_filename)):
+    with open(config_file_name, 'r') as file:
+        config = json.load(file)
+    return config.get('archive', {}).get('after_days', 90)
+
+
+@lru_cache
+def get_sync_settings(config_file_name: str = Depends(get_config_filename)):
+    with open(config_file_name, 'r') as file:
+        config = json.load(file)
+    return {'settle_seconds': 1.0, 'tombstone_days': 30, **config.get('sync', {})}
+
+
+@lru_cache
+def get_replica_pool(config_file_name: str = Depends(get_config_filename)):
     with open(config_file_name, 'r') as file:
         config = json.load(file)
-    with open(secrets_file_name, 'r') as file:
-        secrets = json.load(file)
-    return {
-        'user': secrets['user'],
-        'password': secrets['password'],
-        'host': config['db_host'],
-        'database': config['database'],
-    }
+    return ReplicaPool(
+        config.get('db_replicas', []),
+        retry_seconds=config.get('replica_retry_seconds', 30.0),
+        connect_timeout=config.get('replica_connect_timeout', 2),
+        read_your_writes=config.get('read_your_writes', False),
+        lag_seconds=config.get('replica_lag_seconds', 5),
+        pool_size=config.get('pool_size'),
+        pool_timeout=config.get('pool_timeout', 30.0),
+    )
+
+
+def get_session_factory(
+        request: Request,
+        response: Response,
+        backend=Depends(get_backend),
+        replicas: ReplicaPool = Depends(get_replica_pool),
+        feed: ChangeFeed = Depends(get_feed),
+        coalescer: WriteCoalescer = Depends(get_coalescer),
+        new_uuid=Depends(get_uuid_generator),
+        shard_map: ShardMap = Depends(get_shard_map),
+        write_behind: WriteBehindCache = Depends(get_write_behind),
+        single_flight: SingleFlight = Depends(get_single_flight),
+):
+    if write_behind is not None:
+        # Requests never touch the database; the cache flushes to it.
+        return partial(CachedDBSession, write_behind, feed=feed, new_uuid=new_uuid, name_key=backend.name_key)
+
+    read_connect = None
+    on_write = None
+    if backend is not None and backend.name == 'mysql' and replicas.hosts \
+            and PRIMARY_COOKIE not in request.cookies:
+        read_connect = partial(replicas.connect, backend.credentials)
+    if replicas.read_your_writes:
+        # Pin this client to the primary until the replicas have caught up
+        # with the write it just made.
+        on_write = partial(
+            response.set_cookie,
+            PRIMARY_COOKIE,
+            '1',
+            max_age=replicas.lag_seconds,
+        )
+
+    if shard_map is None:
+        return partial(
+            DBSession,
+            backend.connect,
+            read_connect=read_connect,
+            on_write=on_write,
+            feed=feed,
+            coalescer=coalescer,
+            new_uuid=new_uuid,
+            single_flight=single_flight,
+        )
+    return partial(
+        ShardedDBSession,
+        shard_map,
+        lambda shard, deadline=None: DBSession(
+            shard.backend.connect,
+            on_write=on_write,
+            feed=feed,
+            coalescer=shard.coalescer,
+            single_flight=single_flight,
+            deadline=deadline,
+        ),
+        new_uuid=new_uuid,
+    )
 
 
-def get_db(credentials: dict = Depends(get_credentials)):
+def get_db(make_session=Depends(get_session_factory), deadline: float = Depends(get_deadline)):
+    # Background jobs take the factory instead, to open their own sessions
+    # once this one has been closed, without the request's deadline.
+    session = make_session(deadline=deadline)
     try:
-        connection = conn.connect(**credentials)
-        yield DBSession(connection)
+        yield session
+    except Exception as exception:
+        if is_timeout(exception):
+            raise QueryTimeout() from exception
+        raise
     finally:
-        connection.close()
+        session.close()
@@ -0,0 +1,57 @@
+# pylint: disable=missing-module-docstring, missing-function-docstring, missing-class-docstring
+import json
+import threading
+import time
+
+from functools import lru_cache
+
+from fastapi import Depends, Request
+
+from utils.utils import get_config_filename
+
+
+def route_key(request: Request):
+    route = request.scope.get('route')
+    return f'{request.method} {route.path}' if route is not None else request.url.path
+
+
+# Time budgets per route, in seconds. A route without an entry gets the
+# default; null (or no default) leaves it unbounded, e.g. for exports that
+# stream for as long as the table is large.
+class Deadlines:
+    def __init__(self, config: dict):
+        self.__default = config.get('default')
+        self.__routes = config.get('routes', {})
+        self.__timeouts = {}
+        self.__lock = threading.Lock()
+
+    def seconds_for(self, key: str):
+        return self.__routes.get(key, self.__default)
+
+    def timed_out(self, key: str):
+        with self.__lock:
+            self.__timeouts[key] = self.__timeouts.get(key, 0) + 1
+
+    def stats(self):
+        with self.__lock:
+            return {
+                key: {'deadline': self.seconds_for(key), 'timeouts': timeouts}
+                for key, timeouts in self.__timeouts.items()
+            }
+
+
+@lru_cache
+def get_deadlines(config_file_name: str = Depends(get_config_filename)):
+    with open(config_file_name, 'r') as file:
+        config = json.load(file)
+    if 'deadlines' not in config:
+        return None
+    return Deadlines(config['deadlines'])
+
+
+def get_deadline(request: Request, deadlines: Deadlines = Depends(get_deadlines)):
+    # The time.monotonic() by which this request's queries must be done.
+    # The timeout handler counts timeouts against the same Deadlines.
+    request.state.deadlines = deadlines
+    seconds = None if deadlines is None else deadlines.seconds_for(route_key(request))
+    return None if seconds is None else time.monotonic() + seconds
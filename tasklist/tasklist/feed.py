@@ -0,0 +1,99 @@
+# pylint: disable=missing-module-docstring, missing-function-docstring, missing-class-docstring
+import asyncio
+import threading
+
+
+class ChangeFeed:
+    def __init__(self, history: int = 10000):
+        # A ring of the last `history` events: event n is in slot
+        # n % history, so the events after a sequence are a slice of it.
+        self.__history = history
+        self.__events = [None] * history
+        self.__sequence = 0
+        self.__lock = threading.Lock()
+        self.__loop = None
+        self.__wakeup = None
+
+    @property
+    def sequence(self):
+        return self.__sequence
+
+    def publish(self, kind: str, action: str, uuid_=None, user_uuid=None, item=None):
+        with self.__lock:
+            self.__sequence += 1
+            self.__events[self.__sequence % self.__history] = {
+                'sequence': self.__sequence,
+                'kind': kind,
+                'action': action,
+                'uuid': uuid_,
+                'user_uuid': user_uuid,
+                'item': item,
+            }
+            loop = self.__loop
+
+        # Writers run on worker threads, subscribers on the event loop.
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self.__notify)
+
+    def since(self, sequence: int):
+        # Costs O(new events), however long the history.
+        with self.__lock:
+            start = max(sequence, self.__first() - 1, 0) + 1
+            end = self.__sequence + 1
+            if start >= end:
+                return []
+            first, last = start % self.__history, end % self.__history
+            if first < last:
+                return self.__events[first:last]
+            return self.__events[first:] + self.__events[:last]
+
+    def is_available(self, sequence: int):
+        # Whether every event after `sequence` is still in the history.
+        with self.__lock:
+            if not self.__sequence:
+                return sequence <= 0
+            return sequence >= self.__first() - 1
+
+    def __first(self):
+        # The sequence of the oldest event kept.
+        return max(self.__sequence - self.__history + 1, 1)
+
+    async def subscribe(self, sequence: int = None, user_uuid: str = None, keepalive: float = 15.0):
+        # All subscribers share one asyncio.Event per batch of publishes, so
+        # a publish costs O(1) no matter how many clients are listening.
+        self.__attach()
+        if sequence is None:
+            sequence = self.__sequence
+
+        while True:
+            wakeup = self.__wakeup
+            events = self.since(sequence)
+            for event in events:
+                sequence = event['sequence']
+                # Table-wide events (clear, import) concern every user.
+                if user_uuid is None or event['user_uuid'] == user_uuid \
+                        or event['uuid'] is None:
+                    yield event
+            if not events:
+                try:
+                    await asyncio.wait_for(wakeup.wait(), keepalive)
+                except asyncio.TimeoutError:
+                    yield None
+
+    def __attach(self):
+        loop = asyncio.get_running_loop()
+        with self.__lock:
+            if self.__loop is not loop:
+                self.__loop = loop
+                self.__wakeup = asyncio.Event()
+
+    def __notify(self):
+        wakeup, self.__wakeup = self.__wakeup, asyncio.Event()
+        wakeup.set()
+
+
+feed = ChangeFeed()
+
+
+def get_feed():
+    return feed
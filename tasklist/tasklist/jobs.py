@@ -0,0 +1,91 @@
+# pylint: disable=missing-module-docstring, missing-function-docstring, missing-class-docstring
+import collections
+import json
+import threading
+import time
+import uuid
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from fastapi import Depends
+
+from utils.utils import get_config_filename
+
+
+class Job:
+    def __init__(self, kind: str):
+        self.id = str(uuid.uuid4())
+        self.kind = kind
+        self.status = 'running'
+        self.deleted = 0
+        self.error = None
+        self.started = time.time()
+        self.finished = None
+        self.__lock = threading.Lock()
+
+    def progress(self, count: int):
+        # Sharded jobs report from one thread per shard.
+        with self.__lock:
+            self.deleted += count
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'deleted': self.deleted,
+            'error': self.error,
+            'started': self.started,
+            'finished': self.finished,
+        }
+
+
+# Long deletes run here instead of in the request: the handler returns a job
+# id straight away and the job works through the table in chunks of
+# `chunk_size` rows, one short transaction each, sleeping `pause` seconds in
+# between so other writers and the replicas keep up.
+class JobQueue:
+    def __init__(self, workers: int = 1, history: int = 100, chunk_size: int = 1000, pause: float = 0.0):
+        self.history = history
+        self.chunk_size = chunk_size
+        self.pause = pause
+        self.__executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+        self.__jobs = collections.OrderedDict()
+        self.__lock = threading.Lock()
+
+    def submit(self, kind: str, run) -> Job:
+        job = Job(kind)
+        with self.__lock:
+            self.__jobs[job.id] = job
+            self.__forget_finished()
+        self.__executor.submit(self.__run, job, run)
+        return job
+
+    def get(self, job_id: str) -> Job:
+        with self.__lock:
+            return self.__jobs[job_id]
+
+    def __run(self, job, run):
+        try:
+            run(job)
+            job.status = 'done'
+        except Exception as exception:  # pylint: disable=broad-except
+            job.status = 'failed'
+            job.error = repr(exception)
+        job.finished = time.time()
+
+    def __forget_finished(self):
+        finished = [
+            job_id for job_id, job in self.__jobs.items()
+            if job.status != 'running'
+        ]
+        for job_id in finished[:max(len(self.__jobs) - self.history, 0)]:
+            del self.__jobs[job_id]
+
+
+@lru_cache
+def get_jobs(config_file_name: str = Depends(get_config_filename)):
+    with open(config_file_name, 'r') as file:
+        config = json.load(file)
+    return JobQueue(**config.get('delete_jobs', {}))
@@ -1,7 +1,15 @@
 # pylint: disable=missing-module-docstring
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI, Request
+from fastapi.responses import JSONResponse
 
-from .routers import task, user
+from .admission import admit
+from .backends import QueryTimeout
+from .capture import CaptureMiddleware, stop_capture
+from .deadlines import route_key
+from .profiler import RequestScope
+from .routers import batch, debug, feed, health, job, task, user
+from .warmup import start_warm_up, stop_write_behind
+from .writebehind import WriteBehindFull
 
 tags_metadata = [
     {
@@ -11,7 +19,27 @@ tags_metadata = [
     {
         'name': 'user',
         'description': 'Operations related to users.',
-    }
+    },
+    {
+        'name': 'batch',
+        'description': 'Several task and user operations in one transaction.',
+    },
+    {
+        'name': 'job',
+        'description': 'Progress of background jobs.',
+    },
+    {
+        'name': 'feed',
+        'description': 'Real-time stream of task and user changes.',
+    },
+    {
+        'name': 'health',
+        'description': 'Worker health checks.',
+    },
+    {
+        'name': 'debug',
+        'description': 'Protected diagnostics of a running worker.',
+    },
 ]
 
 app = FastAPI(
@@ -20,5 +48,57 @@ app = FastAPI(
     openapi_tags=tags_metadata,
 )
 
-app.include_router(task.router, prefix='/task', tags=['task'])
-app.include_router(user.router, prefix='/user', tags=['user'])
+app.include_router(
+    task.router,
+    prefix='/task',
+    tags=['task'],
+    dependencies=[Depends(admit)],
+)
+app.include_router(
+    user.router,
+    prefix='/user',
+    tags=['user'],
+    dependencies=[Depends(admit)],
+)
+app.include_router(
+    batch.router,
+    prefix='/batch',
+    tags=['batch'],
+    dependencies=[Depends(admit)],
+)
+app.include_router(job.router, prefix='/job', tags=['job'])
+app.include_router(feed.router, prefix='/feed', tags=['feed'])
+app.include_router(health.router, tags=['health'])
+app.include_router(debug.router, prefix='/debug', tags=['debug'])
+app.add_middleware(RequestScope)
+app.add_middleware(CaptureMiddleware)
+
+
+@app.exception_handler(WriteBehindFull)
+def write_behind_full(_: Request, exception: WriteBehindFull):
+    # The database is behind: clients should slow down, not fail for good.
+    return JSONResponse(
+        {'detail': str(exception)},
+        status_code=503,
+        headers={'Retry-After': '1'},
+    )
+
+
+@app.exception_handler(QueryTimeout)
+def query_timeout(request: Request, _: QueryTimeout):
+    # The database cancelled the statement, so the connection is free again.
+    deadlines = getattr(request.state, 'deadlines', None)
+    if deadlines is not None:
+        deadlines.timed_out(route_key(request))
+    return JSONResponse({'detail': 'Query deadline exceeded'}, status_code=504)
+
+
+@app.on_event('startup')
+def warm_up():
+    start_warm_up(app)
+
+
+@app.on_event('shutdown')
+def flush_writes():
+    stop_write_behind(app)
+    stop_capture(app)
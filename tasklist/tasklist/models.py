@@ -1,5 +1,8 @@
 # pylint: disable=missing-module-docstring,missing-class-docstring
-from typing import Optional
+import uuid
+
+from datetime import date
+from typing import Any, Dict, List, Optional
 
 from pydantic import BaseModel, Field  # pylint: disable=no-name-in-module
 
@@ -20,6 +23,16 @@ class Task(BaseModel):
         title='User id',
         max_length=1024,
     )
+    priority: int = Field(
+        0,
+        title='Task priority, higher is more urgent',
+        ge=0,
+        le=255,
+    )
+    due_date: Optional[date] = Field(
+        None,
+        title='Date the task is due',
+    )
 
     class Config:
         schema_extra = {
@@ -27,6 +40,8 @@ class Task(BaseModel):
                 'description': 'Buy baby diapers',
                 'completed': False,
                 'user_uuid' : '1231233123',
+                'priority': 1,
+                'due_date': '2023-06-30',
             }
         }
 
@@ -43,3 +58,102 @@ class User(BaseModel):
                 'name': 'Beatriz Mie',
             }
         }
+
+
+class Lookup(BaseModel):
+    uuids: List[uuid.UUID] = Field(
+        ...,
+        title='UUIDs to read',
+        max_items=1000,
+    )
+
+    class Config:
+        schema_extra = {
+            'example': {
+                'uuids': [
+                    '3668e9c9-df18-4ce2-9bb2-82f907cf110c',
+                    '0f7fd4b5-8f24-4b4d-a1b3-34c5ad8d6e5e',
+                ],
+            }
+        }
+
+
+class TaskLookup(BaseModel):
+    found: Dict[uuid.UUID, Task]
+    missing: List[uuid.UUID]
+
+
+class TaskChanges(BaseModel):
+    tasks: Dict[uuid.UUID, Task]
+    deleted: List[uuid.UUID]
+    cursor: str = Field(
+        ...,
+        title='Cursor to pass as `updated_since` on the next sync',
+    )
+
+
+class UserLookup(BaseModel):
+    found: Dict[uuid.UUID, User]
+    missing: List[uuid.UUID]
+
+
+class Operation(BaseModel):
+    op: str = Field(
+        ...,
+        title='What to do',
+        regex='^(create|read|replace|patch|delete)$',
+    )
+    kind: str = Field(
+        ...,
+        title='What to do it to',
+        regex='^(task|user)$',
+    )
+    uuid: Optional[str] = Field(
+        None,
+        title='UUID, or `$n` for the UUID created by operation n',
+    )
+    item: Optional[Dict[str, Any]] = Field(
+        None,
+        title='Task or user to write; `$n` values refer to created UUIDs',
+    )
+    version: Optional[int] = Field(
+        None,
+        title='Expected version, as with If-Match',
+    )
+
+
+class Batch(BaseModel):
+    operations: List[Operation] = Field(
+        ...,
+        title='Operations, run in order',
+        max_items=100,
+    )
+    atomic: bool = Field(
+        False,
+        title='Commit nothing if any operation fails',
+    )
+
+    class Config:
+        schema_extra = {
+            'example': {
+                'operations': [
+                    {'op': 'create', 'kind': 'user', 'item': {'name': 'Beatriz Mie'}},
+                    {'op': 'create', 'kind': 'task', 'item': {'description': 'Buy baby diapers', 'user_uuid': '$0'}},
+                    {'op': 'patch', 'kind': 'task', 'uuid': '$1', 'item': {'completed': True}},
+                ],
+                'atomic': True,
+            }
+        }
+
+
+class OperationResult(BaseModel):
+    status: int
+    uuid: Optional[uuid.UUID]
+    version: Optional[int]
+    item: Optional[Dict[str, Any]]
+    detail: Optional[str]
+
+
+class BatchResult(BaseModel):
+    committed: bool
+    results: List[OperationResult]
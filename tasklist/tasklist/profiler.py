@@ -0,0 +1,168 @@
+# pylint: disable=missing-module-docstring, missing-function-docstring, missing-class-docstring
+import collections
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+
+from functools import lru_cache
+
+from fastapi import Depends
+
+from utils.utils import get_config_filename
+
+# The ASGI scope of the request being served. Worker threads run endpoints
+# in a copy of the request's context, which is how their samples are tied
+# to a route.
+request_scope = contextvars.ContextVar('request_scope', default=None)
+
+DB_FILES = ('database.py', 'sharding.py', 'backends.py', 'coalescer.py', 'writebehind.py')
+# pydantic is compiled, so validation shows up as the FastAPI frames that
+# call into it.
+VALIDATION_FUNCTIONS = {
+    'serialize_response',
+    '_prepare_response_content',
+    'request_body_to_args',
+    'request_params_to_args',
+}
+IDLE_FUNCTIONS = {('threading.py', 'wait'), ('selectors.py', 'select'), ('queue.py', 'get')}
+
+
+class RequestScope:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        token = request_scope.set(scope)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            request_scope.reset(token)
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+def classify(frame):
+    code = frame.f_code
+    path = code.co_filename.replace(os.sep, '/')
+    filename = os.path.basename(path)
+    if (filename in DB_FILES and path.endswith(f'tasklist/{filename}')) \
+            or '/mysql/connector/' in path:
+        return 'db'
+    if path.endswith('fastapi/encoders.py') or '/json/' in path \
+            or (path.endswith('starlette/responses.py') and code.co_name == 'render'):
+        return 'json'
+    if '/pydantic/' in path or code.co_name in VALIDATION_FUNCTIONS:
+        return 'validation'
+    if code.co_name == 'run' and '/anyio/' in path:
+        # A worker thread calling straight into compiled pydantic, through
+        # the functools.partial run_in_threadpool wraps it in.
+        func = frame.f_locals.get('func')
+        func = getattr(func, 'func', func)
+        if type(getattr(func, '__self__', None)).__module__.startswith('pydantic'):
+            return 'validation'
+    return None
+
+
+def route_of(frame):
+    scope = None
+    if 'scope' in frame.f_code.co_varnames:
+        scope = frame.f_locals.get('scope')
+    elif 'context' in frame.f_code.co_varnames:
+        context = frame.f_locals.get('context')
+        if isinstance(context, contextvars.Context):
+            scope = context.get(request_scope)
+    if not isinstance(scope, dict) or scope.get('type') != 'http':
+        return None
+    # The router adds the matched route to the same scope dict.
+    route = scope.get('route')
+    return f'{scope["method"]} {route.path if route is not None else scope["path"]}'
+
+
+def label(code):
+    # co_qualname only exists from Python 3.11 on.
+    name = getattr(code, 'co_qualname', code.co_name)
+    return f'{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+# Wall-clock sampling profiler: every `interval` seconds it captures the
+# Python stack of every thread, the event loop and the executor threads
+# alike. Nothing is instrumented, so outside a profile it costs nothing.
+class Profiler:
+    def __init__(self, token: str, interval: float = 0.005):
+        self.token = token
+        self.interval = interval
+        self.__lock = threading.Lock()
+
+    def profile(self, seconds: float):
+        if not self.__lock.acquire(blocking=False):
+            raise ProfilerBusy()
+        try:
+            return self.__sample(seconds)
+        finally:
+            self.__lock.release()
+
+    def __sample(self, seconds):
+        stacks = collections.Counter()
+        routes = collections.defaultdict(collections.Counter)
+        names = {}
+        own = threading.get_ident()
+        samples = 0
+        started = time.monotonic()
+        while time.monotonic() - started < seconds:
+            for ident, frame in sys._current_frames().items():  # pylint: disable=protected-access
+                if ident != own:
+                    if ident not in names:
+                        names = {thread.ident: thread.name for thread in threading.enumerate()}
+                    self.__record(frame, names.get(ident, str(ident)), stacks, routes)
+            samples += 1
+            time.sleep(self.interval)
+
+        period = (time.monotonic() - started) / max(samples, 1)
+        return {
+            'seconds': seconds,
+            'samples': samples,
+            'collapsed': [f'{stack} {count}' for stack, count in stacks.most_common()],
+            'routes': {
+                route: {
+                    category: round(count * period, 4)
+                    for category, count in counts.items()
+                }
+                for route, counts in sorted(routes.items())
+            },
+        }
+
+    @staticmethod
+    def __record(frame, thread_name, stacks, routes):
+        code = frame.f_code
+        if (os.path.basename(code.co_filename), code.co_name) in IDLE_FUNCTIONS:
+            return
+
+        labels = []
+        category = route = None
+        while frame is not None:
+            labels.append(label(frame.f_code))
+            # The innermost classified frame decides where the time goes.
+            if category is None:
+                category = classify(frame)
+            if route is None:
+                route = route_of(frame)
+            frame = frame.f_back
+
+        stacks[';'.join([thread_name] + labels[::-1])] += 1
+        if route is not None:
+            routes[route][category or 'other'] += 1
+            routes[route]['total'] += 1
+
+
+@lru_cache
+def get_profiler(config_file_name: str = Depends(get_config_filename)):
+    with open(config_file_name, 'r') as file:
+        config = json.load(file)
+    if 'profiler' not in config:
+        return None
+    return Profiler(**config['profiler'])
@@ -0,0 +1,109 @@
+# pylint: disable=missing-module-docstring, missing-function-docstring
+import base64
+import datetime
+import json
+import uuid
+
+from typing import Optional
+
+from fastapi import HTTPException, Request, Response
+
+from ..bulk import content_format, iterate_from_thread, iterate_lines, parse_rows
+from ..database import check_fields, utc_now
+from ..jobs import JobQueue
+
+
+def parse_fields(fields: Optional[str], allowed):
+    if fields is None:
+        return None
+    fields = [field.strip() for field in fields.split(',') if field.strip()]
+    try:
+        return check_fields(fields, allowed)
+    except ValueError as exception:
+        raise HTTPException(status_code=422, detail=str(exception)) from exception
+
+
+def parse_items(request: Request, model):
+    # Runs in a worker thread: the body is parsed while it is being received.
+    lines = iterate_lines(iterate_from_thread(request.stream()))
+    for row in parse_rows(lines, content_format(request.headers.get('content-type'))):
+        if row.get('uuid') is None:
+            raise ValueError('Missing uuid')
+        yield uuid.UUID(str(row['uuid'])), model(**row)
+
+
+def start_job(response: Response, jobs: JobQueue, kind: str, make_session, run):
+    # The request's own session is closed once the response is sent, so the
+    # job opens one of its own.
+    def run_in_session(job):
+        session = make_session()
+        try:
+            run(session, job)
+        finally:
+            session.close()
+
+    job = jobs.submit(kind, run_in_session)
+    response.headers['Location'] = f'/job/{job.id}'
+    return job.to_dict()
+
+
+def lookup_result(uuids, found):
+    # Results keep the order of the request, duplicates collapsed.
+    uuids = [str(uuid_) for uuid_ in dict.fromkeys(uuids)]
+    return {
+        'found': {uuid_: found[uuid_] for uuid_ in uuids if uuid_ in found},
+        'missing': [uuid_ for uuid_ in uuids if uuid_ not in found],
+    }
+
+
+def etag(version: int):
+    return f'"{version}"'
+
+
+def parse_if_match(if_match: Optional[str]):
+    # The expected row version, or None when any version will do.
+    if if_match is None or if_match.strip() == '*':
+        return None
+    value = if_match.strip()
+    if value.startswith('W/'):
+        value = value[2:]
+    try:
+        return int(value.strip('"'))
+    except ValueError as exception:
+        raise HTTPException(status_code=412, detail='Precondition failed') from exception
+
+
+def page_cursor(name: Optional[str], uuid_):
+    # Opaque to clients: the (name, uuid) of the last user of a page.
+    return base64.urlsafe_b64encode(json.dumps([name, str(uuid_)]).encode()).decode()
+
+
+def parse_page_cursor(cursor: Optional[str]):
+    if cursor is None:
+        return None
+    try:
+        name, uuid_ = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return name, str(uuid.UUID(uuid_))
+    except (ValueError, TypeError) as exception:
+        raise HTTPException(status_code=422, detail='Invalid cursor') from exception
+
+
+def sync_cursor(since: datetime.datetime):
+    # Opaque to clients: the time the next sync reads changes from.
+    return base64.urlsafe_b64encode(since.isoformat().encode()).decode()
+
+
+def parse_sync_cursor(cursor: str, tombstone_days: float):
+    # None for a full sync. Cursors older than the tombstones kept would
+    # miss deletes, so the client has to start over.
+    if cursor == '0':
+        return None
+    try:
+        since = datetime.datetime.fromisoformat(base64.urlsafe_b64decode(cursor.encode()).decode())
+        if since.tzinfo is not None:
+            raise ValueError()
+    except ValueError as exception:
+        raise HTTPException(status_code=422, detail='Invalid cursor') from exception
+    if since < utc_now() - datetime.timedelta(days=tombstone_days):
+        raise HTTPException(status_code=410, detail='Cursor expired, sync again from 0')
+    return since
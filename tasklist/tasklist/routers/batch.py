@@ -0,0 +1,117 @@
+# pylint: disable=missing-module-docstring, missing-function-docstring, invalid-name
+import re
+
+from fastapi import APIRouter, HTTPException, Depends
+
+from ..backends import ERRORS, INTEGRITY_ERRORS, VersionConflict, is_timeout
+from ..database import DBSession, get_db
+from ..models import Batch, BatchResult, Operation, Task, User
+
+router = APIRouter()
+
+MODELS = {'task': Task, 'user': User}
+REFERENCE = re.compile(r'^\$(\d+)$')
+
+
+class Abort(Exception):
+    # Leaves the transaction of an atomic batch, rolling it back.
+    pass
+
+
+class FailedReference(Exception):
+    pass
+
+
+def resolve(value, created):
+    # `$n` stands for the UUID created by operation n.
+    match = REFERENCE.match(value) if isinstance(value, str) else None
+    if match is None:
+        return value
+    index = int(match.group(1))
+    if index not in created:
+        raise FailedReference(f'Operation {index} did not create anything')
+    return str(created[index])
+
+
+def run_operation(db: DBSession, operation: Operation, created):
+    kind = operation.kind
+    uuid_ = resolve(operation.uuid, created)
+    item = None
+    if operation.item is not None:
+        item = MODELS[kind](**{key: resolve(value, created) for key, value in operation.item.items()})
+
+    if operation.op == 'create':
+        if item is None:
+            raise ValueError('Missing item')
+        return {'status': 200, 'uuid': getattr(db, f'create_{kind}')(item)}
+    if uuid_ is None:
+        raise ValueError('Missing uuid')
+    if operation.op == 'read':
+        item, version = getattr(db, f'read_{kind}')(uuid_, with_version=True)
+        return {'status': 200, 'uuid': uuid_, 'item': item.dict(exclude_unset=True), 'version': version}
+    if operation.op == 'delete':
+        if kind == 'user':
+            if operation.version is not None:
+                raise ValueError('Users are deleted regardless of their version')
+            db.remove_user(uuid_)
+        else:
+            db.remove_task(uuid_, version=operation.version)
+        return {'status': 200, 'uuid': uuid_}
+    if item is None:
+        raise ValueError('Missing item')
+    write = getattr(db, f'{"replace" if operation.op == "replace" else "alter"}_{kind}')
+    return {'status': 200, 'uuid': uuid_, 'version': write(uuid_, item, version=operation.version)}
+
+
+def failure(operation: Operation, exception: Exception):
+    if isinstance(exception, KeyError):
+        return {'status': 404, 'detail': f'{operation.kind.capitalize()} not found'}
+    if isinstance(exception, VersionConflict):
+        return {'status': 412, 'detail': f'{operation.kind.capitalize()} was modified'}
+    if isinstance(exception, FailedReference):
+        return {'status': 424, 'detail': str(exception)}
+    if isinstance(exception, INTEGRITY_ERRORS):
+        # A duplicate key or a reference to a missing row.
+        return {'status': 409, 'detail': str(exception)}
+    # ValueError, or a database error other than a constraint violation.
+    return {'status': 422, 'detail': str(exception)}
+
+
+@router.post(
+    '',
+    summary='Runs several operations',
+    description='Runs task and user operations in order, in one transaction on one '
+                'connection, and reports the result of each. `$n` in a UUID or item '
+                'stands for the UUID created by operation n. Operations that fail '
+                'are undone and the others committed, unless `atomic` is set: then '
+                'the first failure undoes the whole batch and the rest is not run.',
+    response_model=BatchResult,
+    response_model_exclude_unset=True,
+)
+def run_batch(batch: Batch, db: DBSession = Depends(get_db)):
+    results = []
+    created = {}
+    try:
+        with db.transaction():
+            for index, operation in enumerate(batch.operations):
+                try:
+                    with db.savepoint():
+                        result = run_operation(db, operation, created)
+                except (KeyError, VersionConflict, ValueError, FailedReference, *ERRORS) as exception:
+                    if isinstance(exception, ERRORS) and is_timeout(exception):
+                        # The request is out of time; get_db answers it.
+                        raise
+                    results.append(failure(operation, exception))
+                    if batch.atomic:
+                        raise Abort() from exception
+                    continue
+                results.append(result)
+                if operation.op == 'create':
+                    created[index] = result['uuid']
+    except Abort:
+        results += [{'status': 424, 'detail': 'Not run'}] * (len(batch.operations) - len(results))
+        return {'committed': False, 'results': results}
+    except ValueError as exception:
+        # Raised before any operation ran.
+        raise HTTPException(status_code=422, detail=str(exception)) from exception
+    return {'committed': True, 'results': results}
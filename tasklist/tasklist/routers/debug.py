@@ -0,0 +1,57 @@
+# pylint: disable=missing-module-docstring, missing-function-docstring, invalid-name
+import hmac
+
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse
+
+from ..profiler import Profiler, ProfilerBusy, get_profiler
+
+router = APIRouter()
+
+
+def check_token(
+        authorization: Optional[str] = Header(None),
+        profiler: Profiler = Depends(get_profiler),
+):
+    # Without a profiler section in the config the endpoint does not exist.
+    if profiler is None:
+        raise HTTPException(status_code=404, detail='Not Found')
+    scheme, _, token = (authorization or '').partition(' ')
+    if scheme.lower() != 'bearer' or not token:
+        raise HTTPException(
+            status_code=401,
+            detail='Missing debug token',
+            headers={'WWW-Authenticate': 'Bearer'},
+        )
+    if not hmac.compare_digest(token.encode(), profiler.token.encode()):
+        raise HTTPException(status_code=403, detail='Invalid debug token')
+    return profiler
+
+
+@router.get(
+    '/profile',
+    summary='Profiles the worker',
+    description='Samples every thread of this worker for `seconds` and returns '
+                'collapsed stacks for flame graphs, plus the seconds each route '
+                'spent in the database, pydantic validation and JSON encoding. '
+                'Needs the configured token as a bearer token.',
+)
+async def read_profile(
+        seconds: float = Query(5.0, gt=0, le=60),
+        format_: str = Query('json', alias='format', regex='^(json|collapsed)$'),
+        profiler: Profiler = Depends(check_token),
+):
+    try:
+        # The event loop keeps serving requests while it is being sampled.
+        profile = await run_in_threadpool(profiler.profile, seconds)
+    except ProfilerBusy as exception:
+        raise HTTPException(
+            status_code=409,
+            detail='A profile is already running',
+        ) from exception
+    if format_ == 'collapsed':
+        return PlainTextResponse('\n'.join(profile['collapsed']) + '\n')
+    return profile
@@ -0,0 +1,52 @@
+# pylint: disable=missing-module-docstring, missing-function-docstring, invalid-name
+import json
+import uuid
+
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header
+from fastapi.responses import StreamingResponse
+
+from ..feed import ChangeFeed, get_feed
+
+router = APIRouter()
+
+
+async def stream_events(feed: ChangeFeed, sequence: Optional[int], user_uuid: Optional[str]):
+    if sequence is not None and not feed.is_available(sequence):
+        # The client fell too far behind: it has to reload the lists.
+        sequence = feed.sequence
+        yield f'id: {sequence}\nevent: reset\ndata: {json.dumps({"sequence": sequence})}\n\n'
+
+    async for event in feed.subscribe(sequence, user_uuid):
+        if event is None:
+            yield ': keepalive\n\n'
+        else:
+            yield f'id: {event["sequence"]}\nevent: {event["kind"]}\ndata: {json.dumps(event)}\n\n'
+
+
+@router.get(
+    '',
+    summary='Streams changes',
+    description='Streams task and user changes as Server-Sent Events. '
+                'Reconnecting clients resume from `last_sequence` or the '
+                '`Last-Event-ID` header.',
+)
+async def read_feed(
+        user_uuid: Optional[uuid.UUID] = None,
+        last_sequence: Optional[int] = None,
+        last_event_id: Optional[int] = Header(None),
+        feed: ChangeFeed = Depends(get_feed),
+):
+    if last_sequence is None:
+        last_sequence = last_event_id
+
+    return StreamingResponse(
+        stream_events(
+            feed,
+            last_sequence,
+            None if user_uuid is None else str(user_uuid),
+        ),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache'},
+    )
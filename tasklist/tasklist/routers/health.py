@@ -0,0 +1,45 @@
+# pylint: disable=missing-module-docstring, missing-function-docstring
+from fastapi import APIRouter, Depends
+from fastapi.responses import JSONResponse
+
+from ..admission import AdmissionControl, get_admission
+from ..database import get_write_behind
+from ..deadlines import Deadlines, get_deadlines
+from ..singleflight import SingleFlight, get_single_flight
+from ..warmup import Readiness, get_readiness
+from ..writebehind import WriteBehindCache
+
+router = APIRouter()
+
+
+@router.get(
+    '/ready',
+    summary='Reports readiness',
+    description='Returns 200 once the worker has finished warming up, 503 before.',
+)
+def read_ready(readiness: Readiness = Depends(get_readiness)):
+    if not readiness.ready:
+        return JSONResponse({'ready': False}, status_code=503)
+    return {'ready': True}
+
+
+@router.get(
+    '/metrics',
+    summary='Reports load metrics',
+    description='Reports active, queued, admitted and rejected requests per route, '
+                'the writes waiting for the database in write-behind mode, the '
+                'queries run and shared by single-flight reads and the requests '
+                'that ran out of their deadline per route.',
+)
+def read_metrics(
+        admission: AdmissionControl = Depends(get_admission),
+        write_behind: WriteBehindCache = Depends(get_write_behind),
+        single_flight: SingleFlight = Depends(get_single_flight),
+        deadlines: Deadlines = Depends(get_deadlines),
+):
+    return {
+        'admission': {} if admission is None else admission.stats(),
+        'write_behind': None if write_behind is None else write_behind.stats(),
+        'single_flight': None if single_flight is None else single_flight.stats(),
+        'deadlines': {} if deadlines is None else deadlines.stats(),
+    }
@@ -0,0 +1,21 @@
+# pylint: disable=missing-module-docstring, missing-function-docstring, invalid-name
+from fastapi import APIRouter, HTTPException, Depends
+
+from ..jobs import JobQueue, get_jobs
+
+router = APIRouter()
+
+
+@router.get(
+    '/{job_id}',
+    summary='Reads job',
+    description='Reads the status and progress of a background job.',
+)
+def read_job(job_id: str, jobs: JobQueue = Depends(get_jobs)):
+    try:
+        return jobs.get(job_id).to_dict()
+    except KeyError as exception:
+        raise HTTPException(
+            status_code=404,
+            detail='Job not found',
+        ) from exception
@@ -1,12 +1,23 @@
 # pylint: disable=missing-module-docstring, missing-function-docstring, invalid-name
+import datetime
 import uuid
 
-from typing import Dict
+from typing import Dict, Optional, Union
 
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Header, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 
-from ..database import DBSession, get_db
-from ..models import Task
+from . import (
+    etag, lookup_result, parse_fields, parse_if_match, parse_items, parse_sync_cursor, start_job, sync_cursor,
+)
+from ..bulk import FORMATS, format_rows
+from ..backends import VersionConflict
+from ..database import (
+    DBSession, TASK_FIELDS, get_archive_after_days, get_db, get_session_factory, get_sync_settings, utc_now,
+)
+from ..jobs import JobQueue, get_jobs
+from ..models import Lookup, Task, TaskChanges, TaskLookup
 
 router = APIRouter()
 
@@ -14,11 +25,56 @@ router = APIRouter()
 @router.get(
     '',
     summary='Reads task list',
-    description='Reads the whole task list.',
-    response_model=Dict[uuid.UUID, Task],
+    description='Reads the task list, optionally filtered by user and completion, '
+                'sorted and limited. Archived tasks are only included on request. '
+                'With `updated_since`, reads only the tasks changed and the UUIDs of '
+                'the tasks deleted since the sync that returned the cursor, and a '
+                'cursor for the next sync; `0` starts a full sync.',
+    response_model=Union[Dict[uuid.UUID, Task], TaskChanges],
+    response_model_exclude_unset=True,
 )
-async def read_tasks(completed: bool = None, db: DBSession = Depends(get_db)):
-    return db.read_tasks(completed)
+def read_tasks(
+        completed: bool = None,
+        fields: Optional[str] = Query(None, description='Comma-separated fields to return.'),
+        user_uuid: Optional[uuid.UUID] = None,
+        sort: Optional[str] = Query(
+            None,
+            regex='^-?(due_date|priority)$',
+            description='`due_date` or `priority`, prefixed with `-` for descending order.',
+        ),
+        limit: Optional[int] = Query(None, ge=1, le=1000),
+        include_archived: bool = False,
+        updated_since: Optional[str] = Query(
+            None,
+            description='Cursor returned by the previous sync, or `0` for a full sync.',
+        ),
+        sync_settings: dict = Depends(get_sync_settings),
+        db: DBSession = Depends(get_db),
+):
+    if updated_since is not None:
+        if completed is not None or sort is not None or limit is not None or include_archived:
+            raise HTTPException(
+                status_code=422,
+                detail='updated_since cannot be combined with completed, sort, limit or include_archived',
+            )
+        since = parse_sync_cursor(updated_since, sync_settings['tombstone_days'])
+        # The next sync starts a little before this one, so writes that
+        # were stamped before it but committed after it are not missed.
+        cursor = sync_cursor(utc_now() - datetime.timedelta(seconds=sync_settings['settle_seconds']))
+        try:
+            tasks, deleted = db.read_task_changes(since, parse_fields(fields, TASK_FIELDS), user_uuid)
+        except ValueError as exception:
+            raise HTTPException(status_code=422, detail=str(exception)) from exception
+        return {'tasks': tasks, 'deleted': deleted, 'cursor': cursor}
+
+    return db.read_tasks(
+        completed,
+        parse_fields(fields, TASK_FIELDS),
+        user_uuid=user_uuid,
+        sort=sort,
+        limit=limit,
+        include_archived=include_archived,
+    )
 
 
 @router.post(
@@ -27,86 +83,210 @@ async def read_tasks(completed: bool = None, db: DBSession = Depends(get_db)):
     description='Creates a new task and returns its UUID.',
     response_model=uuid.UUID,
 )
-async def create_task(item: Task, db: DBSession = Depends(get_db)):
+def create_task(item: Task, db: DBSession = Depends(get_db)):
     return db.create_task(item)
 
 
+@router.get(
+    '/export',
+    summary='Exports tasks',
+    description='Streams every task as NDJSON or CSV.',
+)
+def export_tasks(
+        format_: str = Query('ndjson', alias='format', regex='^(ndjson|csv)$'),
+        db: DBSession = Depends(get_db),
+):
+    return StreamingResponse(
+        format_rows(db.export_tasks(), ('uuid', ) + TASK_FIELDS, format_),
+        media_type=FORMATS[format_],
+    )
+
+
+@router.post(
+    '/import',
+    summary='Imports tasks',
+    description='Loads tasks exported by `GET /task/export`, as NDJSON or as CSV '
+                '(`Content-Type: text/csv`), in large batches.',
+)
+async def import_tasks(request: Request, db: DBSession = Depends(get_db)):
+    try:
+        imported = await run_in_threadpool(db.import_tasks, parse_items(request, Task))
+    except ValueError as exception:
+        raise HTTPException(
+            status_code=422,
+            detail=str(exception),
+        ) from exception
+    return {'imported': imported}
+
+
+@router.post(
+    '/archive',
+    summary='Archives completed tasks',
+    description='Starts a background job that moves tasks completed more than '
+                '`after_days` days ago to the archive, and drops the tombstones of '
+                'deleted tasks that sync cursors no longer reach. Poll '
+                '`GET /job/{job_id}` for its progress.',
+    status_code=202,
+)
+def archive_tasks(
+        response: Response,
+        after_days: Optional[float] = Query(None, gt=0),
+        default_after_days: float = Depends(get_archive_after_days),
+        sync_settings: dict = Depends(get_sync_settings),
+        jobs: JobQueue = Depends(get_jobs),
+        make_session=Depends(get_session_factory),
+):
+    if after_days is None:
+        after_days = default_after_days
+
+    def run(db, job):
+        db.archive_tasks(after_days, jobs.chunk_size, jobs.pause, job.progress)
+        # Tombstones no cursor can ask for any more go with the same job.
+        db.purge_tombstones(utc_now() - datetime.timedelta(days=sync_settings['tombstone_days']))
+
+    return start_job(response, jobs, 'archive_tasks', make_session, run)
+
+
+@router.post(
+    '/lookup',
+    summary='Reads many tasks',
+    description='Reads up to 1000 tasks by UUID in one query and reports '
+                'which UUIDs were not found.',
+    response_model=TaskLookup,
+    response_model_exclude_unset=True,
+)
+def lookup_tasks(
+        item: Lookup,
+        fields: Optional[str] = Query(None, description='Comma-separated fields to return.'),
+        db: DBSession = Depends(get_db),
+):
+    return lookup_result(
+        item.uuids,
+        db.lookup_tasks(item.uuids, parse_fields(fields, TASK_FIELDS)),
+    )
+
+
 @router.get(
     '/{uuid_}',
     summary='Reads task',
-    description='Reads task from UUID.',
+    description='Reads task from UUID. The `ETag` header carries its version.',
     response_model=Task,
+    response_model_exclude_unset=True,
 )
-async def read_task(uuid_: uuid.UUID, db: DBSession = Depends(get_db)):
+def read_task(
+        uuid_: uuid.UUID,
+        response: Response,
+        fields: Optional[str] = Query(None, description='Comma-separated fields to return.'),
+        db: DBSession = Depends(get_db),
+):
     try:
-        return db.read_task(uuid_)
+        item, version = db.read_task(uuid_, parse_fields(fields, TASK_FIELDS), with_version=True)
     except KeyError as exception:
         raise HTTPException(
             status_code=404,
             detail='Task not found',
         ) from exception
+    response.headers['ETag'] = etag(version)
+    return item
 
 
 @router.put(
     '/{uuid_}',
     summary='Replaces a task',
-    description='Replaces a task identified by its UUID.',
+    description='Replaces a task identified by its UUID. With `If-Match`, only '
+                'if it is still at that version.',
 )
-async def replace_task(
+def replace_task(
         uuid_: uuid.UUID,
         item: Task,
+        response: Response,
+        if_match: Optional[str] = Header(None),
         db: DBSession = Depends(get_db),
 ):
     try:
-        db.replace_task(uuid_, item)
+        version = db.replace_task(uuid_, item, version=parse_if_match(if_match))
     except KeyError as exception:
         raise HTTPException(
             status_code=404,
             detail='Task not found',
         ) from exception
+    except VersionConflict as exception:
+        raise HTTPException(
+            status_code=412,
+            detail='Task was modified',
+        ) from exception
+    response.headers['ETag'] = etag(version)
 
 
 @router.patch(
     '/{uuid_}',
     summary='Alters task',
-    description='Alters a task identified by its UUID',
+    description='Alters a task identified by its UUID. With `If-Match`, only '
+                'if it is still at that version.',
 )
-async def alter_task(
+def alter_task(
         uuid_: uuid.UUID,
         item: Task,
+        response: Response,
+        if_match: Optional[str] = Header(None),
         db: DBSession = Depends(get_db),
 ):
     try:
-        old_item = db.read_task(uuid_)
-        update_data = item.dict(exclude_unset=True)
-        new_item = old_item.copy(update=update_data)
-        db.replace_task(uuid_, new_item)
+        version = db.alter_task(uuid_, item, version=parse_if_match(if_match))
     except KeyError as exception:
         raise HTTPException(
             status_code=404,
             detail='Task not found',
         ) from exception
+    except VersionConflict as exception:
+        raise HTTPException(
+            status_code=412,
+            detail='Task was modified',
+        ) from exception
+    response.headers['ETag'] = etag(version)
 
 
 @router.delete(
     '/{uuid_}',
     summary='Deletes task',
-    description='Deletes a task identified by its UUID',
+    description='Deletes a task identified by its UUID. With `If-Match`, only '
+                'if it is still at that version.',
 )
-async def remove_task(uuid_: uuid.UUID, db: DBSession = Depends(get_db)):
+def remove_task(
+        uuid_: uuid.UUID,
+        if_match: Optional[str] = Header(None),
+        db: DBSession = Depends(get_db),
+):
     try:
-        db.remove_task(uuid_)
+        db.remove_task(uuid_, version=parse_if_match(if_match))
     except KeyError as exception:
         raise HTTPException(
             status_code=404,
             detail='Task not found',
         ) from exception
+    except VersionConflict as exception:
+        raise HTTPException(
+            status_code=412,
+            detail='Task was modified',
+        ) from exception
 
 
 @router.delete(
     '',
     summary='Deletes all tasks, use with caution',
-    description='Deletes all tasks, use with caution',
+    description='Starts a background job that deletes all tasks in chunks. '
+                'Poll `GET /job/{job_id}` for its progress.',
+    status_code=202,
 )
-async def remove_all_tasks(db: DBSession = Depends(get_db)):
-    db.remove_all_tasks()
+def remove_all_tasks(
+        response: Response,
+        jobs: JobQueue = Depends(get_jobs),
+        make_session=Depends(get_session_factory),
+):
+    return start_job(
+        response,
+        jobs,
+        'remove_all_tasks',
+        make_session,
+        lambda db, job: db.remove_all_tasks(jobs.chunk_size, jobs.pause, job.progress),
+    )
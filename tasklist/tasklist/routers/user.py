@@ -1,12 +1,27 @@
 # pylint: disable=missing-module-docstring, missing-function-docstring, invalid-name
 import uuid
 
-from typing import Dict
+from typing import Dict, Optional
 
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Header, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 
-from ..database import DBSession, get_db
-from ..models import User
+from . import (
+    etag,
+    lookup_result,
+    page_cursor,
+    parse_fields,
+    parse_if_match,
+    parse_items,
+    parse_page_cursor,
+    start_job,
+)
+from ..bulk import FORMATS, format_rows
+from ..backends import VersionConflict
+from ..database import DBSession, USER_FIELDS, get_db, get_session_factory
+from ..jobs import JobQueue, get_jobs
+from ..models import Lookup, User, UserLookup
 
 router = APIRouter()
 
@@ -14,11 +29,38 @@ router = APIRouter()
 @router.get(
     '',
     summary='Reads user list',
-    description='Reads the whole user list.',
+    description='Reads the user list. With `name_prefix`, `limit` or `after`, users '
+                'are returned in name order, matched case-insensitively, and a full '
+                'page carries the `after` cursor of the next one in `X-Next-Cursor`.',
     response_model=Dict[uuid.UUID, User],
+    response_model_exclude_unset=True,
 )
-async def read_users(db: DBSession = Depends(get_db)):
-    return db.read_users()
+def read_users(
+        response: Response,
+        fields: Optional[str] = Query(None, description='Comma-separated fields to return.'),
+        name_prefix: Optional[str] = Query(None, min_length=1, max_length=64),
+        limit: Optional[int] = Query(None, ge=1, le=1000),
+        after: Optional[str] = Query(None, description='`X-Next-Cursor` of the previous page.'),
+        db: DBSession = Depends(get_db),
+):
+    fields = parse_fields(fields, USER_FIELDS)
+    if limit is None:
+        return db.read_users(fields, name_prefix=name_prefix, after=parse_page_cursor(after))
+
+    # The cursor needs the name of the last user, even if it is not returned.
+    projected = fields is not None and 'name' not in fields
+    users = db.read_users(
+        fields + ('name', ) if projected else fields,
+        name_prefix=name_prefix,
+        limit=limit,
+        after=parse_page_cursor(after),
+    )
+    if len(users) == limit:
+        last_uuid, last = list(users.items())[-1]
+        response.headers['X-Next-Cursor'] = page_cursor(last.name, last_uuid)
+    if projected:
+        return {uuid_: User(**user.dict(exclude={'name'}, exclude_unset=True)) for uuid_, user in users.items()}
+    return users
 
 
 @router.post(
@@ -27,86 +69,189 @@ async def read_users(db: DBSession = Depends(get_db)):
     description='Creates a new user and returns its UUID.',
     response_model=uuid.UUID,
 )
-async def create_user(item: User, db: DBSession = Depends(get_db)):
+def create_user(item: User, db: DBSession = Depends(get_db)):
     return db.create_user(item)
 
 
+@router.get(
+    '/export',
+    summary='Exports users',
+    description='Streams every user as NDJSON or CSV.',
+)
+def export_users(
+        format_: str = Query('ndjson', alias='format', regex='^(ndjson|csv)$'),
+        db: DBSession = Depends(get_db),
+):
+    return StreamingResponse(
+        format_rows(db.export_users(), ('uuid', ) + USER_FIELDS, format_),
+        media_type=FORMATS[format_],
+    )
+
+
+@router.post(
+    '/import',
+    summary='Imports users',
+    description='Loads users exported by `GET /user/export`, as NDJSON or as CSV '
+                '(`Content-Type: text/csv`), in large batches.',
+)
+async def import_users(request: Request, db: DBSession = Depends(get_db)):
+    try:
+        imported = await run_in_threadpool(db.import_users, parse_items(request, User))
+    except ValueError as exception:
+        raise HTTPException(
+            status_code=422,
+            detail=str(exception),
+        ) from exception
+    return {'imported': imported}
+
+
+@router.post(
+    '/lookup',
+    summary='Reads many users',
+    description='Reads up to 1000 users by UUID in one query and reports '
+                'which UUIDs were not found.',
+    response_model=UserLookup,
+    response_model_exclude_unset=True,
+)
+def lookup_users(
+        item: Lookup,
+        fields: Optional[str] = Query(None, description='Comma-separated fields to return.'),
+        db: DBSession = Depends(get_db),
+):
+    return lookup_result(
+        item.uuids,
+        db.lookup_users(item.uuids, parse_fields(fields, USER_FIELDS)),
+    )
+
+
 @router.get(
     '/{uuid_}',
     summary='Reads user',
-    description='Reads user from UUID.',
+    description='Reads user from UUID. The `ETag` header carries its version.',
     response_model=User,
+    response_model_exclude_unset=True,
 )
-async def read_user(uuid_: uuid.UUID, db: DBSession = Depends(get_db)):
+def read_user(
+        uuid_: uuid.UUID,
+        response: Response,
+        fields: Optional[str] = Query(None, description='Comma-separated fields to return.'),
+        db: DBSession = Depends(get_db),
+):
     try:
-        return db.read_user(uuid_)
+        item, version = db.read_user(uuid_, parse_fields(fields, USER_FIELDS), with_version=True)
     except KeyError as exception:
         raise HTTPException(
             status_code=404,
             detail='User not found',
         ) from exception
+    response.headers['ETag'] = etag(version)
+    return item
 
 
 @router.put(
     '/{uuid_}',
     summary='Replaces a user',
-    description='Replaces a user identified by its UUID.',
+    description='Replaces a user identified by its UUID. With `If-Match`, only '
+                'if it is still at that version.',
 )
-async def replace_user(
+def replace_user(
         uuid_: uuid.UUID,
         item: User,
+        response: Response,
+        if_match: Optional[str] = Header(None),
         db: DBSession = Depends(get_db),
 ):
     try:
-        db.replace_user(uuid_, item)
+        version = db.replace_user(uuid_, item, version=parse_if_match(if_match))
     except KeyError as exception:
         raise HTTPException(
             status_code=404,
             detail='User not found',
         ) from exception
+    except VersionConflict as exception:
+        raise HTTPException(
+            status_code=412,
+            detail='User was modified',
+        ) from exception
+    response.headers['ETag'] = etag(version)
 
 
 @router.patch(
     '/{uuid_}',
     summary='Alters user',
-    description='Alters a user identified by its UUID',
+    description='Alters a user identified by its UUID. With `If-Match`, only '
+                'if it is still at that version.',
 )
-async def alter_user(
+def alter_user(
         uuid_: uuid.UUID,
         item: User,
+        response: Response,
+        if_match: Optional[str] = Header(None),
         db: DBSession = Depends(get_db),
 ):
     try:
-        old_item = db.read_user(uuid_)
-        update_data = item.dict(exclude_unset=True)
-        new_item = old_item.copy(update=update_data)
-        db.replace_user(uuid_, new_item)
+        version = db.alter_user(uuid_, item, version=parse_if_match(if_match))
     except KeyError as exception:
         raise HTTPException(
             status_code=404,
             detail='User not found',
         ) from exception
+    except VersionConflict as exception:
+        raise HTTPException(
+            status_code=412,
+            detail='User was modified',
+        ) from exception
+    response.headers['ETag'] = etag(version)
 
 
 @router.delete(
     '/{uuid_}',
     summary='Deletes user',
-    description='Deletes a user identified by its UUID',
+    description='Starts a background job that deletes a user identified by its '
+                'UUID and their tasks in chunks. Poll `GET /job/{job_id}` for '
+                'its progress.',
+    status_code=202,
 )
-async def remove_user(uuid_: uuid.UUID, db: DBSession = Depends(get_db)):
+def remove_user(
+        uuid_: uuid.UUID,
+        response: Response,
+        db: DBSession = Depends(get_db),
+        jobs: JobQueue = Depends(get_jobs),
+        make_session=Depends(get_session_factory),
+):
     try:
-        db.remove_user(uuid_)
+        db.read_user(uuid_, fields=())
     except KeyError as exception:
         raise HTTPException(
             status_code=404,
             detail='user not found',
         ) from exception
 
+    return start_job(
+        response,
+        jobs,
+        'remove_user',
+        make_session,
+        lambda db, job: db.remove_user(uuid_, jobs.chunk_size, jobs.pause, job.progress),
+    )
+
 
 @router.delete(
     '',
     summary='Deletes all users, use with caution',
-    description='Deletes all users, use with caution',
+    description='Starts a background job that deletes all users and their tasks '
+                'in chunks. Poll `GET /job/{job_id}` for its progress.',
+    status_code=202,
 )
-async def remove_all_users(db: DBSession = Depends(get_db)):
-    db.remove_all_users()
+def remove_all_users(
+        response: Response,
+        jobs: JobQueue = Depends(get_jobs),
+        make_session=Depends(get_session_factory),
+):
+    return start_job(
+        response,
+        jobs,
+        'remove_all_users',
+        make_session,
+        lambda db, job: db.remove_all_users(jobs.chunk_size, jobs.pause, job.progress),
+    )
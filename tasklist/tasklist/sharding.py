@@ -0,0 +1,464 @@
+# pylint: disable=missing-module-docstring, missing-function-docstring, missing-class-docstring
+import contextlib
+import hashlib
+import heapq
+import itertools
+import json
+import uuid
+
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.utils import get_shard_configs
+
+from .backends import ImportFailed, create_backend_from_config
+from .coalescer import create_coalescer
+from .models import Task, User
+
+HASH_SPACE = 65536
+
+executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix='shard')
+
+
+def shard_hash(uuid_):
+    # UUIDv7 keys start with a timestamp, so the key bytes are hashed to
+    # spread users evenly over the hash space.
+    digest = hashlib.md5(uuid.UUID(str(uuid_)).bytes).digest()
+    return int.from_bytes(digest[:2], 'big')
+
+
+def name_order(name, uuid_, name_key):
+    # The (name, uuid) order of the users_name index; `name_key` is the
+    # backend's collation. NULL names come first.
+    return name is not None, name_key(name or ''), uuid.UUID(str(uuid_)).bytes
+
+
+class Shard:
+    def __init__(self, low: int, high: int, backend, coalescer=None):
+        self.low = low
+        self.high = high
+        self.backend = backend
+        self.coalescer = coalescer
+
+
+class ShardMap:
+    def __init__(self, shards, overrides=None):
+        self.shards = shards
+        # Users moved by the rebalancing tool, pinned to a shard index.
+        self.overrides = {
+            str(uuid.UUID(user_uuid)): index
+            for user_uuid, index in (overrides or {}).items()
+        }
+
+    def index_for(self, user_uuid):
+        user_uuid = str(uuid.UUID(str(user_uuid)))
+        if user_uuid in self.overrides:
+            return self.overrides[user_uuid]
+
+        value = shard_hash(user_uuid)
+        for index, shard in enumerate(self.shards):
+            if shard.low <= value < shard.high:
+                return index
+        raise ValueError(f'No shard owns hash {value}')
+
+
+def create_shard_map(config_file_name: str, secrets_file_name: str):
+    with open(config_file_name, 'r') as file:
+        config = json.load(file)
+    if 'shards' not in config:
+        return None
+
+    shards = []
+    for shard_config in get_shard_configs(config):
+        backend = create_backend_from_config(shard_config, config_file_name, secrets_file_name)
+        low, high = shard_config['hash_range']
+        shards.append(Shard(low, high, backend, create_coalescer(shard_config, backend)))
+
+    ranges = sorted((shard.low, shard.high) for shard in shards)
+    bounds = [0] + [bound for range_ in ranges for bound in range_] + [HASH_SPACE]
+    if any(bounds[index] != bounds[index + 1] for index in range(0, len(bounds), 2)):
+        raise ValueError(f'Shard hash ranges must cover [0, {HASH_SPACE}) without gaps')
+    return ShardMap(shards, config.get('shard_overrides'))
+
+
+def move_user(config_file_name: str, secrets_file_name: str, user_uuid: str, target: int):
+    # Copies a user and their tasks to another shard, pins the user there in
+    # the config file and only then deletes the rows from the old shard.
+    # Workers pick the new shard map up when they are restarted.
+    #
+    # Writes are fenced: the user's rows on the old shard stay locked from
+    # before they are read until they are deleted, so a write to them waits
+    # and then finds the user gone, instead of landing after the copy and
+    # being deleted with the rest.
+    shard_map = create_shard_map(config_file_name, secrets_file_name)
+    source = shard_map.index_for(user_uuid)
+    if source == target:
+        return 0
+    key = uuid.UUID(str(user_uuid)).bytes
+
+    source_backend = shard_map.shards[source].backend
+    source_connection = source_backend.open()
+    target_connection = shard_map.shards[target].backend.open()
+    try:
+        with source_connection.cursor() as cursor:
+            if source_backend.name == 'sqlite':
+                # SQLite has no row locks: the whole database is locked
+                # for writing instead.
+                cursor.execute('BEGIN IMMEDIATE')
+                lock = ''
+            else:
+                # On InnoDB, inserting a task for the user also waits for
+                # the lock on the user row.
+                lock = ' FOR UPDATE'
+            cursor.execute(f'SELECT * FROM users WHERE uuid = %s{lock}', (key, ))
+            users = cursor.fetchall()
+            cursor.execute(f'SELECT * FROM tasks WHERE user_uuid = %s{lock}', (key, ))
+            tasks = cursor.fetchall()
+            cursor.execute(f'SELECT * FROM tasks_archive WHERE user_uuid = %s{lock}', (key, ))
+            archived = cursor.fetchall()
+        if not users:
+            raise KeyError(user_uuid)
+
+        with target_connection.cursor() as cursor:
+            for table, rows in (('users', users), ('tasks', tasks), ('tasks_archive', archived)):
+                if rows:
+                    placeholders = ', '.join(['%s'] * len(rows[0]))
+                    cursor.executemany(f'INSERT INTO {table} VALUES ({placeholders})', rows)
+        target_connection.commit()
+
+        with open(config_file_name, 'r') as file:
+            config = json.load(file)
+        config.setdefault('shard_overrides', {})[str(uuid.UUID(str(user_uuid)))] = target
+        with open(config_file_name, 'w') as file:
+            json.dump(config, file, indent=4)
+
+        # The archive has no foreign key to users, so it is deleted first.
+        with source_connection.cursor() as cursor:
+            cursor.execute('DELETE FROM tasks_archive WHERE user_uuid = %s', (key, ))
+            cursor.execute('DELETE FROM users WHERE uuid = %s', (key, ))
+        source_connection.commit()
+    finally:
+        source_connection.close()
+        target_connection.close()
+
+    return len(tasks) + len(archived)
+
+
+class ShardedDBSession:
+    def __init__(self, shard_map: ShardMap, make_session, new_uuid=uuid.uuid4, deadline: float = None):
+        self.shard_map = shard_map
+        self.sessions = [make_session(shard, deadline) for shard in shard_map.shards]
+        self.__new_uuid = new_uuid
+
+    def close(self):
+        for session in self.sessions:
+            session.close()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        # One transaction per shard, committed one after the other: a
+        # transaction is all-or-nothing unless a shard fails to commit after
+        # another one did.
+        with contextlib.ExitStack() as stack:
+            for session in self.sessions:
+                stack.enter_context(session.transaction())
+            yield self
+
+    @contextlib.contextmanager
+    def savepoint(self):
+        with contextlib.ExitStack() as stack:
+            for session in self.sessions:
+                stack.enter_context(session.savepoint())
+            yield self
+
+    def read_tasks(
+            self,
+            completed: bool = None,
+            fields=None,
+            user_uuid=None,
+            sort=None,
+            limit=None,
+            include_archived=False,
+    ):
+        if user_uuid is not None:
+            # A user's tasks all live on the user's shard.
+            return self.__for_user(user_uuid).read_tasks(
+                completed, fields, user_uuid=user_uuid, sort=sort, limit=limit,
+                include_archived=include_archived,
+            )
+        if sort is None:
+            merged = self.__merge(
+                lambda session: session.read_tasks(
+                    completed, fields, limit=limit, include_archived=include_archived,
+                ),
+            )
+            return dict(itertools.islice(merged.items(), limit))
+
+        # Every shard returns its first `limit` rows in order and the global
+        # first `limit` rows are among them. The sort key itself is checked
+        # by the shard sessions.
+        column, descending = sort.lstrip('-'), sort.startswith('-')
+        projected = fields is not None and column not in fields
+        shard_fields = tuple(fields) + (column, ) if projected else fields
+        results = self.__on_all(
+            lambda session: session.read_tasks(
+                completed, shard_fields, sort=sort, limit=limit, include_archived=include_archived,
+            ),
+        )
+
+        def key(entry):
+            uuid_, task = entry
+            value = getattr(task, column)
+            # Both backends put NULLs first in ascending order.
+            return value is not None, value, uuid.UUID(uuid_).bytes
+
+        merged = heapq.merge(
+            *(result.items() for result in results),
+            key=key,
+            reverse=descending,
+        )
+        return {
+            uuid_: Task(**task.dict(exclude={column}, exclude_unset=True)) if projected else task
+            for uuid_, task in itertools.islice(merged, limit)
+        }
+
+    def create_task(self, item, uuid_=None):
+        if uuid_ is None:
+            uuid_ = self.__new_uuid()
+        return self.__for_task(uuid_, item).create_task(item, uuid_)
+
+    def read_task(self, uuid_, fields=None, with_version=False):
+        return self.__first(lambda session: session.read_task(uuid_, fields, with_version))
+
+    def lookup_tasks(self, uuids, fields=None):
+        return self.__merge(lambda session: session.lookup_tasks(uuids, fields))
+
+    def replace_task(self, uuid_, item, action='replace', version=None):
+        source = self.__task_owner(uuid_)
+        target = self.__for_task(uuid_, item)
+        if source is target:
+            return source.replace_task(uuid_, item, action, version)
+
+        # The task changed to a user on another shard: copy it there before
+        # removing it, so it is never missing from reads. The version is
+        # checked by the delete, and a conflict undoes the copy. Neither half
+        # is announced on its own: the feed gets one event for the move.
+        current, created_at, completed_at = source.read_task_times(uuid_)
+        target.create_task(
+            item,
+            uuid_,
+            version=current + 1,
+            action=None,
+            created_at=created_at,
+            completed_at=completed_at,
+        )
+        try:
+            source.remove_task(uuid_, current if version is None else version, action=None)
+        except Exception:
+            target.remove_task(uuid_, action=None)
+            raise
+        target.announce_task(action, uuid_, item)
+        return current + 1
+
+    def alter_task(self, uuid_, item, version=None):
+        source = self.__task_owner(uuid_)
+        update_data = item.dict(exclude_unset=True)
+        if 'user_uuid' not in update_data or self.__for_task(uuid_, item) is source:
+            return source.alter_task(uuid_, item, version)
+
+        old_item, current = source.read_task(uuid_, with_version=True)
+        return self.replace_task(
+            uuid_,
+            old_item.copy(update=update_data),
+            action='patch',
+            version=current if version is None else version,
+        )
+
+    def remove_task(self, uuid_, version=None):
+        self.__task_owner(uuid_).remove_task(uuid_, version)
+
+    def remove_all_tasks(self, chunk_size: int = 1000, pause: float = 0.0, on_chunk=None):
+        self.__on_all(lambda session: session.remove_all_tasks(chunk_size, pause, on_chunk))
+
+    def archive_tasks(self, after_days: float, chunk_size: int = 1000, pause: float = 0.0, on_chunk=None):
+        return sum(self.__on_all(
+            lambda session: session.archive_tasks(after_days, chunk_size, pause, on_chunk),
+        ))
+
+    def read_task_changes(self, since=None, fields=None, user_uuid=None):
+        if user_uuid is not None:
+            return self.__for_user(user_uuid).read_task_changes(since, fields, user_uuid)
+        # A task moved to another shard left a tombstone on the old one.
+        tasks = {}
+        deleted = set()
+        for shard_tasks, shard_deleted in self.__on_all(
+                lambda session: session.read_task_changes(since, fields),
+        ):
+            tasks.update(shard_tasks)
+            deleted.update(shard_deleted)
+        return tasks, sorted(deleted - tasks.keys())
+
+    def purge_tombstones(self, before, chunk_size: int = 1000):
+        return sum(self.__on_all(lambda session: session.purge_tombstones(before, chunk_size)))
+
+    def export_tasks(self, batch_size: int = 1000):
+        for session in self.sessions:
+            yield from session.export_tasks(batch_size)
+
+    def import_tasks(self, items, batch_size: int = 5000):
+        return self.__import(
+            items,
+            lambda uuid_, item: self.__task_index(uuid_, item),
+            lambda session, batch: session.import_tasks(batch, batch_size),
+            batch_size,
+        )
+
+    def read_users(self, fields=None, name_prefix=None, limit=None, after=None):
+        if name_prefix is None and limit is None and after is None:
+            return self.__merge(lambda session: session.read_users(fields))
+
+        # Like sorted task lists: the first `limit` users after the cursor
+        # are among the first `limit` of every shard. Shards return them in
+        # their collation's order, so that is the order they are merged in;
+        # all shards are expected to run the same backend.
+        projected = fields is not None and 'name' not in fields
+        shard_fields = tuple(fields) + ('name', ) if projected else fields
+        results = self.__on_all(
+            lambda session: session.read_users(shard_fields, name_prefix, limit, after),
+        )
+        name_key = self.shard_map.shards[0].backend.name_key
+        merged = heapq.merge(
+            *(result.items() for result in results),
+            key=lambda entry: name_order(entry[1].name, entry[0], name_key),
+        )
+        return {
+            uuid_: User(**user.dict(exclude={'name'}, exclude_unset=True)) if projected else user
+            for uuid_, user in itertools.islice(merged, limit)
+        }
+
+    def create_user(self, item, uuid_=None):
+        if uuid_ is None:
+            uuid_ = self.__new_uuid()
+        return self.__for_user(uuid_).create_user(item, uuid_)
+
+    def read_user(self, uuid_, fields=None, with_version=False):
+        return self.__for_user(uuid_).read_user(uuid_, fields, with_version)
+
+    def lookup_users(self, uuids, fields=None):
+        # Each shard is only asked for the users it owns.
+        by_shard = [[] for _ in self.sessions]
+        for uuid_ in uuids:
+            by_shard[self.shard_map.index_for(uuid_)].append(uuid_)
+        found = {}
+        for result in executor.map(
+                lambda session, keys: session.lookup_users(keys, fields),
+                self.sessions,
+                by_shard,
+        ):
+            found.update(result)
+        return found
+
+    def replace_user(self, uuid_, item, action='replace', version=None):
+        return self.__for_user(uuid_).replace_user(uuid_, item, action, version)
+
+    def alter_user(self, uuid_, item, version=None):
+        return self.__for_user(uuid_).alter_user(uuid_, item, version)
+
+    def remove_user(self, uuid_, chunk_size: int = 1000, pause: float = 0.0, on_chunk=None):
+        self.__for_user(uuid_).remove_user(uuid_, chunk_size, pause, on_chunk)
+
+    def remove_all_users(self, chunk_size: int = 1000, pause: float = 0.0, on_chunk=None):
+        self.__on_all(lambda session: session.remove_all_users(chunk_size, pause, on_chunk))
+
+    def export_users(self, batch_size: int = 1000):
+        for session in self.sessions:
+            yield from session.export_users(batch_size)
+
+    def import_users(self, items, batch_size: int = 5000):
+        return self.__import(
+            items,
+            lambda uuid_, item: self.shard_map.index_for(uuid_),
+            lambda session, batch: session.import_users(batch, batch_size),
+            batch_size,
+        )
+
+    def __for_user(self, user_uuid):
+        return self.sessions[self.shard_map.index_for(user_uuid)]
+
+    def __task_index(self, uuid_, item):
+        # Tasks live with their user; orphan tasks are placed by their own key.
+        return self.shard_map.index_for(item.user_uuid or uuid_)
+
+    def __for_task(self, uuid_, item):
+        return self.sessions[self.__task_index(uuid_, item)]
+
+    def __task_owner(self, uuid_):
+        # Task keys do not tell which shard holds them: ask every shard.
+        found = self.__on_all(lambda session: self.__has_task(session, uuid_))
+        for session, exists in zip(self.sessions, found):
+            if exists:
+                return session
+        raise KeyError()
+
+    @staticmethod
+    def __has_task(session, uuid_):
+        try:
+            session.read_task(uuid_, fields=())
+        except KeyError:
+            return False
+        return True
+
+    def __on_all(self, call):
+        # Shards are queried in parallel; the slowest one sets the latency.
+        return list(executor.map(call, self.sessions))
+
+    def __merge(self, call):
+        merged = {}
+        for result in self.__on_all(call):
+            merged.update(result)
+        return merged
+
+    def __first(self, call):
+        def attempt(session):
+            try:
+                return True, call(session)
+            except KeyError:
+                return False, None
+
+        for found, result in self.__on_all(attempt):
+            if found:
+                return result
+        raise KeyError()
+
+    def __import(self, items, index_for, load, batch_size):
+        # Rows are routed to per-shard buffers and loaded a batch at a time.
+        # Failures are reported by the row's position in the whole import.
+        buffers = [[] for _ in self.sessions]
+        positions = [[] for _ in self.sessions]
+        imported = 0
+
+        def flush(index):
+            nonlocal imported
+            try:
+                imported += load(self.sessions[index], buffers[index])
+            except ImportFailed as exception:
+                row = None if exception.row is None else positions[index][exception.row - 1]
+                raise ImportFailed(exception.reason, row, imported + exception.imported) from exception
+            buffers[index], positions[index] = [], []
+
+        row = 0
+        try:
+            for row, (uuid_, item) in enumerate(items, 1):
+                index = index_for(uuid_, item)
+                buffers[index].append((uuid_, item))
+                positions[index].append(row)
+                if len(buffers[index]) >= batch_size:
+                    flush(index)
+        except ImportFailed:
+            raise
+        except ValueError as exception:
+            raise ImportFailed(exception, row + 1, imported) from exception
+
+        for index, buffer in enumerate(buffers):
+            if buffer:
+                flush(index)
+        return imported
@@ -0,0 +1,88 @@
+# pylint: disable=missing-module-docstring, missing-function-docstring, missing-class-docstring
+import json
+import threading
+
+from functools import lru_cache
+
+from fastapi import Depends
+
+from utils.utils import get_config_filename
+
+
+class Flight:
+    def __init__(self, kind: str, uuid_):
+        self.kind = kind
+        self.uuid = uuid_
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+# Concurrent identical reads share one query: the first caller runs it and
+# the others, arriving while it is in flight, wait for its result. Nothing is
+# cached once the query returns. A committed write detaches the in-flight
+# reads it may have changed, so callers arriving after the write start a
+# fresh query instead of joining one that began before it.
+class SingleFlight:
+    def __init__(self):
+        self.executed = 0
+        self.shared = 0
+        self.__flights = {}
+        self.__lock = threading.Lock()
+
+    def stats(self):
+        return {'executed': self.executed, 'shared': self.shared}
+
+    def do(self, key, kind: str, uuid_, call, timeout=None, retry=None):
+        # `uuid_` is the row a point read is about, None for reads that span
+        # the table. A caller that joins waits at most `timeout` seconds, and
+        # when the first caller fails with an error `retry` accepts (one that
+        # belongs to the first caller, such as its deadline running out), it
+        # runs `call` itself: either way it is bound by its own limits rather
+        # than by those of the caller it joined.
+        with self.__lock:
+            flight = self.__flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.__flights[key] = Flight(kind, uuid_)
+                self.executed += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            if not flight.done.wait(timeout):
+                return call()
+            if flight.error is not None:
+                if retry is not None and retry(flight.error):
+                    return call()
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = call()
+            return flight.result
+        except Exception as exception:
+            flight.error = exception
+            raise
+        finally:
+            with self.__lock:
+                if self.__flights.get(key) is flight:
+                    del self.__flights[key]
+            flight.done.set()
+
+    def invalidate(self, kind: str, uuid_=None):
+        # A write to one row detaches reads of that row and of the whole
+        # table; a table-wide write detaches every read of the table.
+        with self.__lock:
+            for key, flight in list(self.__flights.items()):
+                if flight.kind == kind and (uuid_ is None or flight.uuid in (None, uuid_)):
+                    del self.__flights[key]
+
+
+@lru_cache
+def get_single_flight(config_file_name: str = Depends(get_config_filename)):
+    with open(config_file_name, 'r') as file:
+        config = json.load(file)
+    if not config.get('single_flight', False):
+        return None
+    return SingleFlight()
@@ -0,0 +1,122 @@
+# pylint: disable=missing-module-docstring, missing-function-docstring, missing-class-docstring
+import json
+import logging
+import threading
+import time
+
+from fastapi import FastAPI
+
+from utils.utils import get_app_secrets_filename, get_config_filename
+
+from .admission import get_admission
+from .database import (
+    get_backend,
+    get_coalescer,
+    get_replica_pool,
+    get_shard_map,
+    get_uuid_generator,
+    get_write_behind,
+)
+from .deadlines import get_deadlines
+from .jobs import get_jobs
+from .profiler import get_profiler
+from .singleflight import get_single_flight
+
+logger = logging.getLogger(__name__)
+
+
+class Readiness:
+    def __init__(self):
+        self.__ready = threading.Event()
+
+    @property
+    def ready(self):
+        return self.__ready.is_set()
+
+    def set_ready(self):
+        self.__ready.set()
+
+
+readiness = Readiness()
+
+
+def get_readiness():
+    return readiness
+
+
+def resolve(app: FastAPI, dependency):
+    # Honours dependency_overrides, so tests warm up the test database.
+    return app.dependency_overrides.get(dependency, dependency)()
+
+
+def warm_up(app: FastAPI):
+    config_file_name = resolve(app, get_config_filename)
+    secrets_file_name = resolve(app, get_app_secrets_filename)
+    with open(config_file_name, 'r') as file:
+        config = json.load(file)
+
+    # Dependencies are lru_cached by keyword arguments, exactly as FastAPI
+    # calls them, so these calls fill the caches requests will hit.
+    backend = get_backend(
+        config_file_name=config_file_name,
+        secrets_file_name=secrets_file_name,
+    )
+    get_replica_pool(config_file_name=config_file_name)
+    get_coalescer(config_file_name=config_file_name, backend=backend)
+    get_uuid_generator(config_file_name=config_file_name)
+    get_admission(config_file_name=config_file_name)
+    get_deadlines(config_file_name=config_file_name)
+    get_jobs(config_file_name=config_file_name)
+    get_profiler(config_file_name=config_file_name)
+    get_single_flight(config_file_name=config_file_name)
+    # Replays the writes a crash kept from the database and loads the cache.
+    get_write_behind(config_file_name=config_file_name, backend=backend)
+    shard_map = get_shard_map(
+        config_file_name=config_file_name,
+        secrets_file_name=secrets_file_name,
+    )
+
+    backends = [backend] if shard_map is None else [shard.backend for shard in shard_map.shards]
+    for shard_backend in backends:
+        if shard_backend.pool is not None:
+            shard_backend.pool.fill()
+
+        connection = shard_backend.connect()
+        try:
+            with connection.cursor() as cursor:
+                for query in config.get('warmup_queries', []):
+                    cursor.execute(query)
+                    cursor.fetchall()
+        finally:
+            connection.close()
+
+
+def stop_write_behind(app: FastAPI):
+    # Flushes what is pending, so a clean shutdown leaves nothing to replay.
+    if not readiness.ready:
+        return
+    config_file_name = resolve(app, get_config_filename)
+    backend = get_backend(
+        config_file_name=config_file_name,
+        secrets_file_name=resolve(app, get_app_secrets_filename),
+    )
+    cache = get_write_behind(config_file_name=config_file_name, backend=backend)
+    if cache is not None:
+        cache.stop()
+
+
+def start_warm_up(app: FastAPI, retry_seconds: float = 5.0):
+    def run():
+        while True:
+            try:
+                started = time.monotonic()
+                warm_up(app)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception('Warm-up failed, retrying in %ss', retry_seconds)
+                time.sleep(retry_seconds)
+            else:
+                logger.info('Warm-up finished in %.3fs', time.monotonic() - started)
+                readiness.set_ready()
+                return
+
+    threading.Thread(target=run, name='warm-up', daemon=True).start()
@@ -0,0 +1,219 @@
+# pylint: disable=missing-module-docstring, missing-function-docstring, missing-class-docstring
+import contextlib
+import json
+import logging
+import os
+import threading
+
+from fastapi.encoders import jsonable_encoder
+
+from .models import Task, User
+
+logger = logging.getLogger(__name__)
+
+MODELS = {'tasks': Task, 'users': User}
+
+
+class WriteBehindFull(Exception):
+    pass
+
+
+# Acknowledged writes that may not be in the database yet, one JSON line
+# each. Every flush starts a new segment file and the older ones are deleted
+# once their writes are committed, so the segments found on start-up hold
+# exactly the writes a crash kept from the database.
+class WriteLog:
+    def __init__(self, directory: str, fsync: bool = True):
+        self.directory = directory
+        self.fsync = fsync
+        os.makedirs(directory, exist_ok=True)
+        self.__segment = max(self.segments(), default=0) + 1
+        self.__file = open(self.__path(self.__segment), 'a', encoding='utf-8')
+
+    def segments(self):
+        return sorted(
+            int(filename[:-len('.log')]) for filename in os.listdir(self.directory)
+            if filename.endswith('.log')
+        )
+
+    def append(self, entry: dict):
+        self.__file.write(json.dumps(entry) + '\n')
+        self.__file.flush()
+        if self.fsync:
+            os.fsync(self.__file.fileno())
+
+    def rotate(self):
+        closed = self.__segment
+        self.__file.close()
+        self.__segment += 1
+        self.__file = open(self.__path(self.__segment), 'a', encoding='utf-8')
+        return closed
+
+    def read(self, last: int):
+        for segment in self.segments():
+            if segment > last:
+                return
+            with open(self.__path(segment), 'r', encoding='utf-8') as file:
+                for line in file:
+                    # A crash mid-append leaves a torn last line, which was
+                    # never acknowledged.
+                    if line.endswith('\n'):
+                        yield json.loads(line)
+
+    def delete(self, last: int):
+        for segment in self.segments():
+            if segment <= last:
+                os.remove(self.__path(segment))
+
+    def close(self):
+        self.__file.close()
+
+    def __path(self, segment):
+        return os.path.join(self.directory, f'{segment:012d}.log')
+
+
+# Tasks and users are served from memory. A write is acknowledged once it is
+# in memory and in the local log; a background thread flushes the latest
+# version of every changed row to the database every `flush_interval`
+# seconds, `max_batch` rows per transaction. When more than `max_pending`
+# rows are waiting, writers wait up to `backpressure_timeout` seconds for a
+# flush and then fail with WriteBehindFull.
+class WriteBehindCache:
+    def __init__(
+            self,
+            log: WriteLog,
+            load,
+            flush,
+            flush_interval: float = 0.5,
+            max_batch: int = 1000,
+            max_pending: int = 100000,
+            backpressure_timeout: float = 1.0,
+    ):
+        self.log = log
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self.backpressure_timeout = backpressure_timeout
+        self.tasks = {}
+        self.users = {}
+        self.lock = threading.RLock()
+        self.flushed = 0
+        self.failed_flushes = 0
+        self.__load = load
+        self.__flush = flush
+        self.__pending = {}
+        self.__in_flight = {}
+        self.__space = threading.Condition(self.lock)
+        self.__flush_lock = threading.Lock()
+        self.__stop = threading.Event()
+        self.__thread = None
+
+    @property
+    def pending(self):
+        return len(self.__pending) + len(self.__in_flight)
+
+    def stats(self):
+        return {
+            'pending': self.pending,
+            'flushed': self.flushed,
+            'failed_flushes': self.failed_flushes,
+        }
+
+    def start(self):
+        # Writes a crash kept from the database go there before the cache is
+        # loaded from it.
+        last = self.log.rotate()
+        replayed = {}
+        for entry in self.log.read(last):
+            item = entry['item']
+            replayed[entry['table'], entry['uuid']] = (
+                None if item is None else MODELS[entry['table']](**item),
+                entry['version'],
+            )
+        self.__write_batches(replayed)
+        self.log.delete(last)
+        if replayed:
+            logger.info('Replayed %d unflushed writes', len(replayed))
+
+        self.tasks, self.users = self.__load()
+        self.__thread = threading.Thread(target=self.__run, name='write-behind', daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        self.__stop.set()
+        if self.__thread is not None:
+            self.__thread.join()
+        self.flush()
+        self.log.close()
+
+    @contextlib.contextmanager
+    def writing(self):
+        # Checks and writes made in the block are atomic; entering it waits
+        # for room in the pending set.
+        with self.lock:
+            if not self.__space.wait_for(
+                    lambda: self.pending < self.max_pending,
+                    self.backpressure_timeout,
+            ):
+                raise WriteBehindFull(f'{self.pending} writes waiting for the database')
+            yield
+
+    def write(self, table: str, uuid_: str, item, version: int):
+        # Called inside writing(); a None item deletes the row.
+        self.log.append({
+            'table': table,
+            'uuid': uuid_,
+            'item': None if item is None else jsonable_encoder(item),
+            'version': version,
+        })
+        rows = getattr(self, table)
+        if item is None:
+            rows.pop(uuid_, None)
+        else:
+            rows[uuid_] = (item, version)
+        self.__pending[table, uuid_] = (item, version)
+
+    def flush(self):
+        with self.__flush_lock:
+            with self.lock:
+                if not self.__pending:
+                    return 0
+                batch, self.__pending = self.__pending, {}
+                self.__in_flight = batch
+                last = self.log.rotate()
+
+            try:
+                self.__write_batches(batch)
+            except Exception:
+                with self.lock:
+                    # Rows written again since the batch was taken are newer.
+                    self.__pending = {**batch, **self.__pending}
+                    self.__in_flight = {}
+                    self.failed_flushes += 1
+                raise
+
+            with self.lock:
+                self.__in_flight = {}
+                self.flushed += len(batch)
+                self.__space.notify_all()
+            self.log.delete(last)
+            return len(batch)
+
+    def __write_batches(self, rows):
+        # Rows are written in the order foreign keys need across all the
+        # batches, not just within one: user upserts, then task writes, then
+        # user deletes.
+        rows = sorted(
+            ((table, uuid_, item, version) for (table, uuid_), (item, version) in rows.items()),
+            key=lambda row: 1 if row[0] == 'tasks' else 0 if row[2] is not None else 2,
+        )
+        for start in range(0, len(rows), self.max_batch):
+            self.__flush(rows[start:start + self.max_batch])
+
+    def __run(self):
+        while not self.__stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:  # pylint: disable=broad-except
+                # The rows stay pending and the next flush retries them.
+                logger.exception('Write-behind flush failed, %d writes pending', self.pending)
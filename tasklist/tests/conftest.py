@@ -0,0 +1,40 @@
+# pylint: disable=missing-module-docstring,missing-function-docstring
+import json
+import os.path
+import shutil
+
+import pytest
+
+from utils import utils
+
+from tasklist.main import app
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(__file__), '..', 'database', 'migrations')
+
+
+@pytest.fixture
+def app_config(tmp_path):
+    # Writes a config file (SQLite unless `config` says otherwise, or a copy
+    # of `copy_of`), migrates its database and points the app at it. Each
+    # config needs a directory of its own, since dependencies are cached per
+    # config file name. The app's previous config is restored afterwards.
+    previous = app.dependency_overrides.get(utils.get_config_filename)
+
+    def use(config: dict = None, copy_of: str = None, directory=None):
+        directory = tmp_path if directory is None else directory
+        directory.mkdir(parents=True, exist_ok=True)
+        config_file_name = str(directory / 'config.json')
+        if copy_of is not None:
+            shutil.copy(copy_of, config_file_name)
+        else:
+            with open(config_file_name, 'w') as file:
+                json.dump({'backend': 'sqlite', 'database': 'tasklist.sqlite3', **(config or {})}, file)
+        utils.run_all_scripts(SCRIPTS_DIR, config_file_name, utils.get_admin_secrets_filename())
+        app.dependency_overrides[utils.get_config_filename] = lambda: config_file_name
+        return config_file_name
+
+    yield use
+    if previous is None:
+        app.dependency_overrides.pop(utils.get_config_filename, None)
+    else:
+        app.dependency_overrides[utils.get_config_filename] = previous
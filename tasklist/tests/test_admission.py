@@ -0,0 +1,90 @@
+# pylint: disable=missing-module-docstring,missing-function-docstring
+import asyncio
+
+import pytest
+
+from fastapi.testclient import TestClient
+
+from tasklist.admission import Limiter
+from tasklist.main import app
+
+client = TestClient(app)
+
+
+def test_limiter_queues_then_rejects():
+    async def scenario():
+        limiter = Limiter(concurrency=1, queue=1, timeout=1.0)
+        assert await limiter.acquire()
+
+        queued = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        assert limiter.waiting == 1
+        assert not await limiter.acquire()
+
+        limiter.release()
+        assert await queued
+        assert limiter.stats() == {
+            'concurrency': 1,
+            'active': 1,
+            'waiting': 0,
+            'admitted': 2,
+            'rejected': 1,
+        }
+
+    asyncio.run(scenario())
+
+
+def test_limiter_rejects_after_queue_timeout():
+    async def scenario():
+        limiter = Limiter(concurrency=1, queue=1, timeout=0.01)
+        assert await limiter.acquire()
+        assert not await limiter.acquire()
+        assert limiter.waiting == 0
+
+        limiter.release()
+        assert limiter.active == 0
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiters_give_their_slot_back():
+    async def scenario(handed):
+        limiter = Limiter(concurrency=1, queue=2, timeout=1.0)
+        assert await limiter.acquire()
+        queued = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        queued.cancel()
+        if handed:
+            # The slot is handed over before the cancellation is seen.
+            limiter.release()
+        with pytest.raises(asyncio.CancelledError):
+            await queued
+        assert limiter.waiting == 0
+        if not handed:
+            limiter.release()
+        assert limiter.active == 0
+        assert await limiter.acquire()
+
+    asyncio.run(scenario(handed=False))
+    asyncio.run(scenario(handed=True))
+
+
+def test_overloaded_route_fails_fast(app_config):
+    app_config({
+        'admission': {
+            'default': {'concurrency': 4, 'queue': 4},
+            'routes': {'GET /task': {'concurrency': 0}},
+            'retry_after': 2,
+        },
+    })
+    response = client.get('/task')
+    assert response.status_code == 503
+    assert response.headers['retry-after'] == '2'
+
+    response = client.get('/user')
+    assert response.status_code == 200
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.json()['admission']['GET /task']['rejected'] == 1
+    assert response.json()['admission']['GET /user']['admitted'] == 1
@@ -1,17 +1,27 @@
 # pylint: disable=missing-module-docstring,missing-function-docstring
+import datetime
+import json
 import os.path
+import time
+import uuid
 
 from fastapi.testclient import TestClient
 
 from utils import utils
 
+from tasklist.database import get_sync_settings
+from tasklist.deadlines import Deadlines, get_deadlines
+from tasklist.feed import feed
 from tasklist.main import app
+from tasklist.routers import sync_cursor
 
 client = TestClient(app)
 
 app.dependency_overrides[utils.get_config_filename] = \
     utils.get_config_test_filename
 
+TASK_DEFAULTS = {'priority': 0, 'due_date': None}
+
 
 def setup_database():
     scripts_dir = os.path.join(
@@ -24,6 +34,16 @@ def setup_database():
     secrets_file_name = utils.get_admin_secrets_filename()
     utils.run_all_scripts(scripts_dir, config_file_name, secrets_file_name)
 
+def wait_for_job(response):
+    assert response.status_code == 202
+    for _ in range(100):
+        job = client.get(response.headers['location']).json()
+        if job['status'] != 'running':
+            return job
+        time.sleep(0.05)
+    raise AssertionError('Job did not finish')
+
+
 def setup_user():
     user = { "name": "Gabriel Zanetti" }
     response = client.post("/user", json=user)
@@ -114,7 +134,7 @@ def test_create_and_read_some_tasks():
     # Read the complete list of tasks.
     def get_expected_responses_with_uuid(completed=None):
         return {
-            uuid_: response
+            uuid_: {**response, **TASK_DEFAULTS}
             for uuid_, response in zip(uuids, expected_responses)
             if completed is None or response['completed'] == completed
         }
@@ -161,7 +181,7 @@ def test_substitute_task():
     # Check whether the task was replaced.
     response = client.get(f'/task/{uuid_}')
     assert response.status_code == 200
-    assert response.json() == new_task
+    assert response.json() == {**new_task, **TASK_DEFAULTS}
 
     # Delete the task.
     response = client.delete(f'/task/{uuid_}')
@@ -189,7 +209,7 @@ def test_alter_task():
     # Check whether the task was altered.
     response = client.get(f'/task/{uuid_}')
     assert response.status_code == 200
-    assert response.json() == {**task, **new_task_partial}
+    assert response.json() == {**task, **new_task_partial, **TASK_DEFAULTS}
 
     # Delete the task.
     response = client.delete(f'/task/{uuid_}')
@@ -240,11 +260,11 @@ def test_delete_all_tasks():
     # Check whether the task was inserted.
     response = client.get('/task')
     assert response.status_code == 200
-    assert response.json() == {uuid_: task}
+    assert response.json() == {uuid_: {**task, **TASK_DEFAULTS}}
 
     # Delete all tasks.
     response = client.delete('/task')
-    assert response.status_code == 200
+    assert wait_for_job(response)['status'] == 'done'
 
     # Check whether all tasks have been removed.
     response = client.get('/task')
@@ -252,6 +272,196 @@ def test_delete_all_tasks():
     assert response.json() == {}
 
 
+def test_read_tasks_sorted_and_limited():
+    setup_database()
+    user_uuid = setup_user()
+    other_uuid = setup_user()
+
+    tasks = [
+        {'description': 'a', 'user_uuid': user_uuid, 'priority': 1, 'due_date': '2023-03-01'},
+        {'description': 'b', 'user_uuid': user_uuid, 'priority': 3, 'due_date': '2023-01-01'},
+        {'description': 'c', 'user_uuid': user_uuid, 'priority': 2, 'due_date': '2023-02-01'},
+        {'description': 'd', 'user_uuid': user_uuid, 'completed': True, 'due_date': '2022-01-01'},
+        {'description': 'e', 'user_uuid': other_uuid, 'due_date': '2022-06-01'},
+    ]
+    for task in tasks:
+        response = client.post('/task', json=task)
+        assert response.status_code == 200
+
+    def descriptions(query):
+        response = client.get(f'/task?{query}&fields=description')
+        assert response.status_code == 200
+        return [task['description'] for task in response.json().values()]
+
+    assert descriptions(f'user_uuid={user_uuid}&completed=false&sort=due_date') == ['b', 'c', 'a']
+    assert descriptions(f'user_uuid={user_uuid}&completed=false&sort=-priority&limit=2') == ['b', 'c']
+    assert descriptions('completed=false&sort=due_date&limit=2') == ['e', 'b']
+    assert descriptions(f'user_uuid={other_uuid}') == ['e']
+
+    response = client.get('/task?sort=description')
+    assert response.status_code == 422
+    response = client.get('/task?limit=0')
+    assert response.status_code == 422
+
+
+def test_archive_completed_tasks():
+    setup_database()
+    user_uuid = setup_user()
+    done = client.post('/task', json={'description': 'a', 'completed': True, 'user_uuid': user_uuid}).json()
+    client.post('/task', json={'description': 'b', 'user_uuid': user_uuid})
+
+    response = client.post('/task/archive?after_days=30')
+    job = wait_for_job(response)
+    assert (job['kind'], job['status'], job['deleted']) == ('archive_tasks', 'done', 0)
+    response = client.post('/task/archive?after_days=0.00000001')
+    assert wait_for_job(response)['deleted'] == 1
+
+    assert client.get(f'/task/{done}').status_code == 404
+    assert [task['description'] for task in client.get('/task').json().values()] == ['b']
+    response = client.get('/task?completed=true&include_archived=true')
+    assert response.json() == {done: {'description': 'a', 'completed': True, 'user_uuid': user_uuid, **TASK_DEFAULTS}}
+    response = client.get('/task/export')
+    assert len(response.text.splitlines()) == 2
+
+
+def test_sync_task_changes():
+    setup_database()
+    user_uuid = setup_user()
+    app.dependency_overrides[get_sync_settings] = lambda: {'settle_seconds': 0.0, 'tombstone_days': 30}
+    try:
+        kept = client.post('/task', json={'description': 'kept', 'user_uuid': user_uuid}).json()
+        removed = client.post('/task', json={'description': 'removed', 'user_uuid': user_uuid}).json()
+        response = client.get(f'/task?updated_since=0&user_uuid={user_uuid}&fields=description')
+        assert response.status_code == 200
+        body = response.json()
+        assert body['tasks'] == {kept: {'description': 'kept'}, removed: {'description': 'removed'}}
+        assert body['deleted'] == []
+
+        time.sleep(0.01)
+        client.patch(f'/task/{kept}', json={'completed': True})
+        client.delete(f'/task/{removed}')
+        added = client.post('/task', json={'description': 'added', 'user_uuid': user_uuid}).json()
+        body = client.get(f'/task?updated_since={body["cursor"]}&fields=completed').json()
+        assert body['tasks'] == {kept: {'completed': True}, added: {'completed': False}}
+        assert body['deleted'] == [removed]
+
+        time.sleep(0.01)
+        assert client.get(f'/task?updated_since={body["cursor"]}').json()['tasks'] == {}
+    finally:
+        del app.dependency_overrides[get_sync_settings]
+
+    expired = sync_cursor(datetime.datetime(2000, 1, 1))
+    assert client.get(f'/task?updated_since={expired}').status_code == 410
+    assert client.get('/task?updated_since=nonsense').status_code == 422
+    assert client.get('/task?updated_since=0&sort=priority').status_code == 422
+
+
+def test_batch_runs_operations_in_one_transaction():
+    setup_database()
+    response = client.post('/batch', json={'operations': [
+        {'op': 'create', 'kind': 'user', 'item': {'name': 'Ana'}},
+        {'op': 'create', 'kind': 'task', 'item': {'description': 'a', 'user_uuid': '$0'}},
+        {'op': 'create', 'kind': 'task', 'item': {'description': 'b', 'user_uuid': '$0'}},
+        {'op': 'patch', 'kind': 'task', 'uuid': '$1', 'item': {'completed': True}},
+        {'op': 'patch', 'kind': 'task', 'uuid': '$2', 'item': {'completed': True}, 'version': 7},
+        {'op': 'read', 'kind': 'task', 'uuid': '$1'},
+    ]})
+    assert response.status_code == 200
+    body = response.json()
+    assert body['committed']
+    assert [result['status'] for result in body['results']] == [200, 200, 200, 200, 412, 200]
+    user_uuid, done = body['results'][0]['uuid'], body['results'][1]['uuid']
+    assert body['results'][3]['version'] == 2
+    assert body['results'][5] == {
+        'status': 200,
+        'uuid': done,
+        'version': 2,
+        'item': {'description': 'a', 'completed': True, 'user_uuid': user_uuid, **TASK_DEFAULTS},
+    }
+    tasks = client.get(f'/task?user_uuid={user_uuid}&fields=completed').json()
+    assert sorted(task['completed'] for task in tasks.values()) == [False, True]
+
+    # An atomic batch that fails leaves nothing behind.
+    response = client.post('/batch', json={'atomic': True, 'operations': [
+        {'op': 'create', 'kind': 'task', 'item': {'description': 'c', 'user_uuid': user_uuid}},
+        {'op': 'delete', 'kind': 'task', 'uuid': done},
+        {'op': 'delete', 'kind': 'task', 'uuid': done},
+        {'op': 'create', 'kind': 'task', 'item': {'description': 'd'}},
+    ]})
+    body = response.json()
+    assert not body['committed']
+    assert [result['status'] for result in body['results']] == [200, 200, 404, 424]
+    assert len(client.get(f'/task?user_uuid={user_uuid}').json()) == 2
+    assert client.get(f'/task/{done}').status_code == 200
+
+    response = client.post('/batch', json={'operations': [
+        {'op': 'create', 'kind': 'task', 'item': {'priority': 1000}},
+        {'op': 'patch', 'kind': 'task', 'uuid': '$0', 'item': {'completed': True}},
+    ]})
+    assert [result['status'] for result in response.json()['results']] == [422, 424]
+
+
+def test_batch_reports_database_errors_per_operation():
+    setup_database()
+    user_uuid = client.post('/user', json={'name': 'Ana'}).json()
+    response = client.post('/batch', json={'operations': [
+        {'op': 'create', 'kind': 'task', 'item': {'description': 'a', 'user_uuid': user_uuid}},
+        {'op': 'create', 'kind': 'task', 'item': {'description': 'b', 'user_uuid': str(uuid.uuid4())}},
+        {'op': 'create', 'kind': 'task', 'item': {'description': 'c', 'user_uuid': user_uuid}},
+    ]})
+    assert response.status_code == 200
+    body = response.json()
+    assert body['committed']
+    assert [result['status'] for result in body['results']] == [200, 409, 200]
+    tasks = client.get(f'/task?user_uuid={user_uuid}&fields=description').json()
+    assert sorted(task['description'] for task in tasks.values()) == ['a', 'c']
+
+
+def test_requests_out_of_time_get_504():
+    setup_database()
+    deadlines = Deadlines({'routes': {'GET /task': 0.0}})
+    app.dependency_overrides[get_deadlines] = lambda: deadlines
+    try:
+        response = client.get('/task')
+        assert response.status_code == 504
+        assert client.get('/user').status_code == 200
+        metrics = client.get('/metrics').json()
+        assert metrics['deadlines'] == {'GET /task': {'deadline': 0.0, 'timeouts': 1}}
+    finally:
+        del app.dependency_overrides[get_deadlines]
+
+
+def test_read_nonexistant_job():
+    response = client.get('/job/3668e9c9-df18-4ce2-9bb2-82f907cf110c')
+    assert response.status_code == 404
+
+
+def test_conditional_task_writes():
+    setup_database()
+    user_uuid = setup_user()
+
+    task = {'description': 'foo', 'user_uuid': user_uuid}
+    uuid_ = client.post('/task', json=task).json()
+    response = client.get(f'/task/{uuid_}')
+    assert response.headers['etag'] == '"1"'
+
+    response = client.put(f'/task/{uuid_}', json=task, headers={'If-Match': '"1"'})
+    assert response.status_code == 200
+    assert response.headers['etag'] == '"2"'
+
+    # A writer still holding version 1 loses instead of overwriting.
+    response = client.patch(f'/task/{uuid_}', json={'completed': True}, headers={'If-Match': '"1"'})
+    assert response.status_code == 412
+    response = client.delete(f'/task/{uuid_}', headers={'If-Match': '"1"'})
+    assert response.status_code == 412
+
+    response = client.patch(f'/task/{uuid_}', json={'completed': True})
+    assert response.status_code == 200
+    assert response.headers['etag'] == '"3"'
+    response = client.delete(f'/task/{uuid_}', headers={'If-Match': '"3"'})
+    assert response.status_code == 200
+
+
 # TESTS USER
 
 
@@ -314,7 +524,7 @@ def test_create_and_read_some_users():
     # Delete all users.
     for uuid_ in uuids:
         response = client.delete(f'/user/{uuid_}')
-        assert response.status_code == 200
+        assert wait_for_job(response)['status'] == 'done'
 
     # Check whether there are no more users.
     response = client.get('/user')
@@ -343,7 +553,7 @@ def test_substitute_user():
 
     # Delete the user.
     response = client.delete(f'/user/{uuid_}')
-    assert response.status_code == 200
+    assert wait_for_job(response)['status'] == 'done'
 
 
 def test_alter_user():
@@ -367,7 +577,35 @@ def test_alter_user():
 
     # Delete the user.
     response = client.delete(f'/user/{uuid_}')
-    assert response.status_code == 200
+    assert wait_for_job(response)['status'] == 'done'
+
+
+def test_read_users_by_name_prefix():
+    setup_database()
+    names = ['ana', 'Anabela', 'ANA 100%', 'ana_', 'Bia', 'Ana']
+    uuids = {client.post('/user', json={'name': name}).json(): name for name in names}
+
+    def page(query):
+        response = client.get(f'/user?{query}')
+        assert response.status_code == 200
+        return [uuids[uuid_] for uuid_ in response.json()], response.headers.get('x-next-cursor')
+
+    found, _ = page('name_prefix=aNa')
+    assert sorted(found, key=str.lower) == found and set(found) == set(names) - {'Bia'}
+    assert page('name_prefix=ana 100%')[0] == ['ANA 100%']
+    assert page('name_prefix=ana_')[0] == ['ana_']
+
+    seen = []
+    first, cursor = page('name_prefix=ana&limit=2&fields=')
+    seen += first
+    while cursor is not None:
+        found, cursor = page(f'name_prefix=ana&limit=2&after={cursor}')
+        seen += found
+    assert seen == page('name_prefix=ana')[0]
+    assert client.get('/user?name_prefix=ana&limit=2&fields=').json() == \
+        {uuid_: {} for uuid_ in list(client.get('/user?name_prefix=ana&limit=2').json())}
+
+    assert client.get('/user?after=nonsense').status_code == 422
 
 
 def test_read_invalid_user():
@@ -414,9 +652,248 @@ def test_delete_all_users():
 
     # Delete all users.
     response = client.delete('/user')
-    assert response.status_code == 200
+    assert wait_for_job(response)['status'] == 'done'
 
     # Check whether all users have been removed.
     response = client.get('/user')
     assert response.status_code == 200
-    assert response.json() == {}
\ No newline at end of file
+    assert response.json() == {}
+
+def test_conditional_user_writes():
+    setup_database()
+    user_uuid = setup_user()
+
+    response = client.patch(f'/user/{user_uuid}', json={'name': 'foo'}, headers={'If-Match': '"1"'})
+    assert response.status_code == 200
+    assert response.headers['etag'] == '"2"'
+    response = client.put(f'/user/{user_uuid}', json={'name': 'bar'}, headers={'If-Match': '"1"'})
+    assert response.status_code == 412
+    response = client.put(f'/user/{user_uuid}', json={'name': 'bar'}, headers={'If-Match': 'foo'})
+    assert response.status_code == 412
+    assert client.get(f'/user/{user_uuid}').json() == {'name': 'foo'}
+
+
+# TESTS FEED
+
+
+def test_task_changes_are_published_to_feed():
+    setup_database()
+    sequence = feed.sequence
+
+    user_uuid = setup_user()
+    task = {'description': 'foo', 'completed': False, 'user_uuid': user_uuid}
+    response = client.post('/task', json=task)
+    assert response.status_code == 200
+    uuid_ = response.json()
+
+    response = client.patch(f'/task/{uuid_}', json={'completed': True})
+    assert response.status_code == 200
+    response = client.delete(f'/task/{uuid_}')
+    assert response.status_code == 200
+
+    events = feed.since(sequence)
+    assert [(event['kind'], event['action']) for event in events] == [
+        ('user', 'create'),
+        ('task', 'create'),
+        ('task', 'patch'),
+        ('task', 'delete'),
+    ]
+    assert all(event['user_uuid'] == user_uuid for event in events)
+    assert events[2]['item'] == {**task, 'completed': True, **TASK_DEFAULTS}
+
+
+def test_feed_events_carry_canonical_user_uuids():
+    setup_database()
+    user_uuid = setup_user()
+    sequence = feed.sequence
+    response = client.post('/task', json={'description': 'foo', 'user_uuid': user_uuid.upper()})
+    assert response.status_code == 200
+    assert [event['user_uuid'] for event in feed.since(sequence)] == [user_uuid]
+
+def test_failed_write_is_not_published_to_feed():
+    setup_database()
+    sequence = feed.sequence
+
+    response = client.delete('/task/3668e9c9-df18-4ce2-9bb2-82f907cf110c')
+    assert response.status_code == 404
+    assert feed.since(sequence) == []
+
+
+# TESTS FIELD PROJECTION
+
+
+def test_read_tasks_with_fields():
+    setup_database()
+    user_uuid = setup_user()
+
+    task = {'description': 'foo', 'completed': True, 'user_uuid': user_uuid}
+    response = client.post('/task', json=task)
+    assert response.status_code == 200
+    uuid_ = response.json()
+
+    response = client.get('/task?fields=completed')
+    assert response.status_code == 200
+    assert response.json() == {uuid_: {'completed': True}}
+
+    response = client.get('/task?completed=true&fields=completed,user_uuid')
+    assert response.status_code == 200
+    assert response.json() == {uuid_: {'completed': True, 'user_uuid': user_uuid}}
+
+    response = client.get(f'/task/{uuid_}?fields=description')
+    assert response.status_code == 200
+    assert response.json() == {'description': 'foo'}
+
+    response = client.get(f'/task/{uuid_}')
+    assert response.status_code == 200
+    assert response.json() == {**task, **TASK_DEFAULTS}
+
+
+def test_read_users_with_fields():
+    setup_database()
+    user_uuid = setup_user()
+
+    response = client.get('/user?fields=uuid')
+    assert response.status_code == 200
+    assert response.json() == {user_uuid: {}}
+
+    response = client.get(f'/user/{user_uuid}?fields=name')
+    assert response.status_code == 200
+    assert response.json() == {'name': 'Gabriel Zanetti'}
+
+
+def test_read_with_unknown_fields():
+    setup_database()
+
+    response = client.get('/task?fields=description,password')
+    assert response.status_code == 422
+
+    response = client.get('/user/3668e9c9-df18-4ce2-9bb2-82f907cf110c?fields=name;')
+    assert response.status_code == 422
+
+
+# TESTS LOOKUP
+
+
+def test_lookup_tasks():
+    setup_database()
+    user_uuid = setup_user()
+
+    uuids = []
+    for description in ('foo', 'bar'):
+        response = client.post('/task', json={'description': description, 'user_uuid': user_uuid})
+        assert response.status_code == 200
+        uuids.append(response.json())
+    missing = '3668e9c9-df18-4ce2-9bb2-82f907cf110c'
+
+    response = client.post(
+        '/task/lookup?fields=description',
+        json={'uuids': [uuids[1], missing, uuids[0], uuids[1]]},
+    )
+    assert response.status_code == 200
+    assert response.json() == {
+        'found': {uuids[1]: {'description': 'bar'}, uuids[0]: {'description': 'foo'}},
+        'missing': [missing],
+    }
+
+
+def test_lookup_users():
+    setup_database()
+    user_uuid = setup_user()
+
+    response = client.post('/user/lookup', json={'uuids': [user_uuid]})
+    assert response.status_code == 200
+    assert response.json() == {'found': {user_uuid: {'name': 'Gabriel Zanetti'}}, 'missing': []}
+
+    response = client.post('/user/lookup', json={'uuids': ['invalid_uuid']})
+    assert response.status_code == 422
+
+
+# TESTS EXPORT AND IMPORT
+
+
+def test_export_and_import_round_trip():
+    setup_database()
+    user_uuid = setup_user()
+    tasks = [
+        {'description': 'foo', 'completed': False, 'user_uuid': user_uuid},
+        {'description': 'bar, "quoted"\nmultiline', 'completed': True, 'user_uuid': None},
+    ]
+    for task in tasks:
+        response = client.post('/task', json=task)
+        assert response.status_code == 200
+
+    expected_users = client.get('/user').json()
+    expected_tasks = client.get('/task').json()
+
+    for format_, content_type in [('ndjson', 'application/x-ndjson'), ('csv', 'text/csv')]:
+        users = client.get(f'/user/export?format={format_}')
+        assert users.status_code == 200
+        assert users.headers['content-type'].startswith(content_type)
+        tasks_export = client.get(f'/task/export?format={format_}')
+        assert tasks_export.status_code == 200
+
+        setup_database()
+        response = client.post(
+            '/user/import',
+            content=users.content,
+            headers={'Content-Type': content_type},
+        )
+        assert response.status_code == 200
+        assert response.json() == {'imported': 1}
+        response = client.post(
+            '/task/import',
+            content=tasks_export.content,
+            headers={'Content-Type': content_type},
+        )
+        assert response.status_code == 200
+        assert response.json() == {'imported': 2}
+
+        assert client.get('/user').json() == expected_users
+        assert client.get('/task').json() == expected_tasks
+
+
+def test_import_invalid_rows():
+    setup_database()
+
+    response = client.post('/task/import', content=b'{"description": "no uuid"}\n')
+    assert response.status_code == 422
+
+    response = client.post('/task/import', content=b'not json\n')
+    assert response.status_code == 422
+
+    response = client.get('/task/export?format=xml')
+    assert response.status_code == 422
+
+
+def test_import_reports_the_failing_row():
+    setup_database()
+    users = [str(uuid.uuid4()) for _ in range(5001)] + [None]
+    users[-1] = users[1]
+    content = '\n'.join(json.dumps({'uuid': user, 'name': 'Ana'}) for user in users)
+    response = client.post('/user/import', content=content)
+    assert response.status_code == 422
+    detail = response.json()['detail']
+    assert detail.startswith('Row 5002: ') and detail.endswith('(5000 rows imported)')
+    assert len(client.get('/user').json()) == 5000
+
+    response = client.post('/task/import', content=b'{"uuid": "%s"}\nnot json\n' % users[0].encode())
+    assert response.status_code == 422
+    assert response.json()['detail'].startswith('Row 2: ')
+
+
+# TESTS READINESS
+
+
+def test_ready_after_warm_up():
+    setup_database()
+
+    with TestClient(app) as warm_client:
+        for _ in range(100):
+            response = warm_client.get('/ready')
+            if response.status_code == 200:
+                break
+            assert response.status_code == 503
+            time.sleep(0.05)
+
+        assert response.status_code == 200
+        assert response.json() == {'ready': True}
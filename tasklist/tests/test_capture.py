@@ -0,0 +1,93 @@
+# pylint: disable=missing-module-docstring,missing-function-docstring
+import gzip
+import json
+import threading
+import uuid
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from fastapi.testclient import TestClient
+
+from benchmarks.replay import Replayer, read_capture, summarize
+from tasklist.capture import get_recorder
+from tasklist.main import app
+
+client = TestClient(app)
+
+
+def test_requests_are_captured_sanitized(tmp_path, app_config):
+    config_file_name = app_config({'capture': {'path': 'capture.ndjson.gz'}})
+    user_uuid = client.post('/user', json={'name': 'Ana Maria'}).json()
+    task_uuid = client.post(
+        '/task',
+        json={'description': 'secret', 'user_uuid': user_uuid, 'due_date': '2024-05-01'},
+    ).json()
+    client.patch(f'/task/{task_uuid}', json={'completed': True}, headers={'If-Match': '"1"'})
+    client.get('/user?name_prefix=Ana&limit=10')
+    client.get('/metrics')
+    get_recorder(config_file_name).close()
+
+    entries = read_capture([str(tmp_path / 'capture.ndjson.gz')])
+    assert [(entry['m'], entry['r'], entry['s']) for entry in entries] == [
+        ('POST', '/user', 200),
+        ('POST', '/task', 200),
+        ('PATCH', '/task/{uuid_}', 200),
+        ('GET', '/user', 200),
+    ]
+    assert entries[0]['b'] == {'name': 'xxxxxxxxx'} and entries[0]['c'] == user_uuid
+    assert entries[1]['b'] == {'description': 'xxxxxx', 'user_uuid': user_uuid, 'due_date': '2024-05-01'}
+    assert entries[2]['p'] == f'/task/{task_uuid}' and entries[2]['h'] == {'content-type': 'application/json', 'if-match': '"1"'}
+    assert entries[3]['q'] == 'name_prefix=xxx&limit=10'
+    assert all(entry['d'] > 0 for entry in entries)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    requests = []
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        self.rfile.read(int(self.headers['content-length']))
+        self.requests.append(('POST', self.path))
+        self.respond(json.dumps(str(uuid.uuid4())).encode())
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        self.requests.append(('GET', self.path))
+        self.respond(b'{}')
+
+    def respond(self, body):
+        self.send_response(200)
+        self.send_header('content-length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+def test_replay_maps_created_keys(tmp_path):
+    captured = str(uuid.uuid4())
+    entries = [
+        {'t': 100.0, 'm': 'POST', 'p': '/task', 'r': '/task', 's': 200, 'd': 0.01,
+         'b': {'description': 'xx'}, 'c': captured},
+        {'t': 100.01, 'm': 'GET', 'p': f'/task/{captured}', 'r': '/task/{uuid_}', 's': 200, 'd': 0.002},
+        {'t': 100.02, 'm': 'POST', 'p': '/task/import', 'r': '/task/import', 's': 200, 'd': 0.5, 'x': True},
+    ]
+    path = str(tmp_path / 'capture.ndjson.gz')
+    with gzip.open(path, 'wt') as file:
+        for entry in reversed(entries):
+            file.write(json.dumps(entry) + '\n')
+        file.write('{"t": 1')
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        replayer = Replayer(f'http://127.0.0.1:{server.server_port}', speed=10)
+        results = replayer.run(read_capture([path]))
+    finally:
+        server.shutdown()
+
+    (_, created), (_, read) = StubHandler.requests
+    assert created == '/task' and read.startswith('/task/') and read != f'/task/{captured}'
+    assert replayer.skipped == 1
+    stats = summarize(results, 'seconds')
+    assert sorted(stats) == ['GET /task/{uuid_}', 'POST /task']
+    assert stats['POST /task']['status_changed'] == 0
@@ -0,0 +1,420 @@
+# pylint: disable=missing-module-docstring,missing-function-docstring,missing-class-docstring
+import os.path
+import sqlite3
+import time
+import uuid
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import mysql.connector as conn
+import pytest
+
+from tasklist.backends import (
+    ConnectionPool, PoolTimeout, QueryTimeout, SQLiteConnection, VersionConflict, create_backend_from_config,
+    general_ci_key, is_timeout, nocase_key,
+)
+from tasklist.coalescer import WriteCoalescer, create_coalescer
+from tasklist.database import DBSession, ReplicaPool, from_bin, limit_select, to_bin, utc_now, uuid7
+from tasklist.models import Task, User
+
+SQLITE_MIGRATIONS_DIR = os.path.join(
+    os.path.dirname(__file__),
+    '..',
+    'database',
+    'migrations',
+    'sqlite',
+)
+
+
+class FakeConnection:
+    def __init__(self, host):
+        self.host = host
+
+    def is_connected(self):
+        return True
+
+    def cursor(self):
+        raise conn.OperationalError('replica lost')
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def fake_connect(down_hosts):
+    def connect(**kwargs):
+        if kwargs['host'] in down_hosts:
+            raise conn.InterfaceError('connection refused')
+        return FakeConnection(kwargs['host'])
+    return connect
+
+
+def test_replicas_are_used_round_robin():
+    pool = ReplicaPool(['r1', 'r2'], connect=fake_connect(set()))
+    hosts = [pool.connect({'host': 'primary'}).host for _ in range(4)]
+    assert hosts == ['r1', 'r2', 'r1', 'r2']
+
+
+def test_replica_down_fails_over_to_next_replica():
+    pool = ReplicaPool(['r1', 'r2'], connect=fake_connect({'r1'}))
+    assert pool.connect({'host': 'primary'}).host == 'r2'
+    assert not pool.is_healthy('r1')
+    assert pool.is_healthy('r2')
+
+
+def test_all_replicas_down_falls_back_to_primary():
+    pool = ReplicaPool(['r1', 'r2'], connect=fake_connect({'r1', 'r2'}))
+    assert pool.connect({'host': 'primary'}) is None
+
+
+def test_replica_is_retried_after_cooldown():
+    down_hosts = {'r1'}
+    pool = ReplicaPool(['r1'], retry_seconds=0, connect=fake_connect(down_hosts))
+    assert pool.connect({'host': 'primary'}) is None
+    down_hosts.clear()
+    assert pool.connect({'host': 'primary'}).host == 'r1'
+
+
+def test_replica_port_is_parsed():
+    ports = []
+
+    def connect(**kwargs):
+        ports.append(kwargs.get('port'))
+        return FakeConnection(kwargs['host'])
+
+    pool = ReplicaPool(['127.0.0.1:3307'], connect=connect)
+    assert pool.connect({'host': 'primary'}).host == '127.0.0.1'
+    assert ports == [3307]
+
+
+def test_replica_connections_are_pooled():
+    connected = []
+
+    def connect(**kwargs):
+        connected.append(kwargs['host'])
+        return FakeConnection(kwargs['host'])
+
+    pool = ReplicaPool(['r1'], pool_size=1, pool_timeout=0.01, connect=connect)
+    connection = pool.connect({'host': 'primary'})
+    # A busy replica is not a dead one.
+    assert pool.connect({'host': 'primary'}) is None
+    assert pool.is_healthy('r1')
+    connection.close()
+    assert pool.connect({'host': 'primary'}).host == 'r1'
+    assert connected == ['r1']
+
+
+def test_failed_replica_read_is_retried_on_the_primary(tmp_path):
+    path = str(tmp_path / 'tasks.sqlite3')
+    create_database(path).close()
+    DBSession(partial(SQLiteConnection, path)).create_user(User(name='foo'))
+    pool = ReplicaPool(['r1', 'r2'], connect=fake_connect(set()))
+    db = DBSession(partial(SQLiteConnection, path), read_connect=partial(pool.connect, {'host': 'primary'}))
+    assert list(db.read_users().values()) == [User(name='foo')]
+    assert not pool.is_healthy('r1')
+    # The session stays on the primary; other sessions skip the replica.
+    assert list(db.read_users().values()) == [User(name='foo')]
+    assert pool.is_healthy('r2')
+    db.close()
+
+def create_counter_table(path):
+    connection = SQLiteConnection(path)
+    with connection.cursor() as cursor:
+        cursor.execute('CREATE TABLE counters (id INTEGER PRIMARY KEY)')
+    connection.commit()
+    return connection
+
+
+def test_coalescer_commits_concurrent_writes(tmp_path):
+    path = str(tmp_path / 'coalescer.sqlite3')
+    connection = create_counter_table(path)
+    coalescer = WriteCoalescer(partial(SQLiteConnection, path), max_delay=0.01)
+
+    with ThreadPoolExecutor(16) as executor:
+        results = list(executor.map(
+            lambda id_: coalescer.execute('INSERT INTO counters VALUES (%s)', (id_, )),
+            range(200),
+        ))
+    assert results == [None] * 200
+
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT COUNT(*) FROM counters')
+        assert cursor.fetchone()[0] == 200
+
+
+def test_coalescer_fails_only_the_failing_write(tmp_path):
+    path = str(tmp_path / 'coalescer.sqlite3')
+    connection = create_counter_table(path)
+    coalescer = WriteCoalescer(partial(SQLiteConnection, path), max_delay=0.05)
+
+    futures = [
+        coalescer.submit('INSERT INTO counters VALUES (%s)', (id_, ))
+        for id_ in [1, 2, 1, 3]
+    ]
+    assert futures[0].result() is None
+    with pytest.raises(sqlite3.IntegrityError):
+        futures[2].result()
+    assert futures[3].result() is None
+
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT id FROM counters ORDER BY id')
+        assert cursor.fetchall() == [(1, ), (2, ), (3, )]
+
+
+def test_uuid7_is_time_ordered():
+    keys = []
+    for _ in range(5):
+        keys.append(uuid7())
+        time.sleep(0.002)
+
+    assert all(key.version == 7 for key in keys)
+    assert all(key.variant == uuid.RFC_4122 for key in keys)
+    assert sorted(keys, key=to_bin) == keys
+    assert [from_bin(to_bin(key)) for key in keys] == [str(key) for key in keys]
+
+
+class CountingConnection(FakeConnection):
+    opened = 0
+
+    def __init__(self):
+        super().__init__('localhost')
+        CountingConnection.opened += 1
+
+    def rollback(self):
+        pass
+
+
+def test_pool_reuses_connections():
+    CountingConnection.opened = 0
+    pool = ConnectionPool(CountingConnection, size=2)
+    pool.fill()
+    assert CountingConnection.opened == 2
+
+    for _ in range(10):
+        pool.acquire().close()
+    assert CountingConnection.opened == 2
+
+
+def test_pool_times_out_when_exhausted():
+    pool = ConnectionPool(CountingConnection, size=1, timeout=0.01)
+    connection = pool.acquire()
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+    connection.close()
+    pool.acquire().close()
+
+
+def create_database(path):
+    connection = sqlite3.connect(path)
+    for filename in sorted(os.listdir(SQLITE_MIGRATIONS_DIR)):
+        with open(os.path.join(SQLITE_MIGRATIONS_DIR, filename), 'r') as file:
+            connection.executescript(file.read())
+    return connection
+
+
+def test_group_commit_leaves_the_pool_to_requests(tmp_path):
+    path = str(tmp_path / 'tasks.sqlite3')
+    create_database(path).close()
+    config = {'backend': 'sqlite', 'database': 'tasks.sqlite3', 'pool_size': 1, 'pool_timeout': 0.1,
+              'group_commit': {'max_delay': 0.001}}
+    backend = create_backend_from_config(config, str(tmp_path / 'config.json'), None)
+    coalescer = create_coalescer(config, backend)
+    # Every request gets the pool's only connection, however many inserts
+    # went through the group-commit writer before it.
+    for count, name in enumerate('abc', 1):
+        db = DBSession(backend.connect, coalescer=coalescer)
+        db.create_user(User(name=name))
+        assert len(db.read_users()) == count
+        db.close()
+
+def test_sorted_task_reads_use_an_index(tmp_path):
+    connection = create_database(str(tmp_path / 'plan.sqlite3'))
+
+    for order in ('due_date, uuid', 'priority DESC, uuid DESC'):
+        plan = ' '.join(row[-1] for row in connection.execute(
+            f'EXPLAIN QUERY PLAN SELECT uuid FROM tasks '
+            f'WHERE user_uuid = ? AND completed = ? ORDER BY {order} LIMIT 20',
+            (to_bin(uuid.uuid4()), False),
+        ))
+        assert 'INDEX tasks_user_completed_' in plan
+        assert 'TEMP B-TREE' not in plan
+
+
+def test_user_name_prefix_reads_use_an_index(tmp_path):
+    connection = create_database(str(tmp_path / 'plan.sqlite3'))
+    plan = ' '.join(row[-1] for row in connection.execute(
+        "EXPLAIN QUERY PLAN SELECT uuid, name FROM users WHERE name LIKE ? ESCAPE '!' "
+        'AND (name > ? OR (name = ? AND uuid > ?)) ORDER BY name, uuid LIMIT 20',
+        ('ana%', 'Ana', 'Ana', to_bin(uuid.uuid4())),
+    ))
+    assert 'INDEX users_name (name>? AND name<?)' in plan
+    assert 'TEMP B-TREE' not in plan
+
+
+def test_remove_user_deletes_tasks_in_chunks(tmp_path):
+    path = str(tmp_path / 'tasks.sqlite3')
+    create_database(path).close()
+    db = DBSession(partial(SQLiteConnection, path))
+    user_uuid = db.create_user(User(name='foo'))
+    for index in range(5):
+        db.create_task(Task(description=str(index), user_uuid=str(user_uuid)))
+
+    chunks = []
+    db.remove_user(user_uuid, chunk_size=2, on_chunk=chunks.append)
+    assert chunks == [2, 2, 1, 1]
+    assert db.read_tasks() == {}
+    assert db.read_users() == {}
+    db.close()
+
+
+def test_versioned_writes_never_lose_updates(tmp_path):
+    path = str(tmp_path / 'tasks.sqlite3')
+    create_database(path).close()
+    db = DBSession(partial(SQLiteConnection, path))
+    uuid_ = db.create_task(Task(description='counter'))
+
+    def increment(_):
+        db = DBSession(partial(SQLiteConnection, path))
+        try:
+            while True:
+                task, version = db.read_task(uuid_, with_version=True)
+                try:
+                    db.replace_task(uuid_, task.copy(update={'priority': task.priority + 1}), version=version)
+                    return
+                except VersionConflict:
+                    pass
+        finally:
+            db.close()
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(increment, range(40)))
+
+    task, version = db.read_task(uuid_, with_version=True)
+    assert (task.priority, version) == (40, 41)
+    with pytest.raises(VersionConflict):
+        db.replace_task(uuid_, task, version=1)
+    db.close()
+
+
+def test_completed_tasks_are_archived(tmp_path):
+    path = str(tmp_path / 'tasks.sqlite3')
+    create_database(path).close()
+    db = DBSession(partial(SQLiteConnection, path))
+    user_uuid = str(db.create_user(User(name='foo')))
+    old = db.create_task(Task(description='old', completed=True, user_uuid=user_uuid, due_date='2023-02-01'))
+    recent = db.create_task(Task(description='recent', completed=True, user_uuid=user_uuid, due_date='2023-01-01'))
+    db.create_task(Task(description='open', user_uuid=user_uuid))
+    reopened = db.create_task(Task(description='reopened', completed=True, user_uuid=user_uuid))
+    with db.connection.cursor() as cursor:
+        cursor.execute(
+            "UPDATE tasks SET completed_at = '2000-01-01 00:00:00' WHERE uuid IN (%s, %s)",
+            (to_bin(old), to_bin(reopened)),
+        )
+    db.connection.commit()
+    db.alter_task(reopened, Task(completed=False))
+
+    assert db.archive_tasks(after_days=30, chunk_size=1) == 1
+    assert {task.description for task in db.read_tasks().values()} == {'recent', 'open', 'reopened'}
+    archived = db.read_tasks(completed=True, fields=('description', ), sort='due_date', include_archived=True)
+    assert [task.description for task in archived.values()] == ['recent', 'old']
+    assert len(db.read_tasks(completed=False, include_archived=True)) == 2
+
+    # Completing the task again restarts its clock.
+    db.alter_task(reopened, Task(completed=True))
+    assert db.archive_tasks(after_days=30) == 0
+    assert db.archive_tasks(after_days=0) == 2
+
+    db.remove_user(user_uuid)
+    assert db.read_tasks(include_archived=True) == {}
+    db.close()
+
+
+def test_task_changes_are_read_since_a_time(tmp_path):
+    path = str(tmp_path / 'tasks.sqlite3')
+    create_database(path).close()
+    db = DBSession(partial(SQLiteConnection, path))
+    alice = str(db.create_user(User(name='alice')))
+    bob = str(db.create_user(User(name='bob')))
+    kept = db.create_task(Task(description='kept', user_uuid=alice))
+    changed = db.create_task(Task(description='changed', user_uuid=alice))
+    removed = db.create_task(Task(description='removed', user_uuid=alice))
+    moved = db.create_task(Task(description='moved', user_uuid=alice))
+    tasks, deleted = db.read_task_changes(None, user_uuid=alice)
+    assert len(tasks) == 4 and deleted == []
+
+    time.sleep(0.01)
+    since = utc_now()
+    db.alter_task(changed, Task(completed=True))
+    db.remove_task(removed)
+    db.alter_task(moved, Task(user_uuid=bob))
+
+    tasks, deleted = db.read_task_changes(since, fields=('description', ), user_uuid=alice)
+    assert tasks == {str(changed): Task(description='changed')}
+    assert deleted == sorted([str(removed), str(moved)])
+    # Without a user filter the moved task is a change, not a delete.
+    tasks, deleted = db.read_task_changes(since)
+    assert set(tasks) == {str(changed), str(moved)}
+    assert deleted == [str(removed)]
+
+    # A failed write leaves no tombstone behind.
+    with pytest.raises(VersionConflict):
+        db.replace_task(kept, Task(user_uuid=bob), version=5)
+    assert db.read_task_changes(since, user_uuid=alice)[1] == sorted([str(removed), str(moved)])
+
+    db.remove_user(alice)
+    everything = sorted([str(kept), str(changed), str(removed), str(moved)])
+    assert db.read_task_changes(since, user_uuid=alice)[1] == everything
+    assert db.purge_tombstones(utc_now()) == 4
+    assert db.read_task_changes(since) == ({str(moved): db.read_task(moved)}, [])
+    db.close()
+
+
+def test_task_changes_reads_use_an_index(tmp_path):
+    connection = create_database(str(tmp_path / 'plan.sqlite3'))
+    for query in (
+            'SELECT uuid FROM tasks WHERE user_uuid = ? AND updated_at > ?',
+            'SELECT DISTINCT uuid FROM task_tombstones WHERE user_uuid = ? AND deleted_at > ?',
+    ):
+        plan = ' '.join(row[-1] for row in connection.execute(
+            f'EXPLAIN QUERY PLAN {query}',
+            (to_bin(uuid.uuid4()), '2023-01-01 00:00:00'),
+        ))
+        assert '_user_updated_at (user_uuid=? AND updated_at>?)' in plan \
+            or '_user_deleted_at (user_uuid=? AND deleted_at>?)' in plan
+
+
+def test_statements_stop_at_the_deadline(tmp_path):
+    path = str(tmp_path / 'tasks.sqlite3')
+    create_database(path).close()
+    endless = 'WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) SELECT COUNT(*) FROM n'
+    connection = SQLiteConnection(path)
+    connection.set_deadline(time.monotonic() + 0.05)
+    with pytest.raises(sqlite3.OperationalError) as raised:
+        with connection.cursor() as cursor:
+            cursor.execute(endless)
+    assert is_timeout(raised.value)
+    connection.set_deadline(None)
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT COUNT(*) FROM tasks')
+        assert cursor.fetchone() == (0, )
+    connection.close()
+
+    # Nothing is sent once the time is up.
+    db = DBSession(partial(SQLiteConnection, path), deadline=time.monotonic())
+    with pytest.raises(QueryTimeout):
+        db.read_tasks()
+    db.close()
+
+    query = limit_select('\n    SELECT uuid FROM tasks UNION ALL SELECT uuid FROM tasks_archive', time.monotonic() + 2)
+    assert query.startswith('SELECT /*+ MAX_EXECUTION_TIME(')
+    assert query.count('MAX_EXECUTION_TIME') == 1
+
+
+def test_name_keys_follow_the_collations():
+    assert nocase_key('ÉVA ana') == 'Éva ana'
+    assert general_ci_key('Éva') == general_ci_key('eva') == 'EVA'
+    assert sorted(['éclair', 'Bob', 'Éva', 'zoe'], key=nocase_key) == ['Bob', 'zoe', 'Éva', 'éclair']
+    assert sorted(['éclair', 'Bob', 'Éva', 'zoe'], key=general_ci_key) == ['Bob', 'éclair', 'Éva', 'zoe']
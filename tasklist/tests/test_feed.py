@@ -0,0 +1,71 @@
+# pylint: disable=missing-module-docstring,missing-function-docstring
+import asyncio
+
+from tasklist.feed import ChangeFeed
+
+
+async def collect(feed, count, **kwargs):
+    events = []
+    async for event in feed.subscribe(**kwargs):
+        events.append(event)
+        if len(events) == count:
+            return events
+    return events
+
+
+def test_subscribers_receive_published_events():
+    async def scenario():
+        feed = ChangeFeed()
+        subscribers = [asyncio.create_task(collect(feed, 2)) for _ in range(100)]
+        await asyncio.sleep(0)
+        feed.publish('task', 'create', 'a', 'u1')
+        feed.publish('task', 'delete', 'a', 'u1')
+        return await asyncio.gather(*subscribers)
+
+    for events in asyncio.run(scenario()):
+        assert [event['action'] for event in events] == ['create', 'delete']
+
+
+def test_subscribe_filters_by_user():
+    async def scenario():
+        feed = ChangeFeed()
+        subscriber = asyncio.create_task(collect(feed, 2, user_uuid='u2'))
+        await asyncio.sleep(0)
+        feed.publish('task', 'create', 'a', 'u1')
+        feed.publish('task', 'create', 'b', 'u2')
+        feed.publish('task', 'clear')
+        return await subscriber
+
+    events = asyncio.run(scenario())
+    assert [(event['uuid'], event['action']) for event in events] == [
+        ('b', 'create'),
+        (None, 'clear'),
+    ]
+
+
+def test_subscribe_resumes_from_sequence():
+    async def scenario():
+        feed = ChangeFeed()
+        for name in 'abc':
+            feed.publish('task', 'create', name)
+        return await collect(feed, 2, sequence=1)
+
+    events = asyncio.run(scenario())
+    assert [event['uuid'] for event in events] == ['b', 'c']
+
+
+def test_old_sequences_fall_out_of_history():
+    feed = ChangeFeed(history=2)
+    for name in 'abc':
+        feed.publish('task', 'create', name)
+    assert not feed.is_available(0)
+    assert feed.is_available(1)
+    assert [event['uuid'] for event in feed.since(1)] == ['b', 'c']
+
+    # The history is a ring that the events wrap around.
+    for name in 'defg':
+        feed.publish('task', 'create', name)
+    assert [event['uuid'] for event in feed.since(5)] == ['f', 'g']
+    assert [event['uuid'] for event in feed.since(6)] == ['g']
+    assert [event['uuid'] for event in feed.since(0)] == ['f', 'g']
+    assert feed.since(7) == []
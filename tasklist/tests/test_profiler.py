@@ -0,0 +1,58 @@
+# pylint: disable=missing-module-docstring,missing-function-docstring
+import threading
+import types
+
+from fastapi.testclient import TestClient
+
+from tasklist.main import app
+from tasklist.profiler import label
+
+client = TestClient(app)
+
+
+def test_profile_needs_the_token(tmp_path, app_config):
+    app_config()
+    assert client.get('/debug/profile?seconds=0.01').status_code == 404
+
+    app_config({'profiler': {'token': 'secret'}}, directory=tmp_path / 'enabled')
+    assert client.get('/debug/profile?seconds=0.01').status_code == 401
+    response = client.get(
+        '/debug/profile?seconds=0.01',
+        headers={'Authorization': 'Bearer wrong'},
+    )
+    assert response.status_code == 403
+
+
+def test_profile_breaks_time_down_by_route(app_config):
+    app_config({'profiler': {'token': 'secret', 'interval': 0.001}})
+    for index in range(50):
+        client.post('/task', json={'description': f'task {index}'})
+    profiling = threading.Event()
+    responses = []
+
+    def profile():
+        profiling.set()
+        responses.append(client.get(
+            '/debug/profile?seconds=1',
+            headers={'Authorization': 'Bearer secret'},
+        ))
+
+    thread = threading.Thread(target=profile)
+    thread.start()
+    profiling.wait()
+    while thread.is_alive():
+        client.get('/task')
+    thread.join()
+
+    profile = responses[0].json()
+    assert profile['samples'] > 0
+    assert any('read_tasks' in stack for stack in profile['collapsed'])
+    route = profile['routes']['GET /task']
+    assert route['total'] > 0
+    assert set(route) <= {'db', 'validation', 'json', 'other', 'total'}
+
+
+def test_labels_fall_back_to_the_plain_name():
+    # Code objects before Python 3.11 have no co_qualname.
+    code = types.SimpleNamespace(co_name='read', co_filename='/app/db.py', co_firstlineno=3)
+    assert label(code) == 'read (db.py:3)'
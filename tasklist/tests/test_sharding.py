@@ -0,0 +1,289 @@
+# pylint: disable=missing-module-docstring,missing-function-docstring
+import json
+import os.path
+import shutil
+import sqlite3
+import time
+import uuid
+
+import pytest
+
+from fastapi.testclient import TestClient
+
+from utils import utils
+
+from tasklist.feed import feed
+from tasklist.main import app
+from tasklist.sharding import create_shard_map, move_user
+
+client = TestClient(app)
+
+
+def sharded_config_filename():
+    return os.path.join(
+        os.path.dirname(utils.get_config_test_filename()),
+        'config_test_sharded.json',
+    )
+
+
+@pytest.fixture
+def sharded_config(app_config):
+    # A copy, so the SQLite shards and the shard overrides stay in tmp_path.
+    return app_config(copy_of=sharded_config_filename())
+
+
+# Enough users that all of them landing on one shard is unlikely.
+SPREAD_USERS = 32
+
+
+def create_users(count):
+    uuids = []
+    for index in range(count):
+        response = client.post('/user', json={'name': f'user {index}'})
+        assert response.status_code == 200
+        uuids.append(response.json())
+    return uuids
+
+
+def test_users_and_tasks_are_spread_over_shards(sharded_config):
+    shard_map = create_shard_map(sharded_config, None)
+    user_uuids = create_users(SPREAD_USERS)
+    assert {shard_map.index_for(user_uuid) for user_uuid in user_uuids} == {0, 1}
+
+    task_uuids = {}
+    for user_uuid in user_uuids:
+        task = {
+            'description': 'foo',
+            'completed': False,
+            'user_uuid': user_uuid,
+            'priority': 0,
+            'due_date': None,
+        }
+        response = client.post('/task', json=task)
+        assert response.status_code == 200
+        task_uuids[response.json()] = task
+
+    response = client.get('/user')
+    assert response.status_code == 200
+    assert len(response.json()) == SPREAD_USERS
+
+    response = client.get('/task')
+    assert response.status_code == 200
+    assert response.json() == task_uuids
+
+    for uuid_, task in task_uuids.items():
+        response = client.get(f'/task/{uuid_}')
+        assert response.status_code == 200
+        assert response.json() == task
+
+    response = client.get('/task/3668e9c9-df18-4ce2-9bb2-82f907cf110c')
+    assert response.status_code == 404
+
+
+def test_task_follows_its_user_to_another_shard(sharded_config):
+    shard_map = create_shard_map(sharded_config, None)
+    user_uuids = create_users(SPREAD_USERS)
+    first = user_uuids[0]
+    other = next(
+        user_uuid for user_uuid in user_uuids
+        if shard_map.index_for(user_uuid) != shard_map.index_for(first)
+    )
+
+    response = client.post('/task', json={'description': 'foo', 'user_uuid': first})
+    uuid_ = response.json()
+
+    response = client.patch(f'/task/{uuid_}', json={'user_uuid': other})
+    assert response.status_code == 200
+    response = client.get(f'/task/{uuid_}')
+    assert response.json() == {
+        'description': 'foo',
+        'completed': False,
+        'user_uuid': other,
+        'priority': 0,
+        'due_date': None,
+    }
+    assert len(client.get('/task').json()) == 1
+
+    # Deleting the user cascades to the task on its shard.
+    response = client.delete(f'/user/{other}')
+    assert response.status_code == 202
+    while client.get(response.headers['location']).json()['status'] == 'running':
+        time.sleep(0.05)
+    response = client.get(f'/task/{uuid_}')
+    assert response.status_code == 404
+
+
+def test_task_moved_to_another_shard_is_one_feed_event(sharded_config):
+    shard_map = create_shard_map(sharded_config, None)
+    user_uuids = create_users(SPREAD_USERS)
+    first = user_uuids[0]
+    other = next(
+        user_uuid for user_uuid in user_uuids
+        if shard_map.index_for(user_uuid) != shard_map.index_for(first)
+    )
+    uuid_ = client.post('/task', json={'description': 'foo', 'user_uuid': first, 'completed': True}).json()
+
+    def times(user_uuid):
+        connection = sqlite3.connect(shard_map.shards[shard_map.index_for(user_uuid)].backend.path)
+        try:
+            return connection.execute(
+                'SELECT created_at, completed_at FROM tasks WHERE uuid = ?',
+                (uuid.UUID(uuid_).bytes, ),
+            ).fetchone()
+        finally:
+            connection.close()
+
+    before = times(first)
+    sequence = feed.sequence
+    response = client.patch(f'/task/{uuid_}', json={'user_uuid': other})
+    assert response.status_code == 200
+    events = feed.since(sequence)
+    assert [(event['action'], event['uuid'], event['user_uuid']) for event in events] == [
+        ('patch', uuid_, other),
+    ]
+    assert events[0]['item']['description'] == 'foo'
+    assert times(other) == before
+
+def test_sorted_reads_are_merged_across_shards(sharded_config):
+    user_uuids = create_users(8)
+    for day, user_uuid in enumerate(user_uuids, start=1):
+        task = {'description': str(day), 'user_uuid': user_uuid, 'due_date': f'2023-01-{day:02}'}
+        response = client.post('/task', json=task)
+        assert response.status_code == 200
+
+    response = client.get('/task?sort=-due_date&limit=5&fields=description')
+    assert response.status_code == 200
+    assert list(response.json().values()) == [
+        {'description': str(day)} for day in (8, 7, 6, 5, 4)
+    ]
+
+
+def test_lookup_users_across_shards(sharded_config):
+    user_uuids = create_users(8)
+    missing = '3668e9c9-df18-4ce2-9bb2-82f907cf110c'
+    response = client.post('/user/lookup', json={'uuids': user_uuids + [missing]})
+    assert response.status_code == 200
+    assert list(response.json()['found']) == user_uuids
+    assert response.json()['missing'] == [missing]
+
+
+def test_user_pages_are_merged_across_shards(sharded_config):
+    names = ['b', 'A', 'c', 'D', 'e', 'F', 'g', 'h']
+    for name in names:
+        client.post('/user', json={'name': name})
+
+    found = []
+    response = client.get('/user?limit=3&fields=name')
+    while True:
+        found += [user['name'] for user in response.json().values()]
+        if 'x-next-cursor' not in response.headers:
+            break
+        response = client.get(f'/user?limit=3&fields=name&after={response.headers["x-next-cursor"]}')
+    assert found == sorted(names, key=str.lower)
+
+
+def test_non_ascii_user_pages_are_merged_in_collation_order(sharded_config):
+    shard_map = create_shard_map(sharded_config, None)
+    rows = []
+    for shard, names in ((0, ['Éva', 'ébano', 'Émile']), (1, ['éclair', 'Bob', 'Zoe'])):
+        for name in names:
+            user_uuid = str(uuid.uuid4())
+            while shard_map.index_for(user_uuid) != shard:
+                user_uuid = str(uuid.uuid4())
+            rows.append(json.dumps({'uuid': user_uuid, 'name': name}))
+    response = client.post('/user/import', content='\n'.join(rows))
+    assert response.json() == {'imported': 6}
+
+    found = []
+    response = client.get('/user?limit=1&fields=name')
+    while True:
+        found += [user['name'] for user in response.json().values()]
+        if 'x-next-cursor' not in response.headers:
+            break
+        response = client.get(f'/user?limit=1&fields=name&after={response.headers["x-next-cursor"]}')
+    # SQLite's NOCASE folds ASCII letters only.
+    assert found == ['Bob', 'Zoe', 'Émile', 'Éva', 'ébano', 'éclair']
+    response = client.get('/user?name_prefix=%C3%89&fields=name')
+    assert [user['name'] for user in response.json().values()] == ['Émile', 'Éva']
+
+
+def test_import_failures_are_reported_by_input_row(sharded_config):
+    shard_map = create_shard_map(sharded_config, None)
+    users = []
+    for shard in (1, 0, 1):
+        user_uuid = str(uuid.uuid4())
+        while shard_map.index_for(user_uuid) != shard:
+            user_uuid = str(uuid.uuid4())
+        users.append(user_uuid)
+    rows = [json.dumps({'uuid': user_uuid, 'name': 'Ana'}) for user_uuid in users + users[:1]]
+    response = client.post('/user/import', content='\n'.join(rows))
+    assert response.status_code == 422
+    detail = response.json()['detail']
+    # Shard 0 loads its user first; shard 1 fails on the duplicate.
+    assert detail.startswith('Row 4: ') and detail.endswith('(1 rows imported)')
+
+def test_move_user_between_shards(sharded_config):
+    user_uuid = create_users(1)[0]
+    response = client.post('/task', json={'description': 'foo', 'user_uuid': user_uuid})
+    task_uuid = response.json()
+
+    source = create_shard_map(sharded_config, None).index_for(user_uuid)
+    assert move_user(sharded_config, None, user_uuid, 1 - source) == 1
+
+    with open(sharded_config, 'r') as file:
+        assert json.load(file)['shard_overrides'] == {user_uuid: 1 - source}
+
+    # The cached shard map is only reloaded on restart.
+    app.dependency_overrides[utils.get_config_filename] = lambda: sharded_config + '.moved'
+    shutil.copy(sharded_config, sharded_config + '.moved')
+    response = client.get(f'/user/{user_uuid}')
+    assert response.status_code == 200
+    response = client.get(f'/task/{task_uuid}')
+    assert response.json()['user_uuid'] == user_uuid
+    assert len(client.get('/user').json()) == 1
+
+
+def test_writes_to_a_moving_user_wait_for_the_move(sharded_config, monkeypatch):
+    user_uuid = create_users(1)[0]
+    shard_map = create_shard_map(sharded_config, None)
+    source = shard_map.index_for(user_uuid)
+    blocked = []
+    dump = json.dump
+
+    def write_during_move(config, file, **kwargs):
+        # Another worker, still on the old shard map, adds a task.
+        connection = sqlite3.connect(shard_map.shards[source].backend.path, timeout=0.05)
+        try:
+            connection.execute(
+                'INSERT INTO tasks (uuid, description, user_uuid) VALUES (?, ?, ?)',
+                (uuid.uuid4().bytes, 'late', uuid.UUID(user_uuid).bytes),
+            )
+        except sqlite3.OperationalError as exception:
+            blocked.append(str(exception))
+        finally:
+            connection.close()
+        dump(config, file, **kwargs)
+
+    monkeypatch.setattr(json, 'dump', write_during_move)
+    assert move_user(sharded_config, None, user_uuid, 1 - source) == 0
+    assert blocked == ['database is locked']
+
+def test_batches_span_shards(sharded_config):
+    users = SPREAD_USERS
+    operations = [{'op': 'create', 'kind': 'user', 'item': {'name': f'user {index}'}} for index in range(users)]
+    operations += [
+        {'op': 'create', 'kind': 'task', 'item': {'user_uuid': f'${index}'}} for index in range(users)
+    ]
+    response = client.post('/batch', json={'atomic': True, 'operations': operations + [
+        {'op': 'delete', 'kind': 'task', 'uuid': '3668e9c9-df18-4ce2-9bb2-82f907cf110c'},
+    ]})
+    assert not response.json()['committed']
+    assert client.get('/user').json() == {}
+    assert client.get('/task').json() == {}
+
+    response = client.post('/batch', json={'operations': operations})
+    assert response.json()['committed']
+    shard_map = create_shard_map(sharded_config, None)
+    user_uuids = [result['uuid'] for result in response.json()['results'][:users]]
+    assert {shard_map.index_for(user_uuid) for user_uuid in user_uuids} == {0, 1}
+    assert len(client.get('/task').json()) == users
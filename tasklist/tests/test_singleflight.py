@@ -0,0 +1,217 @@
+# pylint: disable=missing-module-docstring,missing-function-docstring
+import os.path
+import sqlite3
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import pytest
+
+from tasklist.backends import QueryTimeout, SQLiteConnection
+from tasklist.database import DBSession
+from tasklist.models import Task
+from tasklist.singleflight import SingleFlight
+
+SQLITE_MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), '..', 'database', 'migrations', 'sqlite')
+
+
+def wait_until(condition):
+    for _ in range(200):
+        if condition():
+            return
+        time.sleep(0.01)
+    raise AssertionError('Condition not reached')
+
+
+def test_concurrent_calls_share_one_execution():
+    flights = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def call():
+        calls.append(1)
+        release.wait()
+        return {'a': 1}
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [executor.submit(flights.do, 'key', 'task', None, call) for _ in range(4)]
+        wait_until(lambda: flights.shared == 3)
+        release.set()
+        results = [future.result() for future in futures]
+
+    assert results == [{'a': 1}] * 4
+    assert calls == [1]
+    assert flights.stats() == {'executed': 1, 'shared': 3}
+    # Nothing is kept once the call has returned.
+    assert flights.do('key', 'task', None, lambda: 'again') == 'again'
+
+
+def test_waiters_get_the_error():
+    flights = SingleFlight()
+    release = threading.Event()
+
+    def call():
+        release.wait()
+        raise KeyError()
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [executor.submit(flights.do, 'key', 'task', b'1', call) for _ in range(2)]
+        wait_until(lambda: flights.shared == 1)
+        release.set()
+        for future in futures:
+            with pytest.raises(KeyError):
+                future.result()
+
+
+def test_waiters_are_bound_by_their_own_limits():
+    flights = SingleFlight()
+    release = threading.Event()
+
+    def call():
+        release.wait()
+        raise TimeoutError()
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        leader = executor.submit(flights.do, 'key', 'task', None, call)
+        wait_until(lambda: flights.executed == 1)
+        # Out of time before the first call returns: it runs its own call.
+        assert flights.do('key', 'task', None, lambda: 'own', timeout=0.01) == 'own'
+        retried = executor.submit(
+            flights.do, 'key', 'task', None, lambda: 'retried', retry=lambda error: isinstance(error, TimeoutError)
+        )
+        failed = executor.submit(flights.do, 'key', 'task', None, lambda: 'retried')
+        wait_until(lambda: flights.shared == 3)
+        release.set()
+        assert retried.result() == 'retried'
+        for future in (leader, failed):
+            with pytest.raises(TimeoutError):
+                future.result()
+
+
+def test_writes_detach_the_reads_they_change():
+    flights = SingleFlight()
+    release = threading.Event()
+
+    def blocked(value):
+        release.wait()
+        return value
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        point = executor.submit(flights.do, 'point', 'task', b'1', partial(blocked, 'old'))
+        table = executor.submit(flights.do, 'table', 'task', None, partial(blocked, 'old'))
+        wait_until(lambda: flights.executed == 2)
+
+        # Another row: the point read is still shared, the table read is not.
+        flights.invalidate('task', b'2')
+        assert flights.do('table', 'task', None, lambda: 'new') == 'new'
+        joined = executor.submit(flights.do, 'point', 'task', b'1', lambda: 'new')
+        wait_until(lambda: flights.shared == 1)
+
+        flights.invalidate('task', b'1')
+        assert flights.do('point', 'task', b'1', lambda: 'new') == 'new'
+        release.set()
+        assert (point.result(), table.result(), joined.result()) == ('old', 'old', 'old')
+
+
+def test_sessions_share_reads_until_a_write(tmp_path):
+    path = str(tmp_path / 'tasks.sqlite3')
+    connection = sqlite3.connect(path)
+    for filename in sorted(os.listdir(SQLITE_MIGRATIONS_DIR)):
+        with open(os.path.join(SQLITE_MIGRATIONS_DIR, filename), 'r') as file:
+            connection.executescript(file.read())
+    connection.close()
+
+    flights = SingleFlight()
+    writer = DBSession(partial(SQLiteConnection, path), single_flight=flights)
+    uuid_ = writer.create_task(Task(description='old'))
+
+    gate = threading.Event()
+    opened = []
+
+    def connect():
+        # The first reader's connection is slow to open.
+        opened.append(1)
+        if len(opened) == 1:
+            gate.wait()
+        return SQLiteConnection(path)
+
+    def read(_):
+        session = DBSession(connect, single_flight=flights)
+        try:
+            return session.read_task(uuid_).description
+        finally:
+            session.close()
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        readers = [executor.submit(read, index) for index in range(3)]
+        wait_until(lambda: flights.shared == 2)
+
+        writer.replace_task(uuid_, Task(description='new'))
+        assert read(3) == 'new'
+        gate.set()
+        assert len({reader.result() for reader in readers}) == 1
+
+    # The readers that joined never opened a connection.
+    assert len(opened) == 2
+    assert flights.stats() == {'executed': 2, 'shared': 2}
+    writer.close()
+
+
+def test_shared_reads_run_under_each_deadline(tmp_path):
+    path = str(tmp_path / 'tasks.sqlite3')
+    connection = sqlite3.connect(path)
+    for filename in sorted(os.listdir(SQLITE_MIGRATIONS_DIR)):
+        with open(os.path.join(SQLITE_MIGRATIONS_DIR, filename), 'r') as file:
+            connection.executescript(file.read())
+    connection.close()
+
+    flights = SingleFlight()
+    writer = DBSession(partial(SQLiteConnection, path), single_flight=flights)
+    uuid_ = writer.create_task(Task(description='task'))
+    gate = threading.Event()
+    slow = []
+
+    def connect():
+        # The connection of the reader that starts the shared read is slow
+        # to open.
+        if slow:
+            slow.pop()
+            gate.wait()
+        return SQLiteConnection(path)
+
+    def read(deadline=None):
+        session = DBSession(connect, single_flight=flights, deadline=deadline)
+        try:
+            return session.read_task(uuid_).description
+        finally:
+            session.close()
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        # The first reader runs out of time; the one that joined it has time
+        # left and reads the task itself.
+        slow.append(1)
+        leader = executor.submit(read, time.monotonic() + 0.1)
+        wait_until(lambda: flights.executed == 1)
+        follower = executor.submit(read)
+        wait_until(lambda: flights.shared == 1)
+        time.sleep(0.2)
+        gate.set()
+        with pytest.raises(QueryTimeout):
+            leader.result()
+        assert follower.result() == 'task'
+
+        # A reader with less time than the one it joined stops at its own
+        # deadline.
+        gate.clear()
+        slow.append(1)
+        leader = executor.submit(read)
+        wait_until(lambda: flights.executed == 2)
+        started = time.monotonic()
+        with pytest.raises(QueryTimeout):
+            read(time.monotonic() + 0.1)
+        assert time.monotonic() - started < 1
+        gate.set()
+        assert leader.result() == 'task'
+    writer.close()
@@ -0,0 +1,203 @@
+# pylint: disable=missing-module-docstring,missing-function-docstring
+import threading
+import uuid
+
+import pytest
+
+from fastapi.testclient import TestClient
+
+from utils import utils
+
+from tasklist.backends import SQLiteConnection
+from tasklist.database import DBSession, get_backend, get_write_behind
+from tasklist.main import app
+from tasklist.models import Task, User
+from tasklist.writebehind import WriteBehindCache, WriteBehindFull, WriteLog
+
+client = TestClient(app)
+
+WRITE_BEHIND = {'log_dir': 'log'}
+
+
+def create_cache(tmp_path, flush=None, **kwargs):
+    path = str(tmp_path / 'tasklist.sqlite3')
+
+    def in_session(call):
+        session = DBSession(lambda: SQLiteConnection(path))
+        try:
+            return call(session)
+        finally:
+            session.close()
+
+    cache = WriteBehindCache(
+        WriteLog(str(tmp_path / 'log')),
+        load=lambda: in_session(lambda session: session.read_rows()),
+        flush=flush or (lambda rows: in_session(lambda session: session.write_rows(rows))),
+        flush_interval=3600,
+        **kwargs,
+    )
+    cache.start()
+    return cache, in_session
+
+
+def test_writes_are_served_from_memory_and_flushed(app_config):
+    config_file_name = app_config({'write_behind': {**WRITE_BEHIND, 'flush_interval': 3600}})
+    user_uuid = client.post('/user', json={'name': 'Ana'}).json()
+    task_uuid = client.post('/task', json={'description': 'a', 'user_uuid': user_uuid}).json()
+    response = client.put(
+        f'/task/{task_uuid}',
+        json={'description': 'b', 'user_uuid': user_uuid},
+        headers={'If-Match': '"1"'},
+    )
+    assert response.headers['etag'] == '"2"'
+    assert client.get(f'/task/{task_uuid}').json()['description'] == 'b'
+    assert client.get('/metrics').json()['write_behind']['pending'] == 2
+
+    cache = get_write_behind(
+        config_file_name=config_file_name,
+        backend=get_backend(
+            config_file_name=config_file_name,
+            secrets_file_name=utils.get_app_secrets_filename(),
+        ),
+    )
+    session = DBSession(get_backend(
+        config_file_name=config_file_name,
+        secrets_file_name=utils.get_app_secrets_filename(),
+    ).connect)
+    assert session.read_tasks() == {}
+
+    assert cache.flush() == 2
+    assert session.read_task(task_uuid, with_version=True) == \
+        (Task(description='b', completed=False, user_uuid=user_uuid, priority=0, due_date=None), 2)
+
+    client.patch(f'/task/{task_uuid}', json={'completed': True})
+    assert cache.flush() == 1
+    assert session.read_task(task_uuid, fields=('completed', ), with_version=True) == \
+        (Task(completed=True), 3)
+    session.close()
+    cache.stop()
+
+
+def test_unflushed_writes_are_replayed_after_a_crash(tmp_path, app_config):
+    app_config({'write_behind': WRITE_BEHIND})
+    cache, _ = create_cache(tmp_path)
+    ana, bia = str(uuid.uuid4()), str(uuid.uuid4())
+    with cache.writing():
+        cache.write('users', ana, User(name='Ana'), 1)
+        cache.write('users', bia, User(name='Bia'), 1)
+        cache.write('users', ana, User(name='Ana Maria'), 2)
+        cache.write('users', bia, None, None)
+    # The process dies here, without flushing.
+    cache.log.close()
+
+    cache, in_session = create_cache(tmp_path)
+    assert cache.users == {ana: (User(name='Ana Maria'), 2)}
+    assert in_session(lambda session: session.read_users()) == {ana: User(name='Ana Maria')}
+    assert cache.log.segments() == [max(cache.log.segments())]
+
+
+def test_users_are_flushed_before_the_tasks_that_refer_to_them(tmp_path, app_config):
+    app_config({'write_behind': WRITE_BEHIND})
+    cache, in_session = create_cache(tmp_path, max_batch=1)
+    task_uuid, user_uuid, gone = str(uuid.uuid4()), str(uuid.uuid4()), str(uuid.uuid4())
+    with cache.writing():
+        cache.write('users', gone, User(name='Bia'), 1)
+    assert cache.flush() == 1
+    with cache.writing():
+        cache.write('tasks', task_uuid, Task(description='a', user_uuid=gone), 1)
+        cache.write('users', gone, None, None)
+        cache.write('users', user_uuid, User(name='Ana'), 1)
+        cache.write('tasks', task_uuid, Task(description='a', user_uuid=user_uuid), 2)
+    # The same order on replay after a crash.
+    cache.log.close()
+    cache, in_session = create_cache(tmp_path, max_batch=1)
+    assert cache.pending == 0
+    assert in_session(lambda session: session.read_users()) == {user_uuid: User(name='Ana')}
+    assert in_session(lambda session: session.read_task(task_uuid, fields=('user_uuid', ))) == \
+        Task(user_uuid=user_uuid)
+
+    with cache.writing():
+        cache.write('tasks', task_uuid, Task(description='b'), 3)
+        cache.write('users', str(uuid.uuid4()), User(name='Caio'), 1)
+    assert cache.flush() == 2
+
+
+def test_flushed_tasks_keep_completion_and_creation_times(tmp_path, app_config):
+    app_config({'write_behind': WRITE_BEHIND})
+    cache, _ = create_cache(tmp_path)
+    done, todo = str(uuid.uuid4()), str(uuid.uuid4())
+    with cache.writing():
+        cache.write('tasks', done, Task(description='a', completed=True), 1)
+        cache.write('tasks', todo, Task(description='b'), 1)
+    assert cache.flush() == 2
+
+    def times():
+        connection = SQLiteConnection(str(tmp_path / 'tasklist.sqlite3'))
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT description, completed_at, created_at FROM tasks ORDER BY description')
+                return cursor.fetchall()
+        finally:
+            connection.close()
+
+    (_, completed_at, created_at), (_, not_completed, _) = times()
+    assert completed_at is not None and created_at is not None and not_completed is None
+
+    # Rewriting a completed task keeps its completion time; reopening clears it.
+    with cache.writing():
+        cache.write('tasks', done, Task(description='c', completed=True), 2)
+        cache.write('tasks', todo, Task(description='d', completed=True), 2)
+    assert cache.flush() == 2
+    (_, kept, _), (_, now_done, _) = times()
+    assert kept == completed_at and now_done is not None
+    with cache.writing():
+        cache.write('tasks', done, Task(description='c'), 3)
+    assert cache.flush() == 1
+    assert times()[0][1] is None
+    assert times()[0][2] == created_at
+
+def test_writers_wait_for_a_slow_database(tmp_path, app_config):
+    app_config({'write_behind': WRITE_BEHIND})
+    flushing = threading.Event()
+    cache, in_session = create_cache(
+        tmp_path,
+        flush=lambda rows: flushing.wait(),
+        max_pending=2,
+        backpressure_timeout=0.05,
+    )
+    for name in ('a', 'b'):
+        with cache.writing():
+            cache.write('users', str(uuid.uuid4()), User(name=name), 1)
+    with pytest.raises(WriteBehindFull):
+        with cache.writing():
+            pass
+
+    flushing.set()
+    assert cache.flush() == 2
+    with cache.writing():
+        cache.write('users', str(uuid.uuid4()), User(name='c'), 1)
+    assert cache.pending == 1
+    assert in_session(lambda session: session.read_users()) == {}
+
+
+def test_failed_flush_keeps_newer_writes(tmp_path, app_config):
+    app_config({'write_behind': WRITE_BEHIND})
+
+    def fail(rows):
+        raise RuntimeError('database down')
+
+    cache, _ = create_cache(tmp_path, flush=fail)
+    user_uuid = str(uuid.uuid4())
+    with cache.writing():
+        cache.write('users', user_uuid, User(name='old'), 1)
+    with pytest.raises(RuntimeError):
+        cache.flush()
+    with cache.writing():
+        cache.write('users', user_uuid, User(name='new'), 2)
+    assert cache.pending == 1
+    assert cache.stats()['failed_flushes'] == 1
+
+    # Both writes are still in the log until a flush succeeds.
+    cache.log.close()
+    cache, in_session = create_cache(tmp_path)
+    assert in_session(lambda session: session.read_users()) == {user_uuid: User(name='new')}
@@ -2,6 +2,7 @@
 import json
 import os
 import os.path
+import sqlite3
 
 import mysql.connector as cnt
 
@@ -42,11 +43,52 @@ def get_admin_secrets_filename():
     )
 
 
-def run_script(filename_script, filename_config, filename_secrets):
-    with open(filename_script, 'r') as file:
-        script = file.read()
+def get_sqlite_path(filename_config, config):
+    # Relative SQLite paths are resolved against the config file directory.
+    return os.path.join(
+        os.path.dirname(os.path.abspath(filename_config)),
+        config['database'],
+    )
+
+
+def get_write_behind_log_dir(filename_config, config):
+    # Relative log directories are resolved against the config file directory.
+    return os.path.join(
+        os.path.dirname(os.path.abspath(filename_config)),
+        config['write_behind'].get('log_dir', 'write_behind'),
+    )
+
+
+def get_capture_path(filename_config, config):
+    # Relative capture paths are resolved against the config file directory;
+    # {pid} keeps the files of several workers apart.
+    return os.path.join(
+        os.path.dirname(os.path.abspath(filename_config)),
+        config['capture'].get('path', 'capture-{pid}.ndjson.gz').format(pid=os.getpid()),
+    )
+
+
+def get_shard_configs(config):
+    # Every shard entry overrides the top-level settings (db_host, database).
+    if 'shards' not in config:
+        return [config]
+    return [{**config, **shard} for shard in config['shards']]
+
+
+def is_sqlite(filename_config):
     with open(filename_config, 'r') as file:
         config = json.load(file)
+    return config.get('backend', 'mysql') == 'sqlite'
+
+
+def run_sqlite_script(script, filename_config, config):
+    conn = sqlite3.connect(get_sqlite_path(filename_config, config))
+    conn.executescript(script)
+    conn.commit()
+    conn.close()
+
+
+def run_mysql_script(script, config, filename_secrets):
     with open(filename_secrets, 'r') as file:
         secrets = json.load(file)
     conn = cnt.connect(
@@ -67,7 +109,24 @@ def run_script(filename_script, filename_config, filename_secrets):
     conn.close()
 
 
+def run_script(filename_script, filename_config, filename_secrets):
+    with open(filename_script, 'r') as file:
+        script = file.read()
+    with open(filename_config, 'r') as file:
+        config = json.load(file)
+
+    # Sharded deployments run every migration on every shard.
+    for shard_config in get_shard_configs(config):
+        if shard_config.get('backend', 'mysql') == 'sqlite':
+            run_sqlite_script(script, filename_config, shard_config)
+        else:
+            run_mysql_script(script, shard_config, filename_secrets)
+
+
 def run_all_scripts(scripts_dir, filename_config, filename_secrets):
+    # SQLite has its own dialect of every migration in a subdirectory.
+    if is_sqlite(filename_config):
+        scripts_dir = os.path.join(scripts_dir, 'sqlite')
     filenames = sorted([
         filename for filename in os.listdir(scripts_dir)
         if filename.endswith('.sql')